@@ -1,12 +1,16 @@
 import tkinter as tk
-from nanonisTCPIP import nanonisTCP, FolMe, ZCtrl, Current
+from nanonisTCPIP import nanonisTCP
+from scan_engine import RasterScan, NanonisStage, NanonisDetector, PicoHarpDetector, StreamingPicoHarpDetector, PixelClockDetector, FlimDetector, LineResult, pixel_grid
+from flim import lifetime_map, FLIM_METHODS
 from tkinter import font as tkFont
 from tkinter import ttk, filedialog, messagebox
 import numpy as np
-import math
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-from fitting_methods import twoDfittings
+from fitting_methods import twoDfittings, IncrementalSurfaceFit
+from render_scheduler import RenderScheduler
+from ui_bridge import UIBridge
+from autoscale import AutoScale, AUTOSCALE_MODES
 from matplotlib.colors import Normalize
 from thorlabs_control import KDC101Controller
 from stepper_motor import NDFilterGUI
@@ -49,11 +53,16 @@ class IntensityMapGUI:
         self.nanonis_thread = None
         self.nanonis_connected = None
         self.nanonis_running = False
+        self.pipeline_depth = 8  # Outstanding Nanonis requests while averaging a pixel
+        self.scan = None         # RasterScan of the running scan
         
         self.sock = None
         self.picoharp_connected = None
         self.picoharp_running = False
 
+        self.ui = UIBridge(self.root)  # Worker threads post GUI updates here
+        self.ui.start()
+
         self.setup_fonts()
         self.setup_variables()
         #self.setup_plot()
@@ -83,7 +92,7 @@ class IntensityMapGUI:
         # Build tabs
         self.create_scan_tab()
         self.create_polarization_tab()
-        nd_gui = NDFilterGUI(self.ndfilter_tab)
+        nd_gui = NDFilterGUI(self.ndfilter_tab, ui=self.ui)
 
     def setup_fonts(self):
         self.arr18 = tkFont.Font(family='Arial', size=18)
@@ -92,6 +101,13 @@ class IntensityMapGUI:
         self.is_running = False
         self.dropdown_var = tk.StringVar(value="Current")
         self.scan_mode = tk.StringVar(value="Forward") 
+        self.sampling_mode = tk.StringVar(value="Buffer")  # Buffer: Tip Move Recorder block read, Polling: pipelined Get
+        self.photon_mode = tk.StringVar(value="Stream")    # Stream: pushed count bins, Poll: 'D' per pixel, Line/Marker: exact counts per line, FLIM: decays per line
+        self.marker_channel = 1                                # Time tagger input of the pixel clock ("Marker")
+        self.flim_bin_width = 50                               # FLIM microtime bin width (ps)
+        self.flim_bins = 250                                   # Bins per decay, about one laser period
+        self.flim_method = tk.StringVar(value=FLIM_METHODS[0])
+        self.map2_mode = tk.StringVar(value="Intensity")       # Map 2 shows the photon counts or the FLIM lifetimes
         self.cursor_x = tk.StringVar(value="0")
         self.cursor_y = tk.StringVar(value="0")
         self.intensity1 = tk.StringVar(value="0.0")
@@ -124,6 +140,8 @@ class IntensityMapGUI:
         self.min2 = 0
         self.max2 = 0
         self.color_scale = 0.25
+        self.render_fps = 20                   # Maximum frame rate of the live maps
+        self.pending_pixels = {1: [], 2: []}   # Pixels not yet shown, per map
 
         # Track the active colorbar and dragging state
         self.manual_colorbar1 = False
@@ -136,7 +154,8 @@ class IntensityMapGUI:
 
         # Define available colormaps
         self.colormap_options = ["afmhot", "hot", "viridis", "plasma", "inferno", "magma", "cividis"]
-        self.fitting_options = ["Raw", "Subtract Average", "Subtract Slope", "Subtract Linear Fit", "Subtract Parabolic Fit"]
+        self.fitting_options = ["Raw", "Subtract Average", "Subtract Slope", "Subtract Column Slope", "Line Median",
+                                "Subtract Linear Fit", "Subtract Parabolic Fit"]
         self.colormap1 = tk.StringVar(value=self.colormap_options[0])  # Default colormap
         self.colormap2 = tk.StringVar(value=self.colormap_options[1])
         self.fitting1 = tk.StringVar(value=self.fitting_options[0])
@@ -146,9 +165,18 @@ class IntensityMapGUI:
             "Raw": twoDfittings.raw,
             "Subtract Average": twoDfittings.subtract_average,
             "Subtract Slope": twoDfittings.subtract_slope,
+            "Subtract Column Slope": twoDfittings.subtract_slope_columns,
+            "Line Median": twoDfittings.subtract_line_median,
             "Subtract Linear Fit": twoDfittings.subtract_linear_fit,
             "Subtract Parabolic Fit": twoDfittings.subtract_parabolic_fit
         }
+        self.live_fit_orders = {"Subtract Linear Fit": 1, "Subtract Parabolic Fit": 2}
+        self.live_fits = {}  # Incremental fits of the maps being scanned
+        self.autoscale_mode = tk.StringVar(value=AUTOSCALE_MODES[0])
+        self.autoscales = {}      # AutoScale per map
+        self.autoscale_local = {}  # Whether the limits were last built from raw (per-pixel) data
+        self.line_fit_methods = ("Subtract Slope", "Subtract Column Slope", "Line Median")
+        self.fit_buffers = {}  # Output arrays reused by the line-levelling methods
 
         # Variables for server IPs and Ports
         self.server1_ip = tk.StringVar(value="127.0.0.1")
@@ -166,6 +194,7 @@ class IntensityMapGUI:
         # Create the default intensity maps (initialized with zeros)
         self.raw_intensity1 = np.zeros((int(self.pixel.get()), int(self.pixel.get())))
         self.raw_intensity2 = np.zeros((int(self.pixel.get()), int(self.pixel.get())))
+        self.raw_lifetime = np.zeros((int(self.pixel.get()), int(self.pixel.get())))  # FLIM lifetimes (ns), 0 where not determined
 
         # First intensity map on the left
         self.im1 = self.ax1.imshow(self.raw_intensity1, cmap=self.colormap1.get(), 
@@ -191,6 +220,11 @@ class IntensityMapGUI:
 
         # Initial draw of the canvas
         self.canvas.draw()
+
+        # Live updates are applied and repainted from the Tk main loop
+        self.renderer = RenderScheduler(self.root, self.canvas, fps=self.render_fps)
+        self.renderer.add_artists(self.im1, self.im2, self.crosshair1, self.crosshair2)
+        self.renderer.start()
         
         # Bind the event handlers
         self.setup_bindings()
@@ -334,6 +368,11 @@ class IntensityMapGUI:
         self.fitting2_combo.pack(side=tk.LEFT, padx=5)
         self.fitting2_combo.bind("<<ComboboxSelected>>", lambda e: self.update_fitting2())
 
+        tk.Label(colorbar_frame, text="Autoscale", font=self.arr18).pack(side=tk.LEFT, padx=2)
+        self.autoscale_combo = ttk.Combobox(colorbar_frame, textvariable=self.autoscale_mode, font=self.arr18, width=9, values=AUTOSCALE_MODES, state="readonly")
+        self.autoscale_combo.pack(side=tk.LEFT, padx=5)
+        self.autoscale_combo.bind("<<ComboboxSelected>>", lambda e: (self.update_fitting1(), self.update_fitting2()))
+
     def setup_status_panel1(self, parent_frame):
         # Status frame for Height
         status_frame1 = tk.Frame(parent_frame)
@@ -381,18 +420,26 @@ class IntensityMapGUI:
 
     def update_fitting1(self):
         fitted_data1 = self.fitting_methods.get(self.fitting1.get(), twoDfittings.raw)(self.raw_intensity1)
-        vmin = np.min(fitted_data1)
-        vmax = np.max(fitted_data1)*(1+self.color_scale)
+        vmin, vmax = self.autoscale_limits(1, fitted_data1, [], self.fitting1.get())
+        vmax = self.headroom(vmax)
         self.im1.set_data(fitted_data1)
         self.im1.set_clim(vmin=vmin, vmax=vmax)
         self.vmin1.set(vmin)
         self.vmax1.set(vmax)
         self.canvas.draw()
 
+    def photon_map(self):
+        """Raw data of map 2: photon counts, or FLIM lifetimes (ns)."""
+        return self.raw_lifetime if self.map2_mode.get() == "Lifetime" else self.raw_intensity2
+
+    def update_map2_source(self):
+        self.autoscale_local.pop(2, None)  # Rebuild the colour limits from the new data
+        self.update_fitting2()
+
     def update_fitting2(self):
-        fitted_data2 = self.fitting_methods.get(self.fitting2.get(), twoDfittings.raw)(self.raw_intensity2)
-        vmin = np.min(fitted_data2)
-        vmax = np.max(fitted_data2)*(1+self.color_scale)
+        fitted_data2 = self.fitting_methods.get(self.fitting2.get(), twoDfittings.raw)(self.photon_map())
+        vmin, vmax = self.autoscale_limits(2, fitted_data2, [], self.fitting2.get())
+        vmax = self.headroom(vmax)
         self.im2.set_data(fitted_data2)
         self.im2.set_clim(vmin=vmin, vmax=vmax)
         self.vmin2.set(vmin)
@@ -458,6 +505,30 @@ class IntensityMapGUI:
         server2_port_entry = tk.Entry(server_frame, textvariable=self.server2_port, font=self.arr18, width=6)
         server2_port_entry.pack(side=tk.LEFT, padx=5)
 
+        # Dwell sampling: one bulk read of the controller buffer or pipelined polling
+        tk.Label(server_frame, text="Sampling", font=self.arr18).pack(side=tk.LEFT)
+        combobox = ttk.Combobox(server_frame, textvariable=self.sampling_mode, state="readonly", font=self.arr18, width=7)
+        combobox['values'] = ("Buffer", "Polling")
+        combobox.current(0)
+        combobox.pack(side=tk.LEFT, padx=2)
+
+        # Photon counts: binary count stream aligned to the dwell windows, one 'D' request per pixel, or
+        # exact counts from the photon timestamps once per line (dwell windows or hardware pixel-clock markers),
+        # or decay histograms of the dwell windows for FLIM
+        tk.Label(server_frame, text="Photons", font=self.arr18).pack(side=tk.LEFT)
+        combobox = ttk.Combobox(server_frame, textvariable=self.photon_mode, state="readonly", font=self.arr18, width=7)
+        combobox['values'] = ("Stream", "Poll", "Line", "Marker", "FLIM")
+        combobox.current(0)
+        combobox.pack(side=tk.LEFT, padx=2)
+
+        # FLIM lifetime estimator, and whether map 2 shows the counts or the lifetimes
+        tk.Label(server_frame, text="Lifetime", font=self.arr18).pack(side=tk.LEFT)
+        combobox = ttk.Combobox(server_frame, textvariable=self.flim_method, values=FLIM_METHODS, state="readonly", font=self.arr18, width=12)
+        combobox.pack(side=tk.LEFT, padx=2)
+        combobox = ttk.Combobox(server_frame, textvariable=self.map2_mode, values=("Intensity", "Lifetime"), state="readonly", font=self.arr18, width=8)
+        combobox.pack(side=tk.LEFT, padx=2)
+        combobox.bind("<<ComboboxSelected>>", lambda e: self.update_map2_source())
+
     def create_polarization_tab(self):
         self.polarization_frame = tk.Frame(self.polarization_tab)
         self.polarization_frame.grid(row=0, column=0, sticky="nsew", padx=0, pady=0)
@@ -580,8 +651,8 @@ class IntensityMapGUI:
         self.intensities_pol = []
         self.norm_intensities_pol = []
         self.norm2_intensities_pol = []
-        self.ax.clear()
-        self.canvas_pol.draw()
+        self.ui.post(self.ax.clear)
+        self.ui.post(self.canvas_pol.draw)
 
         current_angle = self.prm1.get_position()
         end_angle = current_angle + 360  # You can customize total rotation
@@ -591,14 +662,14 @@ class IntensityMapGUI:
         while self.running_pol and current_angle <= end_angle:
             move_angle = current_angle % 360
             self.prm1.move_to(move_angle)
-            self.cur_angle.set(f"{move_angle:.2f}")
+            self.ui.set(self.cur_angle, f"{move_angle:.2f}")
             time.sleep(acq_time)
 
             intensity = self.tcp_client2(-1, -1)
             if isinstance(intensity, numbers.Number):
                 self.angles_pol.append(np.radians(current_angle))
                 self.intensities_pol.append(intensity)
-                self.update_plot()
+                self.ui.post(self.update_plot)
             else:
                 print("End polarization measurement")
             current_angle += step
@@ -610,8 +681,8 @@ class IntensityMapGUI:
         self.picoharp_running = False
         self.thorlabs_running = False
         self.thorlabs_thread = False
-        self.goto_btn.config(state="normal")
-        self.start_btn.config(text="Start", font=self.arr18, bg="green")
+        self.ui.post(self.goto_btn.config, state="normal")  # Also called from the measurement thread
+        self.ui.post(self.start_btn.config, text="Start", font=self.arr18, bg="green")
 
     def deivce_connect(self):
         if not self.picoharp_connected and not self.thorlabs_connected:
@@ -691,6 +762,10 @@ class IntensityMapGUI:
                 writer4 = csv.writer(f4, delimiter='\t')
                 writer4.writerows(np.flipud(self.im2.get_array()))
             self.save_image(np.flipud(self.im2.get_array()), self.colormap2.get(), self.vmin2.get(), self.vmax2.get(), filename + "_photon.png")
+            if self.raw_lifetime.any():
+                with open(filename + '_lifetime.txt', 'w', newline='') as f5:
+                    writer5 = csv.writer(f5, delimiter='\t')
+                    writer5.writerows(np.flipud(self.raw_lifetime))
 
     def save_image(self, data, cmap, vmin, vmax, output_filename):
         fig = plt.figure(figsize=(3.5+0.5, 3.5))
@@ -742,11 +817,14 @@ class IntensityMapGUI:
 
             self.start_button.config(text="Running", font=self.arr18, bg="red")
         else:
-            self.send_stop_to_picoharp()
+            if self.scan is not None and self.scan.running:
+                self.scan.stop()  # tcp_client1 ends the count stream and sends Stop once the scan has ended
+            else:
+                self.send_stop_to_picoharp()
+                self.picoharp_running = False
             self.is_running = False
             self.nanonis_thread = None
             self.nanonis_running = False
-            self.picoharp_running = False
 
             self.start_button.config(text="Start", font=self.arr18, bg="green")
 
@@ -773,126 +851,77 @@ class IntensityMapGUI:
         frame = self.parse_input(self.frame.get())
         pixel = int(self.pixel.get())
         acq_time = int(self.acq_time.get()) / 1000  # Convert ms to seconds
-        response = None
-        current_x = 0
-        current_y = 0
-        intensity = 0
-        cur_x = 0
-        cur_y = 0
-        
-        resolution = frame / pixel
-        start_x = center_x - (frame / 2)  # Start from the left
-        start_y = center_y + (frame / 2)  # Start from the top
 
         try:
             self.send_start_to_picoharp(int(self.acq_time.get()))
             time.sleep(1.5)
             self.manual_colorbar1 = False
             self.manual_colorbar2 = False
-            if self.nanonis_running:                
-                folme = FolMe(self.nanonis)
-                zctrl = ZCtrl(self.nanonis)
-                current = Current(self.nanonis)
-
-            while self.is_running:
-                if not self.is_running:
-                    break
-                if self.nanonis_running:
-                    for y in range(pixel):
-                        if not self.nanonis_running:
-                            break
-                        current_y = start_y - y * resolution  # Move downward                        
-                        #if y % 2 == 0:                            
-                        #    x_range = range(pixel)  # Left to Right
-                        #else:
-                        #    x_range = range(pixel-1, -1, -1)  # Right to Left (Zig-Zag)
-                         # ----------------------------
-                        # FORWARD ONLY
-                        # ----------------------------
-                        if self.scan_mode.get() == "Forward":
-                            x_range = range(pixel)  # only L -> R
-
-                        # ----------------------------
-                        # BACKWARD ONLY
-                        # ----------------------------
-                        elif self.scan_mode.get() == "Backward":
-                            x_range = range(pixel - 1, -1, -1)  # only R -> L
-
-                        # ----------------------------
-                        # BIDIRECTIONAL (same Y twice)
-                        # ----------------------------
-                        elif self.scan_mode.get() == "Bidirectional":
-                            x_range = range(pixel)
-                            x_rangeb = range(pixel - 1, -1, -1)
-                            #x_range = range(pixel),                    # forward
-                            #    range(pixel - 1, -1, -1)          # backward
-
-                        # ----------------------------
-                        # ZIGZAG (interleaved lines)
-                        # ----------------------------
-                        elif self.scan_mode.get() == "Zigzag":
-                            if y % 2 == 0:
-                                x_range = range(pixel)       # forward
-                            else:
-                                x_range = range(pixel - 1, -1, -1)  # backward
-
-                        else:
-                            raise ValueError("Unknown scan mode")
-                        for x in x_range:
-                            if not self.nanonis_running:
-                               #print("Client 1 detected stop signal in x.")
-                                break
-                            current_x = start_x + x * resolution
-                            cur_x, cur_y = self.rotate_point(current_x, current_y, center_x, center_y, rotation*(-1))
-                            response = folme.XYPosSet(cur_x, cur_y, True)
-                            start_time = time.time()
-                            intensity_values = []
-                            while time.time() - start_time < acq_time:
-                                if self.dropdown_var.get() == "Height":
-                                    intensity_values.append(zctrl.ZPosGet())
-                                elif self.dropdown_var.get() == "Current":
-                                    intensity_values.append(current.Get())
-                            #end_time = time.time()
-                            #total_time_ms = (end_time - start_time) * 1000  # Convert to milliseconds
-                            if intensity_values:
-                                intensity = sum(intensity_values) / len(intensity_values)  # Mean value
-                            else:
-                                intensity = 0
-                            #print(f"Time: {total_time_ms:.2f} ms ms. N: {len(intensity_values)}")
-                            self.intensity1.set(self.format_output(intensity))
-                            self.update_z_plot(x, y, intensity)
-                            self.tcp_client2(x, y)
-                        if self.scan_mode.get() == "Bidirectional":
-                            for x in x_rangeb:
-                                if not self.nanonis_running:
-                                   #print("Client 1 detected stop signal in x.")
-                                    break
-                                current_x = start_x + x * resolution
-                                cur_x, cur_y = self.rotate_point(current_x, current_y, center_x, center_y, rotation*(-1))
-                                response = folme.XYPosSet(cur_x, cur_y, True)
-                                start_time = time.time()
-                                intensity_values = []
-                                while time.time() - start_time < acq_time:
-                                    if self.dropdown_var.get() == "Height":
-                                        intensity_values.append(zctrl.ZPosGet())
-                                    elif self.dropdown_var.get() == "Current":
-                                        intensity_values.append(current.Get())
-                                #end_time = time.time()
-                                #total_time_ms = (end_time - start_time) * 1000  # Convert to milliseconds
-                                if intensity_values:
-                                    intensity = sum(intensity_values) / len(intensity_values)  # Mean value
-                                else:
-                                    intensity = 0
-                    self.start_button.config(text="Start", font=self.arr18, bg="green")
-                    self.send_stop_to_picoharp()
-                    self.is_running = False
-                    self.nanonis_running = False
-                    self.picoharp_running = False
-                    #self.client_socket1 = self.nanonis.close_socket()
-                    #self.client_socket2 = self.client_socket2.close()
+            if self.nanonis_running:
+                # Widget state is read once here; the engine only sees plain parameters
+                detectors = {"z": NanonisDetector(self.nanonis, self.dropdown_var.get(), self.sampling_mode.get(), self.pipeline_depth)}
+                if self.picoharp_running:
+                    detectors["photon"] = self.photon_detector(pixel)
+                self.scan = RasterScan(center_x, center_y, frame, pixel, rotation, self.scan_mode.get(), acq_time,
+                                       stage=NanonisStage(self.nanonis), detectors=detectors)
+                results = self.scan.start()
+                while True:
+                    result = results.get()
+                    if result is None:
+                        break
+                    if isinstance(result, LineResult):
+                        self.ui.post(self.show_line, result)
+                    elif result.trace == 0:
+                        self.ui.post(self.show_pixel, result)  # Tk is only touched from the main loop
+                print(self.scan.timing_summary())
+                self.ui.post(self.finish_scan)  # Queued after the last results, so they are still drawn
         except Exception as e:
             print(f"Client 1 error: {e}")
 
+    def finish_scan(self):
+        """End of a scan, on the main loop once the last pixels are shown: resets the button and the run flags."""
+        self.start_button.config(text="Start", font=self.arr18, bg="green")
+        self.send_stop_to_picoharp()
+        self.is_running = False
+        self.nanonis_running = False
+        self.picoharp_running = False
+
+    def photon_detector(self, pixel):
+        """Photon detector for the selected Photons mode."""
+        mode = self.photon_mode.get()
+        if mode == "Stream":
+            return StreamingPicoHarpDetector(self.sock)
+        if mode in ("Line", "Marker"):
+            return PixelClockDetector(self.sock, pixel, marker=self.marker_channel if mode == "Marker" else 0)
+        if mode == "FLIM":
+            return FlimDetector(self.sock, pixel, self.flim_bin_width, self.flim_bins)
+        return PicoHarpDetector(self.sock)
+
+    def show_line(self, result):
+        """Displays the per-line photon counts of a LineResult (and the lifetimes for FLIM decays)."""
+        if "photon" not in result.values:
+            return
+        counts = result.values["photon"]
+        if counts.ndim == 2:
+            lifetimes = lifetime_map(counts, self.flim_bin_width * 1e-12, self.flim_method.get()) * 1e9  # whole line at once
+            counts = counts.sum(axis=1)
+            for ix, value, lifetime in zip(result.ix, counts.tolist(), lifetimes.tolist()):
+                self.update_intensity_plot(ix, result.iy, value, lifetime)
+        else:
+            for ix, value in zip(result.ix, counts.tolist()):
+                self.update_intensity_plot(ix, result.iy, value)
+        if len(counts):
+            self.intensity2.set(self.format_output(counts[-1]))
+
+    def show_pixel(self, result):
+        """Displays one PixelResult from the scan engine."""
+        intensity = result.values["z"]
+        self.intensity1.set(self.format_output(intensity))
+        self.update_z_plot(result.ix, result.iy, intensity)
+        if "photon" in result.values:
+            self.intensity2.set(self.format_output(result.values["photon"]))
+            self.update_intensity_plot(result.ix, result.iy, result.values["photon"])
+
     # TCP client 2 function
     def tcp_client2(self, x, y):
         message = f"D".encode('utf-8')
@@ -909,11 +938,11 @@ class IntensityMapGUI:
 
                 # Unpack the received data (intensity value)
                 intensity_value = struct.unpack('!I', data)[0]
-                self.intensity2.set(self.format_output(intensity_value))
+                self.ui.set(self.intensity2, self.format_output(intensity_value))
 
                 # Update the plot with the received intensity value for the given (x, y)
                 if x >= 0 and y >=0:
-                    self.update_intensity_plot(x, y, intensity_value)
+                    self.ui.post(self.update_intensity_plot, x, y, intensity_value)
                 else:
                     return intensity_value
 
@@ -941,6 +970,54 @@ class IntensityMapGUI:
         except Exception as e:
             print(f"Error sending Stop to Picoharp: {e}")
 
+    def fit_live(self, key, raw_data, method, pixels):
+        """
+        Fitted map after the (x, y) pixels of raw_data changed. Plane and
+        parabolic fits keep running sums and are updated with these pixels
+        only; the other methods are applied to the whole map.
+        """
+        order = self.live_fit_orders.get(method)
+        if order is None:
+            self.live_fits.pop(key, None)
+            if method in self.line_fit_methods:
+                buffer = self.fit_buffers.get(key)
+                if buffer is None or buffer.shape != raw_data.shape:
+                    buffer = np.empty(raw_data.shape)
+                    self.fit_buffers[key] = buffer
+                return self.fitting_methods[method](raw_data, out=buffer)
+            return self.fitting_methods.get(method, twoDfittings.raw)(raw_data)
+        source, fit = self.live_fits.get(key, (None, None))
+        if source is not raw_data or fit.order != order:
+            fit = IncrementalSurfaceFit.from_data(raw_data, order)  # New map or method: start from the scanned pixels
+            self.live_fits[key] = (raw_data, fit)
+        else:
+            for x, y in pixels:
+                fit.add(x, y, raw_data[y, x])
+        return fit.subtract(raw_data)
+
+    def autoscale_limits(self, key, fitted_data, pixels, method):
+        """Colour limits over the scanned pixels of the map (see AutoScale)."""
+        mode = self.autoscale_mode.get()
+        local = method == "Raw"  # Every other processing also changes the earlier pixels
+        scale = self.autoscales.get(key)
+        if scale is None or scale.shape != fitted_data.shape:
+            scale = AutoScale(fitted_data.shape, mode)
+            self.autoscales[key] = scale
+            self.autoscale_local.pop(key, None)
+        first = (fitted_data.shape[1] - 1, 0) if self.scan_mode.get() == "Backward" else (0, 0)
+        if first in pixels:
+            scale.reset()  # New frame
+            scale.mode = mode
+            pixels = pixels[pixels.index(first):]
+        elif scale.mode != mode or self.autoscale_local.get(key) != local:
+            scale.set_mode(mode, fitted_data, local)  # Rebuild the statistics from the valid pixels
+        self.autoscale_local[key] = local
+        return scale.update(fitted_data, pixels, local)
+
+    def headroom(self, vmax):
+        """Extra range above the maximum in Min/Max mode, so the colorbar does not change every pixel."""
+        return vmax*(1+self.color_scale) if self.autoscale_mode.get() == "Min/Max" else vmax
+
     def update_z_plot(self, x, y, intensity_value):
         if self.is_running:
             frame_size = int(self.pixel.get())
@@ -949,69 +1026,62 @@ class IntensityMapGUI:
                 new_intensity_data = np.zeros((frame_size, frame_size))
                 self.raw_intensity1 = new_intensity_data
                 self.im1.set_data(new_intensity_data)
+                self.pending_pixels[1] = []
+                self.renderer.invalidate()
 
             self.raw_intensity1[y, x] = intensity_value
-            fitted_data1 = self.fitting_methods.get(self.fitting1.get(), twoDfittings.raw)(self.raw_intensity1)
-            self.im1.set_data(fitted_data1)
-            if self.manual_colorbar1 == False:
-                if self.scan_mode.get() == "Backward":
-                    if y == 0 and x == frame_size-1:
-                        self.min1 = fitted_data1[y, x]
-                        self.max1 = fitted_data1[y, x]
-                    else:
-                        val = fitted_data1[y, x]
-                        self.min1 = min(self.min1, val)
-                        self.max1 = max(self.max1, val)
-                else:
-                    if y == 0 and x == 0:
-                        self.min1 = fitted_data1[y, x]
-                        self.max1 = fitted_data1[y, x]
-                    else:
-                        val = fitted_data1[y, x]
-                        self.min1 = min(self.min1, val)
-                        self.max1 = max(self.max1, val)
-                vmin=self.min1
-                vmax=self.max1*(1+self.color_scale)
-                self.im1.set_clim(vmin=vmin, vmax=vmax)
-                self.vmin1.set(vmin)
-                self.vmax1.set(vmax)
-            #self.canvas.draw_idle()
-
-    def update_intensity_plot(self, x, y, intensity_value):
+            self.pending_pixels[1].append((x, y))
+            self.renderer.request(1, self.refresh_z_plot)  # Refit and repaint once per frame, not per pixel
+
+    def refresh_z_plot(self):
+        pixels, self.pending_pixels[1] = self.pending_pixels[1], []
+        if not pixels:
+            return
+        fitted_data1 = self.fit_live(1, self.raw_intensity1, self.fitting1.get(), pixels)
+        self.im1.set_data(fitted_data1)
+        if self.manual_colorbar1 == False:
+            self.min1, self.max1 = self.autoscale_limits(1, fitted_data1, pixels, self.fitting1.get())
+            vmin=self.min1
+            vmax=self.headroom(self.max1)
+            self.im1.set_clim(vmin=vmin, vmax=vmax)
+            self.vmin1.set(vmin)
+            self.vmax1.set(vmax)
+            self.renderer.invalidate()  # Colorbar range changed
+        self.renderer.mark(self.im1)
+
+    def update_intensity_plot(self, x, y, intensity_value, lifetime=None):
         if self.is_running:
             frame_size = int(self.pixel.get())
-
+            
             if self.raw_intensity2.shape != (frame_size, frame_size):
                 new_intensity_data = np.zeros((frame_size, frame_size))
                 self.raw_intensity2 = new_intensity_data
+                self.raw_lifetime = np.zeros((frame_size, frame_size))
                 self.im2.set_data(new_intensity_data)
-            
+                self.pending_pixels[2] = []
+                self.renderer.invalidate()
+
             self.raw_intensity2[y, x] = intensity_value
-            fitted_data2 = self.fitting_methods.get(self.fitting2.get(), twoDfittings.raw)(self.raw_intensity2)
-            self.im2.set_data(fitted_data2)
-            if self.manual_colorbar2 == False:
-                if self.scan_mode.get() == "Backward":
-                    if y == 0 and x == frame_size-1:
-                        self.min2 = fitted_data2[y, x]
-                        self.max2 = fitted_data2[y, x]
-                    else:
-                        val = fitted_data2[y, x]
-                        self.min2 = min(self.min2, val)
-                        self.max2 = max(self.max2, val)
-                else:
-                    if y == 0 and x == 0:
-                        self.min2 = fitted_data2[y, x]
-                        self.max2 = fitted_data2[y, x]
-                    else:
-                        val = fitted_data2[y, x]
-                        self.min2 = min(self.min2, val)
-                        self.max2 = max(self.max2, val)
-                vmin=self.min2
-                vmax=self.max2*(1+self.color_scale)
-                self.im2.set_clim(vmin=vmin, vmax=vmax)
-                self.vmin2.set(vmin)
-                self.vmax2.set(vmax)           
-            self.canvas.draw_idle()
+            if lifetime is not None:
+                self.raw_lifetime[y, x] = lifetime
+            self.pending_pixels[2].append((x, y))
+            self.renderer.request(2, self.refresh_intensity_plot)  # Refit and repaint once per frame, not per pixel
+
+    def refresh_intensity_plot(self):
+        pixels, self.pending_pixels[2] = self.pending_pixels[2], []
+        if not pixels:
+            return
+        fitted_data2 = self.fit_live(2, self.photon_map(), self.fitting2.get(), pixels)
+        self.im2.set_data(fitted_data2)
+        if self.manual_colorbar2 == False:
+            self.min2, self.max2 = self.autoscale_limits(2, fitted_data2, pixels, self.fitting2.get())
+            vmin=self.min2
+            vmax=self.headroom(self.max2)
+            self.im2.set_clim(vmin=vmin, vmax=vmax)
+            self.vmin2.set(vmin)
+            self.vmax2.set(vmax)
+            self.renderer.invalidate()  # Colorbar range changed
+        self.renderer.mark(self.im2)
 
     def on_click(self, event):
         #if event.inaxes:
@@ -1046,14 +1116,11 @@ class IntensityMapGUI:
         
         center_x = self.parse_input(self.center_x.get())
         center_y = self.parse_input(self.center_y.get())
+        rotation = self.parse_input(self.rotation.get())
         frame = self.parse_input(self.frame.get())
         pixel = int(self.pixel.get())        
-        resolution = frame / pixel
-        start_x = center_x - (frame / 2)  # Start from the left
-        start_y = center_y + (frame / 2)  # Start from the top
-        
-        current_x = start_x + x * resolution
-        current_y = start_y - y * resolution
+        # Same cached grid the scan used, so the readout is the actual tip position
+        current_x, current_y = pixel_grid(center_x, center_y, frame, pixel, rotation)[min(y, pixel - 1), min(x, pixel - 1)]
 
         # Update cursor x, y, and intensity values for both maps
         self.cursor_x.set(self.format_output(current_x))
@@ -1063,26 +1130,8 @@ class IntensityMapGUI:
         self.intensity1.set(self.format_output(intensity1))  # Update intensity for the first map
         self.intensity2.set(self.im2.get_array()[y, x])  # Update intensity for the first map
 
-        # Redraw the canvas with updated crosshairs
-        self.canvas.draw()
-
-    def rotate_point(self, x, y, cx=0, cy=0, angle=0):
-        # Convert angle to radians
-        theta = math.radians(angle)
-
-        # Translate point back to origin
-        x_shifted = x - cx
-        y_shifted = y - cy
-
-        # Apply rotation matrix
-        x_rotated = x_shifted * math.cos(theta) - y_shifted * math.sin(theta)
-        y_rotated = x_shifted * math.sin(theta) + y_shifted * math.cos(theta)
-
-        # Translate back to original position
-        x_new = x_rotated + cx
-        y_new = y_rotated + cy
-
-        return x_new, y_new
+        # Repaint only the crosshairs
+        self.renderer.mark(self.crosshair1, self.crosshair2)
 
     def parse_input(self, input_str):
         if input_str.strip() in ['0', '-0']:
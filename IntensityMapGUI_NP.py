@@ -2,11 +2,15 @@ import tkinter as tk
 from tkinter import font as tkFont
 from tkinter import ttk, filedialog, messagebox
 import numpy as np
-import math
 from e70d2s import e70
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-from fitting_methods import twoDfittings
+from fitting_methods import twoDfittings, IncrementalSurfaceFit
+from render_scheduler import RenderScheduler
+from ui_bridge import UIBridge
+from autoscale import AutoScale, AUTOSCALE_MODES
+from scan_engine import RasterScan, E70Stage, PicoHarpDetector, StreamingPicoHarpDetector, PixelClockDetector, FlimDetector, LineResult, pixel_grid
+from flim import lifetime_map, FLIM_METHODS
 from matplotlib.colors import Normalize
 from thorlabs_control import KDC101Controller
 from stepper_motor_NP import NDFilterGUI
@@ -42,6 +46,7 @@ class IntensityMapGUI:
         self.running_pol = False
         self.is_running = False 
         self.running_thread = None
+        self.scan = None  # RasterScan of the running scan
 
         self.prm1 = KDC101Controller()
         self.thorlabs_connected = None
@@ -55,6 +60,9 @@ class IntensityMapGUI:
         self.sock = None
         self.picoharp_connected = False
 
+        self.ui = UIBridge(self.root)  # Worker threads post GUI updates here
+        self.ui.start()
+
         self.setup_fonts()
         self.setup_variables()
         #self.setup_plot()
@@ -84,7 +92,7 @@ class IntensityMapGUI:
         # Build tabs
         self.create_scan_tab()
         self.create_polarization_tab()
-        self.stepper_motor = NDFilterGUI(self.ndfilter_tab)
+        self.stepper_motor = NDFilterGUI(self.ndfilter_tab, ui=self.ui)
 
     def setup_fonts(self):
         self.arr18 = tkFont.Font(family='Arial', size=18)
@@ -117,6 +125,8 @@ class IntensityMapGUI:
 
         self.vmin1 = tk.DoubleVar(value=0.0)
         self.vmax1 = tk.DoubleVar(value=1.0)
+        self.render_fps = 20           # Maximum frame rate of the live map
+        self.pending_pixels = {1: []}  # Pixels not yet shown
 
         self.min1 = 0
         self.max1 = 0
@@ -133,7 +143,8 @@ class IntensityMapGUI:
 
         # Define available colormaps
         self.colormap_options = ["afmhot", "hot", "viridis", "plasma", "inferno", "magma", "cividis"]
-        self.fitting_options = ["Raw", "Subtract Average", "Subtract Slope", "Subtract Linear Fit", "Subtract Parabolic Fit"]
+        self.fitting_options = ["Raw", "Subtract Average", "Subtract Slope", "Subtract Column Slope", "Line Median",
+                                "Subtract Linear Fit", "Subtract Parabolic Fit"]
         self.colormap1 = tk.StringVar(value=self.colormap_options[1])  # Default colormap
         self.fitting1 = tk.StringVar(value=self.fitting_options[0])
 
@@ -141,15 +152,30 @@ class IntensityMapGUI:
             "Raw": twoDfittings.raw,
             "Subtract Average": twoDfittings.subtract_average,
             "Subtract Slope": twoDfittings.subtract_slope,
+            "Subtract Column Slope": twoDfittings.subtract_slope_columns,
+            "Line Median": twoDfittings.subtract_line_median,
             "Subtract Linear Fit": twoDfittings.subtract_linear_fit,
             "Subtract Parabolic Fit": twoDfittings.subtract_parabolic_fit
         }
+        self.live_fit_orders = {"Subtract Linear Fit": 1, "Subtract Parabolic Fit": 2}
+        self.live_fits = {}  # Incremental fits of the maps being scanned
+        self.autoscale_mode = tk.StringVar(value=AUTOSCALE_MODES[0])
+        self.autoscales = {}      # AutoScale per map
+        self.autoscale_local = {}  # Whether the limits were last built from raw (per-pixel) data
+        self.line_fit_methods = ("Subtract Slope", "Subtract Column Slope", "Line Median")
+        self.fit_buffers = {}  # Output arrays reused by the line-levelling methods
 
         # Variables for server IPs and Ports
         self.e70d2s_address = tk.StringVar(value="01")
         self.e70d2s_port = tk.StringVar(value="COM1")
         self.picoharp_ip = tk.StringVar(value="192.168.236.2")
         self.picoharp_port = tk.IntVar(value=65053)
+        self.photon_mode = tk.StringVar(value="Stream")  # Stream: pushed count bins, Poll: 'D' per pixel, Line/Marker: exact counts per line, FLIM: decays per line
+        self.marker_channel = 1                              # Time tagger input of the pixel clock ("Marker")
+        self.flim_bin_width = 50                             # FLIM microtime bin width (ps)
+        self.flim_bins = 250                                 # Bins per decay, about one laser period
+        self.flim_method = tk.StringVar(value=FLIM_METHODS[0])
+        self.map1_mode = tk.StringVar(value="Intensity")     # The map shows the photon counts or the FLIM lifetimes
 
     def create_scan_tab(self):
         self.setup_connection()
@@ -185,6 +211,23 @@ class IntensityMapGUI:
         self.picoharp_button = tk.Button(connection_frame, text="Connect", bg="red", font=self.arr18, command=self.picoharp_connect)
         self.picoharp_button.pack(side=tk.LEFT, padx=5)
 
+        # Photon counts: binary count stream aligned to the dwell windows, one 'D' request per pixel, or
+        # exact counts from the photon timestamps once per line (dwell windows or hardware pixel-clock markers),
+        # or decay histograms of the dwell windows for FLIM
+        tk.Label(connection_frame, text="Photons", font=self.arr18).pack(side=tk.LEFT)
+        combobox = ttk.Combobox(connection_frame, textvariable=self.photon_mode, state="readonly", font=self.arr18, width=7)
+        combobox['values'] = ("Stream", "Poll", "Line", "Marker", "FLIM")
+        combobox.current(0)
+        combobox.pack(side=tk.LEFT, padx=2)
+
+        # FLIM lifetime estimator, and whether the map shows the counts or the lifetimes
+        tk.Label(connection_frame, text="Lifetime", font=self.arr18).pack(side=tk.LEFT)
+        combobox = ttk.Combobox(connection_frame, textvariable=self.flim_method, values=FLIM_METHODS, state="readonly", font=self.arr18, width=12)
+        combobox.pack(side=tk.LEFT, padx=2)
+        combobox = ttk.Combobox(connection_frame, textvariable=self.map1_mode, values=("Intensity", "Lifetime"), state="readonly", font=self.arr18, width=8)
+        combobox.pack(side=tk.LEFT, padx=2)
+        combobox.bind("<<ComboboxSelected>>", lambda e: self.update_map1_source())
+
     def update_ports(self, combobox, variable, event=None):
         ports = [port.device for port in serial.tools.list_ports.comports()]
         combobox["values"] = ports    
@@ -197,6 +240,7 @@ class IntensityMapGUI:
 
         # Create the default intensity maps (initialized with zeros)
         self.raw_intensity1 = np.zeros((int(self.pixel.get()), int(self.pixel.get())))
+        self.raw_lifetime = np.zeros((int(self.pixel.get()), int(self.pixel.get())))  # FLIM lifetimes (ns), 0 where not determined
 
         # First intensity map on the left
         self.im1 = self.ax1.imshow(self.raw_intensity1, cmap=self.colormap1.get(), 
@@ -214,6 +258,11 @@ class IntensityMapGUI:
 
         # Initial draw of the canvas
         self.canvas.draw()
+
+        # Live updates are applied and repainted from the Tk main loop
+        self.renderer = RenderScheduler(self.root, self.canvas, fps=self.render_fps)
+        self.renderer.add_artists(self.im1, self.crosshair1)
+        self.renderer.start()
         
         # Bind the event handlers
         self.setup_bindings()
@@ -338,6 +387,11 @@ class IntensityMapGUI:
         self.fitting1_combo = ttk.Combobox(status_colorbar_frame, textvariable=self.fitting1, font=self.arr18, width=18, values=self.fitting_options, state="readonly")
         self.fitting1_combo.pack(side=tk.LEFT, padx=2)
         self.fitting1_combo.bind("<<ComboboxSelected>>", lambda e: self.update_fitting1())
+
+        tk.Label(status_colorbar_frame, text="Autoscale", font=self.arr18).pack(side=tk.LEFT, padx=2)
+        self.autoscale_combo = ttk.Combobox(status_colorbar_frame, textvariable=self.autoscale_mode, font=self.arr18, width=9, values=AUTOSCALE_MODES, state="readonly")
+        self.autoscale_combo.pack(side=tk.LEFT, padx=2)
+        self.autoscale_combo.bind("<<ComboboxSelected>>", lambda e: self.update_fitting1())
    
     def update_colormap(self, plot_number):
         """Updates the colormap for the selected plot."""
@@ -346,10 +400,17 @@ class IntensityMapGUI:
 
         self.canvas.draw_idle()  # Redraw with the new colormap
 
+    def photon_map(self):
+        """Raw data of the map: photon counts, or FLIM lifetimes (ns)."""
+        return self.raw_lifetime if self.map1_mode.get() == "Lifetime" else self.raw_intensity1
+
+    def update_map1_source(self):
+        self.autoscale_local.pop(1, None)  # Rebuild the colour limits from the new data
+        self.update_fitting1()
+
     def update_fitting1(self):
-        fitted_data1 = self.fitting_methods.get(self.fitting1.get(), twoDfittings.raw)(self.raw_intensity1)
-        vmin = np.min(fitted_data1)
-        vmax = np.max(fitted_data1)
+        fitted_data1 = self.fitting_methods.get(self.fitting1.get(), twoDfittings.raw)(self.photon_map())
+        vmin, vmax = self.autoscale_limits(1, fitted_data1, [], self.fitting1.get())
         diff = 0.5*(vmax - vmin)
         self.im1.set_data(fitted_data1)
         self.im1.set_clim(vmin=vmin-diff, vmax=vmax+diff)
@@ -499,8 +560,8 @@ class IntensityMapGUI:
         self.intensities_pol = []
         self.norm_intensities_pol = []
         self.norm2_intensities_pol = []
-        self.ax.clear()
-        self.canvas_pol.draw()
+        self.ui.post(self.ax.clear)
+        self.ui.post(self.canvas_pol.draw)
 
         current_angle = self.prm1.get_position()
         end_angle = current_angle + 360  # You can customize total rotation
@@ -510,14 +571,14 @@ class IntensityMapGUI:
         while self.running_pol and current_angle <= end_angle:
             move_angle = current_angle % 360
             self.prm1.move_to(move_angle)
-            self.cur_angle.set(f"{move_angle:.2f}")
+            self.ui.set(self.cur_angle, f"{move_angle:.2f}")
             time.sleep(acq_time)
 
             intensity = self.tcp_client2(-1, -1)
             if isinstance(intensity, numbers.Number):
                 self.angles_pol.append(np.radians(current_angle))
                 self.intensities_pol.append(intensity)
-                self.update_plot()
+                self.ui.post(self.update_plot)
             else:
                 print("End polarization measurement")
             current_angle += step
@@ -529,8 +590,8 @@ class IntensityMapGUI:
         self.picoharp_connected = False
         self.thorlabs_running = False
         self.thorlabs_thread = False
-        self.goto_btn.config(state="normal")
-        self.start_btn.config(text="Start", font=self.arr18, bg="green")
+        self.ui.post(self.goto_btn.config, state="normal")  # Also called from the measurement thread
+        self.ui.post(self.start_btn.config, text="Start", font=self.arr18, bg="green")
 
     def deivce_connect(self):
         if not self.picoharp_connected and not self.thorlabs_connected:
@@ -591,6 +652,10 @@ class IntensityMapGUI:
                 writer4 = csv.writer(f4, delimiter='\t')
                 writer4.writerows(np.flipud(self.im1.get_array()))
             self.save_image(self.im1.get_array(), self.colormap1.get(), self.vmin1.get(), self.vmax1.get(), filename + "_photon.png")
+            if self.raw_lifetime.any():
+                with open(filename + '_lifetime.txt', 'w', newline='') as f5:
+                    writer5 = csv.writer(f5, delimiter='\t')
+                    writer5.writerows(np.flipud(self.raw_lifetime))
 
     def save_image(self, data, cmap, vmin, vmax, output_filename):
         fig = plt.figure(figsize=(3.5+0.5, 3.5))
@@ -626,7 +691,10 @@ class IntensityMapGUI:
                 self.running_thread = threading.Thread(target=self.run_mapping)
                 self.running_thread.start()
             else:
-                self.send_stop_to_picoharp()
+                if self.scan is not None and self.scan.running:
+                    self.scan.stop()  # run_mapping ends the count stream and sends Stop once the scan has ended
+                else:
+                    self.send_stop_to_picoharp()
                 self.index_x = -1
                 self.index_y = -1
                 self.is_running = False
@@ -683,96 +751,74 @@ class IntensityMapGUI:
         frame = self.parse_input(self.frame.get())
         pixel = int(self.pixel.get())
         acq_time = int(self.acq_time.get()) / 1000  # Convert ms to seconds
-        move = False
-        current_x = 0
-        current_y = 0
-        intensity = 0
-        cur_x = 0
-        cur_y = 0
-        
         resolution = frame / pixel
-        start_x = center_x - (frame / 2)  # Start from the left
-        start_y = center_y + (frame / 2)  # Start from the top
 
         try:
             self.send_start_to_picoharp(int(self.acq_time.get()))
             time.sleep(1.5)
             self.manual_colorbar1 = False
-            #print("Scan Loop")
-            while self.is_running:
-                if not self.is_running:
+            # Widget state is read once here; the engine only sees plain parameters
+            detectors = {}
+            if self.picoharp_connected:
+                detectors["photon"] = self.photon_detector(pixel)
+            self.scan = RasterScan(center_x, center_y, frame, pixel, rotation, self.scan_mode.get(), acq_time,
+                                   stage=E70Stage(self.e70d2s, resolution), detectors=detectors)
+            results = self.scan.start()
+            while True:
+                result = results.get()
+                if result is None:
                     break
-                if self.is_running:
-                    for y in range(pixel):
-                        if not self.is_running:
-                            break
-                        current_y = start_y - y * resolution  # Move downward     
-
-                        if self.scan_mode.get() == "Forward":
-                            x_range = range(pixel)  # only L -> R
-                        elif self.scan_mode.get() == "Backward":
-                            x_range = range(pixel - 1, -1, -1)  # only R -> L
-
-                        elif self.scan_mode.get() == "Bidirectional":
-                            x_range = range(pixel)
-                            x_rangeb = range(pixel - 1, -1, -1)
-                            #x_range = range(pixel),                    # forward
-                            #    range(pixel - 1, -1, -1)          # backward
-
-                        elif self.scan_mode.get() == "Zigzag":
-                            if y % 2 == 0:
-                                x_range = range(pixel)       # forward
-                            else:
-                                x_range = range(pixel - 1, -1, -1)  # backward
-
-                        else:
-                            raise ValueError("Unknown scan mode")
-                        for x in x_range:
-                            if not self.is_running:
-                               #print("Client 1 detected stop signal in x.")
-                                break
-                            current_x = start_x + x * resolution
-                            cur_x, cur_y = self.rotate_point(current_x, current_y, center_x, center_y, rotation*(-1))
-                            #print(f"x: {x}, y: {y}")
-                            self.e70d2s.move_to(target_x=cur_x, target_y=cur_y, step_size=resolution)
-                            self.current_x.set(f"{cur_x:.4f}")
-                            self.current_y.set(f"{cur_y:.4f}")
-                            start_time = time.time()
-                            while time.time() - start_time < acq_time:
-                                time.sleep(0.01)
-                            self.tcp_client2(x, y)
-                        #if self.scan_mode.get() == "Bidirectional":
-                        #    for x in x_rangeb:
-                        #        if not self.nanonis_running:
-                        #           #print("Client 1 detected stop signal in x.")
-                        #            break
-                        #        current_x = start_x + x * resolution
-                        #        cur_x, cur_y = self.rotate_point(current_x, current_y, center_x, center_y, rotation*(-1))
-                        #        response = folme.XYPosSet(cur_x, cur_y, True)
-                        #        start_time = time.time()
-                        #        intensity_values = []
-                        #        while time.time() - start_time < acq_time:
-                        #            if self.dropdown_var.get() == "Height":
-                        #                intensity_values.append(zctrl.ZPosGet())
-                        #            elif self.dropdown_var.get() == "Current":
-                        #                intensity_values.append(current.Get())
-                        #        #end_time = time.time()
-                        #        #total_time_ms = (end_time - start_time) * 1000  # Convert to milliseconds
-                        #        if intensity_values:
-                        #            intensity = sum(intensity_values) / len(intensity_values)  # Mean value
-                        #        else:
-                        #            intensity = 0
-                    self.start_button.config(text="Start", font=self.arr18, bg="green")
-                    self.index_x = -1
-                    self.index_y = -1
-                    self.send_stop_to_picoharp()
-                    self.is_running = False
-                    #print("Finish Scan Loop")
-                    #self.client_socket1 = self.nanonis.close_socket()
-                    #self.client_socket2 = self.client_socket2.close()
+                if isinstance(result, LineResult):
+                    self.ui.post(self.show_line, result)
+                elif result.trace == 0:
+                    self.ui.post(self.show_pixel, result)  # Tk is only touched from the main loop
+            self.ui.post(self.finish_scan)  # Queued after the last results, so they are still drawn
         except Exception as e:
             print(f"Client 1 error: {e}")
 
+    def finish_scan(self):
+        """End of a scan, on the main loop once the last pixels are shown: resets the button and the run flag."""
+        self.start_button.config(text="Start", font=self.arr18, bg="green")
+        self.index_x = -1
+        self.index_y = -1
+        self.send_stop_to_picoharp()
+        self.is_running = False
+
+    def photon_detector(self, pixel):
+        """Photon detector for the selected Photons mode."""
+        mode = self.photon_mode.get()
+        if mode == "Stream":
+            return StreamingPicoHarpDetector(self.sock)
+        if mode in ("Line", "Marker"):
+            return PixelClockDetector(self.sock, pixel, marker=self.marker_channel if mode == "Marker" else 0)
+        if mode == "FLIM":
+            return FlimDetector(self.sock, pixel, self.flim_bin_width, self.flim_bins)
+        return PicoHarpDetector(self.sock)
+
+    def show_line(self, result):
+        """Displays the per-line photon counts of a LineResult (and the lifetimes for FLIM decays)."""
+        if "photon" not in result.values:
+            return
+        counts = result.values["photon"]
+        if counts.ndim == 2:
+            lifetimes = lifetime_map(counts, self.flim_bin_width * 1e-12, self.flim_method.get()) * 1e9  # whole line at once
+            counts = counts.sum(axis=1)
+            for ix, value, lifetime in zip(result.ix, counts.tolist(), lifetimes.tolist()):
+                self.update_intensity_plot(ix, result.iy, value, lifetime)
+        else:
+            for ix, value in zip(result.ix, counts.tolist()):
+                self.update_intensity_plot(ix, result.iy, value)
+        if len(counts):
+            self.intensity1.set(self.format_output(counts[-1]))
+
+    def show_pixel(self, result):
+        """Displays one PixelResult from the scan engine."""
+        self.current_x.set(f"{result.x:.4f}")
+        self.current_y.set(f"{result.y:.4f}")
+        if "photon" in result.values:
+            self.intensity1.set(self.format_output(result.values["photon"]))
+            self.update_intensity_plot(result.ix, result.iy, result.values["photon"])
+
     # TCP client 2 function
     def tcp_client2(self, x, y):
         message = f"D".encode('utf-8')
@@ -789,11 +835,11 @@ class IntensityMapGUI:
 
                 # Unpack the received data (intensity value)
                 intensity_value = struct.unpack('!I', data)[0]
-                self.intensity1.set(self.format_output(intensity_value))
+                self.ui.set(self.intensity1, self.format_output(intensity_value))
 
                 # Update the plot with the received intensity value for the given (x, y)
                 if x >= 0 and y >=0:
-                    self.update_intensity_plot(x, y, intensity_value)
+                    self.ui.post(self.update_intensity_plot, x, y, intensity_value)
                 else:
                     return intensity_value
 
@@ -821,45 +867,90 @@ class IntensityMapGUI:
         except Exception as e:
             print(f"Error sending Stop to Picoharp: {e}")
 
-    def update_intensity_plot(self, x, y, intensity_value):
+    def fit_live(self, key, raw_data, method, pixels):
+        """
+        Fitted map after the (x, y) pixels of raw_data changed. Plane and
+        parabolic fits keep running sums and are updated with these pixels
+        only; the other methods are applied to the whole map.
+        """
+        order = self.live_fit_orders.get(method)
+        if order is None:
+            self.live_fits.pop(key, None)
+            if method in self.line_fit_methods:
+                buffer = self.fit_buffers.get(key)
+                if buffer is None or buffer.shape != raw_data.shape:
+                    buffer = np.empty(raw_data.shape)
+                    self.fit_buffers[key] = buffer
+                return self.fitting_methods[method](raw_data, out=buffer)
+            return self.fitting_methods.get(method, twoDfittings.raw)(raw_data)
+        source, fit = self.live_fits.get(key, (None, None))
+        if source is not raw_data or fit.order != order:
+            fit = IncrementalSurfaceFit.from_data(raw_data, order)  # New map or method: start from the scanned pixels
+            self.live_fits[key] = (raw_data, fit)
+        else:
+            for x, y in pixels:
+                fit.add(x, y, raw_data[y, x])
+        return fit.subtract(raw_data)
+
+    def autoscale_limits(self, key, fitted_data, pixels, method):
+        """Colour limits over the scanned pixels of the map (see AutoScale)."""
+        mode = self.autoscale_mode.get()
+        local = method == "Raw"  # Every other processing also changes the earlier pixels
+        scale = self.autoscales.get(key)
+        if scale is None or scale.shape != fitted_data.shape:
+            scale = AutoScale(fitted_data.shape, mode)
+            self.autoscales[key] = scale
+            self.autoscale_local.pop(key, None)
+        first = (fitted_data.shape[1] - 1, 0) if self.scan_mode.get() == "Backward" else (0, 0)
+        if first in pixels:
+            scale.reset()  # New frame
+            scale.mode = mode
+            pixels = pixels[pixels.index(first):]
+        elif scale.mode != mode or self.autoscale_local.get(key) != local:
+            scale.set_mode(mode, fitted_data, local)  # Rebuild the statistics from the valid pixels
+        self.autoscale_local[key] = local
+        return scale.update(fitted_data, pixels, local)
+
+    def headroom(self, vmax):
+        """Extra range above the maximum in Min/Max mode, so the colorbar does not change every pixel."""
+        return vmax*(1+self.color_scale) if self.autoscale_mode.get() == "Min/Max" else vmax
+
+    def update_intensity_plot(self, x, y, intensity_value, lifetime=None):
         if self.is_running:
             frame_size = int(self.pixel.get())
             
             if self.raw_intensity1.shape != (frame_size, frame_size):
                 new_intensity_data = np.zeros((frame_size, frame_size))
                 self.raw_intensity1 = new_intensity_data
+                self.raw_lifetime = np.zeros((frame_size, frame_size))
                 self.im1.set_data(new_intensity_data)
                 self.im1.set_extent((0, frame_size, 0, frame_size))
                 self.ax1.set_xlim(0, frame_size)
                 self.ax1.set_ylim(0, frame_size)
-                self.ax1.figure.canvas.draw_idle()
+                self.pending_pixels[1] = []
+                self.renderer.invalidate()
 
             self.raw_intensity1[y, x] = intensity_value
-            fitted_data1 = self.fitting_methods.get(self.fitting1.get(), twoDfittings.raw)(self.raw_intensity1)
-            self.im1.set_data(fitted_data1)
-            if self.manual_colorbar1 == False:
-                if self.scan_mode.get() == "Backward":
-                    if y == 0 and x == frame_size-1:
-                        self.min1 = fitted_data1[y, x]
-                        self.max1 = fitted_data1[y, x]
-                    else:
-                        val = fitted_data1[y, x]
-                        self.min1 = min(self.min1, val)
-                        self.max1 = max(self.max1, val)
-                else:
-                    if y == 0 and x == 0:
-                        self.min1 = fitted_data1[y, x]
-                        self.max1 = fitted_data1[y, x]
-                    else:
-                        val = fitted_data1[y, x]
-                        self.min1 = min(self.min1, val)
-                        self.max1 = max(self.max1, val)
-                vmin=self.min1
-                vmax=self.max1*(1+self.color_scale)
-                self.im1.set_clim(vmin=vmin, vmax=vmax)
-                self.vmin1.set(vmin)
-                self.vmax1.set(vmax)
-            self.canvas.draw_idle()
+            if lifetime is not None:
+                self.raw_lifetime[y, x] = lifetime
+            self.pending_pixels[1].append((x, y))
+            self.renderer.request(1, self.refresh_intensity_plot)  # Refit and repaint once per frame, not per pixel
+
+    def refresh_intensity_plot(self):
+        pixels, self.pending_pixels[1] = self.pending_pixels[1], []
+        if not pixels:
+            return
+        fitted_data1 = self.fit_live(1, self.photon_map(), self.fitting1.get(), pixels)
+        self.im1.set_data(fitted_data1)
+        if self.manual_colorbar1 == False:
+            self.min1, self.max1 = self.autoscale_limits(1, fitted_data1, pixels, self.fitting1.get())
+            vmin=self.min1
+            vmax=self.headroom(self.max1)
+            self.im1.set_clim(vmin=vmin, vmax=vmax)
+            self.vmin1.set(vmin)
+            self.vmax1.set(vmax)
+            self.renderer.invalidate()  # Colorbar range changed
+        self.renderer.mark(self.im1)
 
     def on_click(self, event):
         #if event.inaxes:
@@ -914,12 +1005,8 @@ class IntensityMapGUI:
         frame = self.parse_input(self.frame.get())
         pixel = int(self.pixel.get())        
         resolution = frame / pixel
-        start_x = center_x - (frame / 2)  # Start from the left
-        start_y = center_y + (frame / 2)  # Start from the top
-        
-        current_x = start_x + x * resolution
-        current_y = start_y - (frame-y-1) * resolution
-        cur_x, cur_y = self.rotate_point(current_x, current_y, center_x, center_y, rotation*(-1))
+        # Click y counts up from the bottom of the map, scan grid rows count down from the top
+        cur_x, cur_y = (float(v) for v in pixel_grid(center_x, center_y, frame, pixel, rotation)[pixel - 1 - y, x])
 
         dx = cur_x - float(self.current_x.get())
         dy = cur_y - float(self.current_y.get())
@@ -933,26 +1020,8 @@ class IntensityMapGUI:
         intensity1 = self.im1.get_array()[y, x]
         self.intensity1.set(self.format_output(intensity1))  # Update intensity for the first map
 
-        # Redraw the canvas with updated crosshairs
-        self.canvas.draw()
-
-    def rotate_point(self, x, y, cx=0, cy=0, angle=0):
-        # Convert angle to radians
-        theta = math.radians(angle)
-
-        # Translate point back to origin
-        x_shifted = x - cx
-        y_shifted = y - cy
-
-        # Apply rotation matrix
-        x_rotated = x_shifted * math.cos(theta) - y_shifted * math.sin(theta)
-        y_rotated = x_shifted * math.sin(theta) + y_shifted * math.cos(theta)
-
-        # Translate back to original position
-        x_new = x_rotated + cx
-        y_new = y_rotated + cy
-
-        return x_new, y_new
+        # Repaint only the crosshair
+        self.renderer.mark(self.crosshair1)
 
     def parse_input(self, input_str):
         if input_str.strip() in ['0', '-0']:
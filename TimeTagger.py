@@ -6,15 +6,25 @@ from tkinter import ttk, filedialog, messagebox
 import tkinter.font as tkfont
 import struct
 import socket
-import select
 import threading
-import random
 import time
 import re
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import csv
 from matplotlib.ticker import FuncFormatter
+from photon_stream import pack_frame, end_frame, pack_line, pack_decays, SUBSCRIBE_REPLY
+from tagger_protocol import CommandParser, HELLO_REPLY, pack_g2
+from photon_tools import PhotonStream, MAX_SYNC_EVENTS, sync_divider
+from tagger_server import TaggerServer
+from trace_store import TimeTraceStore
+from t2_file import T2Capture
+from correlator import Correlator, MultiTauCorrelator
+from render_scheduler import RenderScheduler
+from live_plot import LivePlot, minmax_decimate, pixel_width
+from ui_bridge import UIBridge
+
+SI_PREFIXES = {9: 'G', 6: 'M', 3: 'K', 0: '', -3: 'm', -6: 'u', -9: 'n', -12: 'p'}  # Exponent: prefix
 
 def on_closing():
     plt.close('all')  # Close all matplotlib plots
@@ -26,6 +36,8 @@ class MeasurementApp:
         self.root = root
         self.root.title("Time Tagger App")
         self.root.geometry("1600x1080")
+        self.ui = UIBridge(self.root)  # Server and worker threads post GUI updates here
+        self.ui.start()
         
         # Set font to Arial 18 for all widgets
         self.arr18 = ('Arial', 18)
@@ -37,15 +49,30 @@ class MeasurementApp:
         self.style.configure('TButton', font=self.arr18)
         self.style.configure('TCombobox', font=self.arr18)
 
-        self.server_socket = None
-        self.client_socket = None
-        self.server_thread = False
+        self.server = None
         self.server_running = False
+        self.photon_stream = None  # Raw T2 photon counting for the pixel clock ('P')
+        self.photon_owner = None  # Client that armed it
+        self.correlator = None  # Local g2 of the Correlation tab
+        self.multitau = None  # Multi-tau correlation of all channel pairs, also served by 'G'
+        self.correlation_lock = threading.Lock()
+        self.restart_lock = threading.Lock()  # One 'M' time trace restart at a time
+        self.histogram_running = False
+        self.hist_times = np.empty(0)  # Lifetime histogram: bin start times (ns) and counts of channels 1-4
+        self.hist_counts = np.zeros((4, 0))
+        self.hist_buffers = np.zeros((2, 4, 0))
+        self.capture = None  # Raw T2 capture to disk
+        self.window_line = 0
         
         # Initialize Picoquant
         self.sn = snp.snAPI()
         self.sn.getDevice()
         self.sn.initDevice(MeasMode.T2)
+
+        # Time trace bins are acquired once into a ring buffer shared by the plot, saving and the TCP server
+        self.trace_store = TimeTraceStore(self.sn.timeTrace)
+        self.trace_store.add_listener(self.publish_bins)  # Runs while a time trace is measured
+        self.trace_bins = None  # Bins shown in the Time Trace tab
         
         self.entries={}
         self.color_map = ['cornflowerblue', 'tomato', 'green', 'orange']
@@ -64,10 +91,7 @@ class MeasurementApp:
         self.default_ref_channel = "Sync"
         self.default_start_channel = "Channel 1"
         self.default_stop_channel = "Channel 2"
-        self.last_si_scale_x = None
-        self.last_si_scale_y = None
-        self.si_offset_text_y = None
-        self.si_offset_text_x = None
+        self.si_scales = {}  # (axes, 'x' or 'y'): (decade, prefix, label) of the SI scale shown
         
         self.counts = []
         self.times = []
@@ -167,6 +191,10 @@ class MeasurementApp:
             "port_number": port_number,
         })
 
+        # Raw T2 events streamed to a chunked capture file (see t2_file)
+        self.capture_button = tk.Button(config_frame, text="Record Raw T2", bg="orange", fg="white", width=20, font=self.arr18, command=self.toggle_capture)
+        self.capture_button.grid(row=row + 1, column=1, padx=10, pady=5)
+
     def create_time_trace_tab(self, notebook):
         time_trace_frame = ttk.Frame(notebook)
         notebook.add(time_trace_frame, text="Time Trace")
@@ -209,6 +237,11 @@ class MeasurementApp:
         self.fig_time_trace, self.ax_time_trace = plt.subplots(figsize=(15.8, 7.4))
         self.canvas_time_trace = FigureCanvasTkAgg(self.fig_time_trace, master=time_trace_frame)
         self.canvas_time_trace.get_tk_widget().grid(row=5, column=0, columnspan=2, padx=5, pady=5)   
+
+        # Live lines are blitted from the Tk main loop; the axes are redrawn only when limits or labels change
+        self.trace_renderer = RenderScheduler(self.root, self.canvas_time_trace)
+        self.trace_plot = LivePlot(self.ax_time_trace, self.trace_renderer)
+        self.trace_renderer.start()
         
         # Save button
         self.time_trace_save = tk.Button(time_trace_frame, text="Save Data", bg="blue", fg="white", font=self.arr18, command=lambda: self.save_data("time_trace"))
@@ -248,6 +281,9 @@ class MeasurementApp:
         self.fig_histogram, self.ax_histogram = plt.subplots(figsize=(15.8, 7.4))
         self.canvas_histogram = FigureCanvasTkAgg(self.fig_histogram, master=histogram_frame)
         self.canvas_histogram.get_tk_widget().grid(row=5, column=0, columnspan=2, padx=5, pady=5)
+        self.histogram_renderer = RenderScheduler(self.root, self.canvas_histogram)
+        self.histogram_steps = {}  # Step artist of each channel, blitted by the renderer
+        self.histogram_renderer.start()
         
         # Save button
         self.histogram_save = tk.Button(histogram_frame, text="Save Data", bg="blue", fg="white", font=self.arr18, command=lambda: self.save_data("histogram"))
@@ -285,6 +321,11 @@ class MeasurementApp:
         ttk.Label(correlation_frame, text="Acquisition Size (ms):").grid(row=5, column=0, padx=5, pady=5, sticky="w")
         cor_acquisition_time = ttk.Entry(correlation_frame, font=self.arr18)
         cor_acquisition_time.grid(row=5, column=0, padx=5, pady=5)
+
+        # Linear: one start/stop pair; Multi-tau: log-spaced lags from the bin width to 1 s, all pairs of channels 1-4
+        cor_mode = ttk.Combobox(correlation_frame, values=["Linear", "Multi-tau"], state="readonly", font=self.arr18)
+        cor_mode.grid(row=4, column=1, padx=5, pady=5)
+        cor_mode.set("Linear")
         cor_acquisition_time.insert(0, self.default_acquisition_time)
 
         self.entries.update({
@@ -292,7 +333,8 @@ class MeasurementApp:
             "cor_stop_channel": cor_stop_channel,
             "cor_bin_width": cor_bin_width,
             "cor_window_size": cor_window_size,
-            "cor_acquisition_time": cor_acquisition_time
+            "cor_acquisition_time": cor_acquisition_time,
+            "cor_mode": cor_mode
         })
         
         # Start/Stop Button
@@ -303,6 +345,9 @@ class MeasurementApp:
         self.fig_correlation, self.ax_correlation = plt.subplots(figsize=(15.8, 7))
         self.canvas_correlation = FigureCanvasTkAgg(self.fig_correlation, master=correlation_frame)
         self.canvas_correlation.get_tk_widget().grid(row=7, column=0, columnspan=2, padx=5, pady=5)
+        self.correlation_renderer = RenderScheduler(self.root, self.canvas_correlation)
+        self.correlation_plot = LivePlot(self.ax_correlation, self.correlation_renderer)
+        self.correlation_renderer.start()
         
         # Save button
         self.correlation_save = tk.Button(correlation_frame, text="Save Data", bg="blue", fg="white", font=self.arr18, command=lambda: self.save_data("correlation"))
@@ -315,92 +360,258 @@ class MeasurementApp:
             return  # Prevent multiple instances
 
         try:
-            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.server_socket.bind((self.ip_address, port))
-            self.server_socket.listen(5)
+            self.server = TaggerServer(self.ip_address, port, self.handle_input, self.client_closed, self.serve_windows)
+            self.server.start()
             self.server_running = True
             self.allow_connections = True
             print(f"TCP/IP Server started on port {port}")
-
-            # Start server loop in a separate thread
-            server_thread = threading.Thread(target=self.server_loop, daemon=True)
-            server_thread.start()
         except Exception as e:
             print(f"Error starting server: {e}")
 
-    def server_loop(self):
-        while self.server_running:
-            if not self.allow_connections:
-                time.sleep(1)  # Prevents unnecessary CPU usage
-                continue  # Skip accepting new clients
-
-            ready, _, _ = select.select([self.server_socket], [], [], 2.0)
-            if ready:
-                try:
-                    self.client_socket, addr = self.server_socket.accept()
-                    print(f"Connection from {addr}")
-                    self.client_socket.settimeout(5.0)
-                    self.handle_client()
-                except socket.error as e:
-                    print(f"Error accepting client: {e}")
-
-    def handle_client(self):
+    def handle_input(self, conn):
+        """
+        Runs every complete command buffered for a client (legacy or framed,
+        see tagger_protocol), in order. While a command of this client runs
+        in the background ('M'), its next commands wait in conn.commands;
+        the server calls this again when it is done.
+        """
+        if conn.parser is None:
+            conn.parser = CommandParser()
+        conn.commands.extend(conn.parser.feed(conn.inbuf))
+        while conn.commands and not conn.busy:
+            command, args = conn.commands.popleft()
+            if command == 'H':
+                conn.send(HELLO_REPLY.pack(b'OK', args))
+            elif command == 'M':
+                self.handle_M_command(conn, args)
+            elif command == 'P':
+                self.handle_P_command(conn, *args)
+            elif command == 'W':
+                self.handle_W_command(conn, *args)
+            elif command == 'F':
+                self.handle_F_command(conn, *args)
+            elif command == 'D':
+                self.handle_D_command(conn)
+            elif command == 'S':
+                self.handle_S_command(conn)
+            elif command == 'B':
+                self.handle_B_command(conn)
+            elif command == 'G':
+                self.handle_G_command(conn)
+            elif command == 'U':
+                self.stop_stream(conn)
+                if conn is self.photon_owner:
+                    self.stop_photons()
+
+    def client_closed(self, conn):
+        self.stop_stream(conn, send_end=False)
+        if conn is self.photon_owner:
+            self.stop_photons(send_end=False)
+
+    def handle_M_command(self, conn, number):
+        """
+        Restarts the time trace with a history of number / 20 s. The device
+        is reconfigured on a worker thread, so the server keeps serving the
+        other clients; this client's next commands wait for the 'OK'.
+        """
+        self.stop_photons()
+        conn.busy = True
+        threading.Thread(target=self.restart_time_trace, args=(conn, number), daemon=True).start()
+
+    def restart_time_trace(self, conn, number):
+        """Worker of the 'M' command: stops all measurements, starts the time trace and replies."""
         try:
-            while self.server_running and self.allow_connections:
-                ready_client, _, _ = select.select([self.client_socket], [], [], 2.0)
-                if ready_client:
-                    prefix = self.client_socket.recv(1).decode('utf-8')
-                    if not prefix:
-                        print("Client disconnected")
-                        break
-
-                    if prefix == 'M':
-                        #print("M_command")
-                        self.handle_M_command()
-                    elif prefix == 'D':
-                        #print("D_command")
-                        self.handle_D_command()
-                    elif prefix == 'S':
-                        #print("S_command")
-                        self.handle_S_command()
-        except (ConnectionResetError, BrokenPipeError, OSError) as e:
-            print(f"Client error: {e}")
+            acquisition_time = int(self.entries["tt_acquisition_time"].get())
+            with self.restart_lock:
+                # Explicitly stop all ongoing activities and update button states
+                self.stop_measurement("time_trace")
+                self.stop_measurement("histogram")
+                self.stop_measurement("correlation")
+                # Update buttons to reflect stopped state
+                self.ui.post(self.time_trace_button.config, text="Start", bg="green")
+                self.ui.post(self.histogram_button.config, text="Start", bg="green")
+                self.ui.post(self.correlation_button.config, text="Start", bg="green")
+
+                window = float(number / 20)
+                time.sleep(0.5)
+                self.sn.timeTrace.setNumBins(100)
+                self.sn.timeTrace.setHistorySize(window)
+                self.sn.timeTrace.measure(acquisition_time, waitFinished=False, savePTU=False)
+                self.trace_store.start()
+            conn.send(b'OK')
+        except Exception as e:
+            print(f"M command error: {e}")
+            conn.closed = True  # The server loop closes the connection
         finally:
-            if self.client_socket:
-                self.client_socket.close()
-                self.client_socket = None
+            conn.busy = False
+            self.server.resume(conn)
 
-    def handle_M_command(self):
-        # Explicitly stop all ongoing activities and update button states
-        self.stop_measurement("time_trace")
-        self.stop_measurement("histogram")
-        self.stop_measurement("correlation")
-        # Update buttons to reflect stopped state
-        self.time_trace_button.config(text="Start", bg="green")
-        self.histogram_button.config(text="Start", bg="green")
-        self.correlation_button.config(text="Start", bg="green")
-
-        number_data = bytearray()
-        while True:
-            byte = self.client_socket.recv(1)
-            if byte.decode('utf-8') == 'M':  # stop reading at non-digit or connection end  
-                break
-            number_data.extend(byte)
-        number_str = int(number_data.decode('utf-8').strip())
-        window = float(number_str / 20)
-        time.sleep(0.5)
-        self.sn.timeTrace.setNumBins(100)
-        self.sn.timeTrace.setHistorySize(window)
-        self.sn.timeTrace.measure(int(self.entries["tt_acquisition_time"].get()), waitFinished=False, savePTU=False)
-        self.client_socket.sendall(b'OK')
-
-    def handle_D_command(self):
-        counts, times = self.sn.timeTrace.getData()
-        self.client_socket.sendall(struct.pack('!I', int(counts[1][-1])))
-
-    def handle_S_command(self):
+    def handle_D_command(self, conn):
+        conn.send(struct.pack('!I', int(self.trace_store.latest(1))))
+
+    def handle_S_command(self, conn):
+        self.stop_stream(conn)
+        self.stop_photons()
         self.stop_measurement("time_trace")
-        self.client_socket.sendall(b'OK')
+        conn.send(b'OK')
+
+    def handle_G_command(self, conn):
+        """Replies with the latest multi-tau g2 of every pair with photons (see tagger_protocol)."""
+        curves = {}
+        tau = np.empty(0)
+        with self.correlation_lock:
+            if self.multitau is not None:
+                for pair in self.multitau.active_pairs():
+                    tau, curves[pair] = self.multitau.g2(pair)
+        conn.send(pack_g2(tau, curves))
+
+    def handle_B_command(self, conn):
+        """Subscribes the client to the binary count stream (see photon_stream)."""
+        with conn.lock:
+            conn.send(SUBSCRIBE_REPLY.pack(b'OK', time.time()))
+            conn.subscribed = True
+            conn.seq = 0
+
+    def stop_stream(self, conn, send_end=True):
+        """Stops pushing frames to a client; the end frame tells it the stream is over."""
+        with conn.lock:
+            if not conn.subscribed:
+                return
+            conn.subscribed = False
+            if send_end:
+                conn.send(end_frame(conn.seq))
+
+    def publish_bins(self, times, counts, bin_width, wall_offset):
+        """
+        Pushes new time-trace bins of all channels to the subscribed clients
+        (listener of the trace store). A client whose send buffer is full
+        misses frames; the others and the acquisition are not slowed down.
+        """
+        if self.server is None:
+            return
+        counts = counts.T
+        for conn in self.server.connections():
+            with conn.lock:
+                if conn.subscribed and conn.send(pack_frame(conn.seq, counts, times[0], bin_width, wall_offset), push=True):
+                    conn.seq += 1
+        self.server.wake()
+
+    def handle_P_command(self, conn, n_pixels, channel, marker):
+        """
+        Arms pixel-clock counting from raw T2 timestamps (see photon_stream):
+        P<n_pixels>,<channel>,<marker>P. With a marker channel every completed
+        line is pushed to the client; with marker 0 the client asks for the
+        counts of its dwell windows with 'W', or their FLIM decays with 'F'
+        (microtimes from the sync, channel 0). The T2 reader is owned by one
+        client at a time; others are refused, as is everyone during a raw capture or a g2 measurement.
+        The device is set up on a worker thread like 'M'; this client's next
+        commands wait for the reply.
+        """
+        if (self.photon_owner is not None and self.photon_owner is not conn) or self.capture is not None or self.correlation_running:
+            conn.send(SUBSCRIBE_REPLY.pack(b'NO', time.time()))
+            return
+
+        self.photon_owner = conn  # Claims the T2 reader while it is armed
+        conn.busy = True
+        threading.Thread(target=self.arm_photons, args=(conn, n_pixels, channel, marker), daemon=True).start()
+
+    def arm_photons(self, conn, n_pixels, channel, marker):
+        """Worker of the 'P' command: restarts the T2 reader with a sync divider for the laser rate and replies."""
+        try:
+            acquisition_time = int(self.entries["tt_acquisition_time"].get())
+            with self.restart_lock:
+                self.stop_photons(send_end=False)
+                self.photon_owner = conn
+                self.stop_measurement("time_trace")
+                self.ui.post(self.time_trace_button.config, text="Start", bg="green")
+                sync_rate = self.sn.getCountRates()[0]
+                divider = sync_divider(sync_rate)  # Keeps the sync events the reader handles below MAX_SYNC_EVENTS
+                if sync_rate / divider > MAX_SYNC_EVENTS:
+                    print(f"Sync rate {sync_rate:.3g}/s is above the supported {MAX_SYNC_EVENTS * divider:.3g}/s: FLIM decays will lag")
+                self.sn.device.setSyncDiv(divider)
+                photons = PhotonStream(self.sn.unfold, channel=channel, marker_channel=marker or None,
+                                       n_pixels=n_pixels, on_line=self.send_line if marker else None,
+                                       sync_channel=0, sync_divider=divider)
+                photons.start(acquisition_time)
+                self.window_line = 0
+                self.photon_stream = photons
+                if conn.closed:  # Gone while arming: client_closed found nothing to stop
+                    self.stop_photons(send_end=False)
+                    return
+            conn.send(SUBSCRIBE_REPLY.pack(b'OK', time.time()))
+        except Exception as e:
+            print(f"P command error: {e}")
+            conn.closed = True  # The server loop closes the connection
+        finally:
+            conn.busy = False
+            self.server.resume(conn)
+
+    def handle_W_command(self, conn, starts, ends):
+        """Queues a window request; serve_windows replies once the photons of the windows are in."""
+        conn.windows.append((starts, ends, time.time() + 0.5, None))
+        self.serve_windows()
+
+    def handle_F_command(self, conn, starts, ends, bin_width, n_bins):
+        """Queues a FLIM request (decay histograms of the windows, bin_width in ps), served like 'W'."""
+        conn.windows.append((starts, ends, time.time() + 0.5, (bin_width, n_bins)))
+        self.serve_windows()
+
+    def serve_windows(self):
+        """Replies to the pending 'W' and 'F' requests whose windows are covered (or timed out), in order."""
+        for conn in self.server.connections():
+            while conn.windows:
+                starts, ends, deadline, flim = conn.windows[0]
+                photons = self.photon_stream if conn is self.photon_owner else None
+                if photons is not None and len(ends) and not photons.covers(ends.max()) and time.time() <= deadline:
+                    break
+                conn.windows.pop(0)
+                if flim is not None:
+                    decays = photons.decays(starts, ends, *flim) if photons is not None else np.zeros((len(starts), flim[1]), dtype=np.int64)
+                    conn.send(pack_decays(self.window_line, decays))
+                else:
+                    counts = photons.count(starts, ends) if photons is not None else np.zeros(len(starts), dtype=np.int64)
+                    conn.send(pack_line(self.window_line, counts))
+                self.window_line += 1
+
+    def send_line(self, index, counts):
+        """Pushes a line completed from the pixel-clock markers (reader thread of the PhotonStream)."""
+        conn = self.photon_owner
+        if conn is not None:
+            conn.send(pack_line(index, counts))
+            self.server.wake()
+
+    def stop_photons(self, send_end=True):
+        """Stops raw photon counting; in marker mode an empty line frame ends the pushed lines."""
+        if self.photon_stream is None:
+            self.photon_owner = None  # Also releases a claim whose reader is not armed yet
+            return
+        photons, self.photon_stream = self.photon_stream, None
+        conn, self.photon_owner = self.photon_owner, None
+        photons.stop()
+        if photons.sync_divider != 1:
+            self.sn.device.setSyncDiv(1)  # The histogram and correlation tabs need every sync
+        if send_end and photons.binner is not None:
+            conn.send(pack_line(0, []))
+
+    def toggle_capture(self):
+        """Starts or stops streaming raw T2 events to a capture file."""
+        if self.capture is None:
+            if self.photon_stream is not None or self.correlation_running:
+                messagebox.showwarning("Raw T2", "The T2 reader is in use.")
+                return
+            filename = filedialog.asksaveasfilename(defaultextension=".t2", filetypes=[("T2 capture", "*.t2")])
+            if not filename:
+                return
+            self.stop_measurement("time_trace")
+            self.time_trace_button.config(text="Start", bg="green")
+            self.capture = T2Capture(self.sn.unfold, filename)
+            self.capture.start(int(self.entries["tt_acquisition_time"].get()))
+            self.capture_button.config(text="Stop Recording", bg="red")
+        else:
+            capture, self.capture = self.capture, None
+            capture.stop()
+            print(f"Raw T2 capture: {capture.events} events written")
+            self.capture_button.config(text="Record Raw T2", bg="orange")
 
     # Toggle function that starts or stops the TCP/IP server based on the button state
     def toggle_tcp_enable(self, button):
@@ -419,6 +630,7 @@ class MeasurementApp:
             else:
                 button.config(text="Enable TCP/IP", bg="green")
                 self.allow_connections = True   # Allow new clients to connect
+            self.server.set_accepting(self.allow_connections)
 
     def toggle_enable(self, button, trigger_mode, trigger_level, offset, label):
         # Convert label to numeric value using the dictionary
@@ -470,15 +682,36 @@ class MeasurementApp:
             window_size = float(self.entries["tt_window_size"].get())
             num_bins = int(window_size*1000/bin_width)
             acquisition_time = int(self.entries["tt_acquisition_time"].get())
+            self.trace_bins = num_bins
 
             self.sn.timeTrace.stopMeasure()
             self.sn.timeTrace.clearMeasure()
             self.sn.timeTrace.setNumBins(num_bins)
             self.sn.timeTrace.setHistorySize(window_size)
             self.sn.timeTrace.measure(acquisition_time, waitFinished=False, savePTU=False)
+            self.trace_store.start()
 
             self.measure_time_trace()
         elif tab == "histogram":
+            self.histogram_running = True
+            ref = self.entries["hist_ref_channel"].get()
+            ref_channel = 0 if ref == "Sync" else int(ref.split()[-1])
+            bin_width = int(self.entries["hist_bin_width"].get())
+            acquisition_time = int(self.entries["hist_acquisition_time"].get())
+
+            self.sn.histogram.stopMeasure()
+            self.sn.histogram.clearMeasure()
+            self.sn.histogram.setRefChannel(ref_channel)
+            self.sn.histogram.setBinWidth(bin_width)
+            self.sn.histogram.measure(acquisition_time, waitFinished=False, savePTU=False)
+
+            data, bins = self.sn.histogram.getData()
+            self.hist_times = np.asarray(bins, dtype=float) * 1e-3  # ps to ns
+            self.hist_buffers = np.zeros((2, 4, len(self.hist_times)))  # Filled in turn: the main loop draws one while the other is refilled
+            self.hist_counts = self.hist_buffers[0]
+            edges = np.append(self.hist_times, self.hist_times[-1] + bin_width * 1e-3) if len(self.hist_times) else np.zeros(1)
+            self.histogram_renderer.request("setup", self.setup_histogram_plot, edges)
+
             self.measure_histogram()
         elif tab == "correlation":
             self.correlation_running = True
@@ -488,12 +721,26 @@ class MeasurementApp:
             window_size = int(self.entries["cor_window_size"].get())*500
             acquisition_time = int(self.entries["cor_acquisition_time"].get())
 
-            self.sn.correlation.stopMeasure()
-            self.sn.correlation.clearMeasure()
-            self.sn.correlation.setG2Parameters(start_channel_num, stop_channel_num, window_size, bin_width)
-            self.sn.correlation.measure(acquisition_time, waitFinished=False, savePTU=False)
-
-            self.measure_correlation(start_channel_num, stop_channel_num)
+            if self.photon_stream is not None or self.capture is not None:
+                print("Correlation: the T2 reader is in use")
+                self.correlation_running = False
+                self.ui.post(self.correlation_button.config, text="Start", bg="green")
+                return
+
+            # g2 is computed locally from the raw T2 events (see correlator), so the bin width can be coarsened live
+            multitau = self.entries["cor_mode"].get() == "Multi-tau"
+            with self.correlation_lock:
+                if multitau:
+                    self.multitau = MultiTauCorrelator(channels=(1, 2, 3, 4), tau0=bin_width, tau_max=10**12)
+                else:
+                    self.correlator = Correlator([(start_channel_num, stop_channel_num)], bin_width, window_size)
+            self.sn.unfold.stopMeasure()
+            self.sn.unfold.measure(acquisition_time, waitFinished=False, savePTU=False)
+
+            if multitau:
+                self.measure_multitau()
+            else:
+                self.measure_correlation(start_channel_num, stop_channel_num)
     
     def stop_measurement(self, tab):
         # Stop the measurement by setting the stop flag
@@ -501,99 +748,200 @@ class MeasurementApp:
         if tab == "time_trace":
             self.time_trace_running = False
             self.sn.timeTrace.stopMeasure()
+            self.trace_store.stop()
         elif tab == "histogram":
+            self.histogram_running = False
             self.sn.histogram.stopMeasure()
         elif tab == "correlation":
             self.correlation_running = False
-            self.sn.correlation.stopMeasure()   
+            self.sn.unfold.stopMeasure()   
     
     def measure_time_trace(self):
-        y_data_list = []
-        lines = {}
-        self.ax_time_trace.clear()
-        self.canvas_time_trace.draw()
-        self.counts, self.times = self.sn.timeTrace.getData()
-        #
-        ## Plot each selected channel
-        for ch in range(1, 5):
-            if self.selected_channels[ch].get():
-                line, = self.ax_time_trace.plot([], [], label=f"Channel {ch}", color=self.color_map[ch - 1])
-                lines[ch] = line
-                y_data_list.append(self.counts[ch])  # Add for scaling
-
-        # Set labels and title
-        self.set_si_scaled_axis(self.ax_time_trace, y_data_list, axis='y', label="Photon Count Rate (Cnt/s)", fontsize=18, fontname='Arial')
-        self.ax_time_trace.set_xlabel("Time (s)", fontsize=18, fontname='Arial')
-        self.ax_time_trace.set_title("Time Trace", fontsize=18, fontname='Arial')
-        self.ax_time_trace.tick_params(axis='both', which='major', labelsize=18)
-        self.ax_time_trace.legend(loc='upper right', frameon=False)
+        """
+        Live time trace of the selected channels. This thread only reads the
+        ring buffer and decimates the window to the plot width; the lines are
+        set and blitted from the Tk main loop (see LivePlot).
+        """
+        channels = [ch for ch in range(1, 5) if self.selected_channels[ch].get()]
+        self.trace_renderer.request("setup", self.setup_time_trace_plot, channels, float(self.entries["tt_window_size"].get()))
 
         while self.time_trace_running:
             finished = self.sn.timeTrace.isFinished()
-            self.counts, self.times = self.sn.timeTrace.getData()
-
-            y_data_list = [self.counts[ch] for ch in lines]
-            self.set_si_scaled_axis(self.ax_time_trace, y_data_list, axis='y', label="Photon Count Rate (Cnt/s)", fontsize=18, fontname='Arial')
-            for ch, line in lines.items():
-                line.set_data(self.times, self.counts[ch])
+            self.times, self.counts = self.trace_store.window(self.trace_bins)  # Views of the ring buffer, no getData copy
 
-            self.ax_time_trace.relim()
-            self.ax_time_trace.autoscale_view()
-            self.canvas_time_trace.draw()
+            width = pixel_width(self.ax_time_trace)
+            traces = {ch: minmax_decimate(self.times, self.counts[ch], width) for ch in channels}
+            self.trace_renderer.request("trace", self.draw_time_trace, traces)
 
-            # Update the canvas
             time.sleep(0.1)            
             if finished or not self.time_trace_running:
                 self.time_trace_running = False
-                self.time_trace_button.config(text="Start", bg="green")
+                self.trace_store.stop()
+                self.ui.post(self.time_trace_button.config, text="Start", bg="green")
                 break
         #print("out of measure_time_trace")
 
+    def setup_time_trace_plot(self, channels, window_size):
+        self.trace_plot.clear()
+        self.si_scales.pop((self.ax_time_trace, 'y'), None)
+        self.trace_plot.follow = window_size
+        for ch in channels:
+            self.trace_plot.add_line(ch, label=f"Channel {ch}", color=self.color_map[ch - 1])
+        self.ax_time_trace.set_xlabel("Time (s)", fontsize=18, fontname='Arial')
+        self.ax_time_trace.set_title("Time Trace", fontsize=18, fontname='Arial')
+        self.ax_time_trace.tick_params(axis='both', which='major', labelsize=18)
+        if channels:
+            self.ax_time_trace.legend(loc='upper right', frameon=False)
+
+    def draw_time_trace(self, traces):
+        """Updates the time trace lines from {channel: (times, counts)} (Tk main loop)."""
+        self.trace_plot.update(traces)
+        if self.set_si_scaled_axis(self.ax_time_trace, [counts for _, counts in traces.values()], axis='y', label="Photon Count Rate (Cnt/s)", fontsize=18, fontname='Arial'):
+            self.trace_renderer.invalidate()
+
     def measure_histogram(self):
-        self.stop_flag = False
-        for i in range(100):  # Simulating 100 data points
-            if self.stop_flag:
-                break
-            self.data["histogram"].append(random.random())
-            self.update_plot("histogram")
+        """
+        TCSPC lifetime histogram of channels 1-4 from sn.histogram, on a log
+        scale, started by start_measurement. The step artists are created
+        once on the Tk main loop; this thread copies the counts into the
+        two preallocated buffers in turn and hands the filled one to the
+        renderer, which sets the step heights and blits them (a full redraw
+        only when the y range or the legend changes).
+        """
+        filled = 0
+        while self.histogram_running:
+            finished = self.sn.histogram.isFinished()
+            data, bins = self.sn.histogram.getData()
+            data = np.asarray(data)
+            if data.ndim == 2 and data.shape[1] == self.hist_buffers.shape[2]:
+                filled = 1 - filled
+                np.copyto(self.hist_buffers[filled], data[1:5])
+                self.hist_counts = self.hist_buffers[filled]
+                self.histogram_renderer.request("counts", self.draw_histogram, self.hist_counts)
+
             time.sleep(0.1)
-    
-    def measure_correlation(self, start_ch, stop_ch):
-        self.counts, self.times = self.sn.correlation.getG2Data()
+            if finished or not self.histogram_running:
+                self.histogram_running = False
+                self.ui.post(self.histogram_button.config, text="Start", bg="green")
+                break
 
-        self.ax_correlation.clear()
-        self.canvas_correlation.draw()
-        line, = self.ax_correlation.plot([], [])
+    def setup_histogram_plot(self, edges):
+        """Clears the histogram axes and creates the (hidden) step artists of channels 1-4 (Tk main loop)."""
+        self.histogram_renderer.remove_artists(*self.histogram_steps.values())
+        self.ax_histogram.clear()
+        self.histogram_steps = {}
+        for ch in range(1, 5):
+            step = self.ax_histogram.stairs(np.zeros(len(edges) - 1), edges, baseline=None, label=f"Channel {ch}", color=self.color_map[ch - 1])
+            step.set_visible(False)
+            self.histogram_steps[ch] = step
+        self.histogram_renderer.add_artists(*self.histogram_steps.values())
+        self.ax_histogram.set_yscale('log')
+        self.ax_histogram.set_xlim(edges[0], edges[-1])
+        self.ax_histogram.set_ylim(0.8, 10)
+        self.ax_histogram.set_xlabel("Time (ns)", fontsize=18, fontname='Arial')
+        self.ax_histogram.set_ylabel("Counts", fontsize=18, fontname='Arial')
+        self.ax_histogram.set_title("Lifetime Histogram", fontsize=18, fontname='Arial')
+        self.ax_histogram.tick_params(axis='both', which='major', labelsize=18)
+
+    def draw_histogram(self, counts):
+        """Sets the step heights from counts (4, n_bins) (Tk main loop)."""
+        changed = False
+        for ch, step in self.histogram_steps.items():
+            if counts[ch - 1].any():
+                step.set_data(counts[ch - 1])
+                if not step.get_visible():
+                    step.set_visible(True)
+                    self.ax_histogram.legend(loc='upper right', frameon=False)
+                    changed = True
+        top = counts.max() if counts.size else 0
+        if top > self.ax_histogram.get_ylim()[1]:
+            self.ax_histogram.set_ylim(0.8, 10 ** np.ceil(np.log10(top * 1.5)))
+            changed = True
+        if changed:
+            self.histogram_renderer.invalidate()
+        else:
+            self.histogram_renderer.mark(*self.histogram_steps.values())
 
-        # Set labels and title
-        self.set_si_scaled_axis(self.ax_correlation, self.times, axis='x', label="Time (s)", fontsize=18, fontname='Arial')
-        self.ax_correlation.set_ylabel("Coincidence", fontsize=18, fontname='Arial')
-        self.ax_correlation.set_title("Correlation Function g2", fontsize=18, fontname='Arial')
-        self.ax_correlation.tick_params(axis='both', which='major', labelsize=18)
+    def measure_correlation(self, start_ch, stop_ch):
+        pair = (start_ch, stop_ch)
+        self.times, self.counts = self.correlator.g2(pair)
+        self.correlation_renderer.request("setup", self.setup_correlation_plot, "Correlation Function g2", "Coincidence", 'linear')
 
         while self.correlation_running:
             rates = self.sn.getCountRates()
             try:
-                self.start_count_label.config(text=self.format_rate(rates[start_ch]))
-                self.stop_count_label.config(text=self.format_rate(rates[stop_ch]))
+                self.ui.post(self.start_count_label.config, text=self.format_rate(rates[start_ch]))
+                self.ui.post(self.stop_count_label.config, text=self.format_rate(rates[stop_ch]))
             except Exception as e:
-                self.start_count_label.config(text="--")
-                self.stop_count_label.config(text="--")
+                self.ui.post(self.start_count_label.config, text="--")
+                self.ui.post(self.stop_count_label.config, text="--")
             
-            finished = self.sn.correlation.isFinished()
-            self.counts, self.times = self.sn.correlation.getG2Data()
+            finished = self.sn.unfold.isFinished()
+            times, channels = self.sn.unfold.getBlock()
+            self.correlator.add(times, channels)
+            try:
+                bin_width = int(self.entries["cor_bin_width"].get())  # Coarser multiples re-bin without re-acquiring
+            except ValueError:
+                bin_width = None
+            if finished:
+                self.correlator.flush()
+            self.times, self.counts = self.correlator.g2(pair, bin_width)
 
-            line.set_data(self.times, self.counts)
-            self.ax_correlation.relim()
-            self.ax_correlation.autoscale_view()
-            self.canvas_correlation.draw()
+            curve = minmax_decimate(self.times, self.counts, pixel_width(self.ax_correlation))
+            self.correlation_renderer.request("g2", self.draw_correlation, {pair: curve}, False)
 
             time.sleep(0.1)            
             if finished or not self.correlation_running:
                 self.correlation_running = False
-                self.correlation_button.config(text="Start", bg="green")
+                self.ui.post(self.correlation_button.config, text="Start", bg="green")
                 break
     
+    def measure_multitau(self):
+        """Multi-tau g2 of every channel pair with photons, on a log lag axis."""
+        self.correlation_renderer.request("setup", self.setup_correlation_plot, "Multi-tau Correlation", "g2", 'log')
+
+        while self.correlation_running:
+            finished = self.sn.unfold.isFinished()
+            times, channels = self.sn.unfold.getBlock()
+            with self.correlation_lock:
+                self.multitau.add(times, channels)
+                if finished:
+                    self.multitau.flush()
+                curves = {pair: self.multitau.g2(pair) for pair in self.multitau.active_pairs()}
+
+            if curves:
+                self.times = next(iter(curves.values()))[0]
+                self.counts = np.column_stack([g2 for _, g2 in curves.values()])
+                self.correlation_renderer.request("g2", self.draw_correlation, curves, True)
+
+            time.sleep(0.1)
+            if finished or not self.correlation_running:
+                self.correlation_running = False
+                self.ui.post(self.correlation_button.config, text="Start", bg="green")
+                break
+
+    def setup_correlation_plot(self, title, ylabel, xscale):
+        self.correlation_plot.clear()
+        self.si_scales.pop((self.ax_correlation, 'x'), None)
+        self.ax_correlation.set_xscale(xscale)
+        if xscale == 'log':
+            self.ax_correlation.set_xlabel("Lag (s)", fontsize=18, fontname='Arial')
+        self.ax_correlation.set_ylabel(ylabel, fontsize=18, fontname='Arial')
+        self.ax_correlation.set_title(title, fontsize=18, fontname='Arial')
+        self.ax_correlation.tick_params(axis='both', which='major', labelsize=18)
+
+    def draw_correlation(self, curves, multitau):
+        """Updates the g2 lines from {pair: (tau, g2)} (Tk main loop); the linear lag axis is SI-scaled."""
+        for pair in curves:
+            if pair not in self.correlation_plot.lines:
+                label = f"Ch{pair[0]}" if pair[0] == pair[1] else f"Ch{pair[0]} \u2192 Ch{pair[1]}"  # Ch a -> Ch b: b delayed by the lag
+                self.correlation_plot.add_line(pair, label=label)
+                if multitau:
+                    self.ax_correlation.legend(loc='upper right', frameon=False)
+        self.correlation_plot.update(curves)
+        if not multitau and self.set_si_scaled_axis(self.ax_correlation, [tau for tau, _ in curves.values()], axis='x', label="Time (s)", fontsize=18, fontname='Arial'):
+            self.correlation_renderer.invalidate()
+
     def update_plot(self, tab):
         if tab == "time_trace":   
             self.update_time_trace()
@@ -619,16 +967,14 @@ class MeasurementApp:
             if tab == "time_trace":
                 with open(filename + "_time_trace_data.txt", 'w', newline='') as file:
                     writer = csv.writer(file, delimiter='\t')
-                    #counts, times = self.sn.timeTrace.getData()
-                    writer.writerows(np.column_stack((self.times, self.counts[1])))
+                    times, counts = self.trace_store.window(self.trace_bins)
+                    writer.writerows(np.column_stack((times, counts[1])))
                 self.fig_time_trace.savefig(filename + "_time_trace_plot.png", dpi=300, bbox_inches="tight", pad_inches=0.2)
             elif tab == "histogram":
-                if filename:
-                    with open(filename, 'w', newline='') as file:
-                        writer = csv.writer(file)
-                        writer.writerow(["Histogram Data"])
-                        writer.writerows([[x] for x in self.data["histogram"]])
-                    messagebox.showinfo("Save Data", "Data saved successfully!")
+                with open(filename + "_histogram_data.txt", 'w', newline='') as file:
+                    writer = csv.writer(file, delimiter='\t')
+                    writer.writerows(np.column_stack((self.hist_times, self.hist_counts.T)))
+                self.fig_histogram.savefig(filename + "_histogram_plot.png", dpi=300, bbox_inches="tight", pad_inches=0.2)
             elif tab == "correlation":
                 with open(filename + "_g2_data.txt", 'w', newline='') as file:
                     writer = csv.writer(file, delimiter='\t')
@@ -645,33 +991,35 @@ class MeasurementApp:
             return f"{input_value:.0f} Hz"
 
     def get_si_scale(self, data_max):
-        if data_max >= 1e9:
-            return 1e9, '×1G', 'G'
-        if data_max >= 1e6:
-            return 1e6, '×1M', 'M'
-        elif data_max >= 1e3:
-            return 1e3, '×1K', 'K'
-        elif data_max >= 1:
-            return 1, '', ''
-        elif data_max >= 1e-3:
-            return 1e-3, '×1m', 'm'
-        elif data_max >= 1e-6:
-            return 1e-6, '×1u', 'u'
-        elif data_max >= 1e-9:
-            return 1e-9, '×1n', 'n'
-        elif data_max >= 1e-12:
-            return 1e-12, '×1p', 'p'
-        else:
+        if not np.isfinite(data_max) or data_max < 1e-12:
             return 1, '', ''  # fallback
+        exponent = min(3 * int(np.floor(np.log10(data_max) / 3)), 9)
+        prefix = SI_PREFIXES[exponent]
+        return (10.0 ** exponent, f'×1{prefix}', prefix) if prefix else (1, '', '')
 
     def set_si_scaled_axis(self, ax, data, axis='y', label=None, fontname="Arial", fontsize=14):
-        if isinstance(data, (list, tuple)) and not isinstance(data[0], (int, float, np.number)):
+        """
+        SI prefix of the tick labels and label of an axis, from the maximum
+        of the data. The decision is cached per axis and only remade when the
+        maximum crosses a decade; the formatter and label are only replaced
+        when the prefix changes. Returns True if they were (the axes need a
+        full redraw).
+        """
+        if isinstance(data, (list, tuple)) and (not data or not isinstance(data[0], (int, float, np.number))):
             y_data_list = data
         else:
             y_data_list = [data]
 
-        data_max = max(np.nanmax(np.abs(np.array(dat))) for dat in y_data_list)
+        data_max = max((np.nanmax(np.abs(np.asarray(dat))) for dat in y_data_list if np.size(dat)), default=0.0)
+        decade = int(np.floor(np.log10(data_max))) if np.isfinite(data_max) and data_max > 0 else None
+        key = (ax, axis)
+        cached = self.si_scales.get(key)
+        if cached is not None and cached[0] == decade and cached[2] == label:
+            return False
         scale, offset_label, prefix = self.get_si_scale(data_max)
+        self.si_scales[key] = (decade, prefix, label)
+        if cached is not None and cached[1] == prefix and cached[2] == label:
+            return False
 
         def formatter(val, _):
             return f"{int(round(val / scale))}"
@@ -693,6 +1041,7 @@ class MeasurementApp:
                 ax.set_xlabel(new_label, fontsize=fontsize, fontname=fontname)
         else:
             raise ValueError("axis must be 'x' or 'y'")   
+        return True
             
     def split_label_units(self, label):
         match = re.match(r'(.+?)\s*\((.+?)\)', label)
@@ -0,0 +1,177 @@
+import numpy as np
+
+AUTOSCALE_MODES = ("Min/Max", "Percentile")
+
+class P2Quantile:
+    """
+    Streaming estimate of the p-quantile with the P² algorithm (Jain and
+    Chlamtac): five markers are adjusted with a piecewise-parabolic
+    prediction, so each sample costs O(1) and no samples are stored.
+
+    Parameters
+    p : quantile in [0, 1]
+    """
+    def __init__(self, p):
+        self.p = p
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.q = []                                                             # marker heights
+        self.n = [1, 2, 3, 4, 5]                                                # marker positions
+        p = self.p
+        self.desired = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, x):
+        x = float(x)
+        self.count += 1
+        q = self.q
+        if self.count <= 5:
+            q.append(x)
+            q.sort()
+            return
+        n = self.n
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+        for i in (1, 2, 3):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                height = self.parabolic(i, d)
+                if not q[i - 1] < height < q[i + 1]:
+                    height = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])   # Linear fallback keeps the markers ordered
+                q[i] = height
+                n[i] += d
+
+    def parabolic(self, i, d):
+        q, n = self.q, self.n
+        return q[i] + d / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i]) +
+            (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+
+    def value(self):
+        if not self.q:
+            return 0.0
+        if self.count <= 5:
+            return float(np.percentile(self.q, self.p * 100))
+        return self.q[2]
+
+class AutoScale:
+    """
+    Colour limits of a map being scanned, kept over the scanned (valid)
+    pixels only.
+
+    For data whose pixels do not depend on each other (raw data) the limits
+    are updated per new pixel in O(1): running min/max, or P² sketches of
+    the low/high percentiles. When a global fit changes the earlier pixels
+    too, the limits are recomputed exactly over the valid mask, once per
+    update (i.e. once per displayed frame, not per pixel).
+
+    Non-finite values (NaN from fits, empty pixels) are ignored; until a
+    finite value has been seen the previous limits are returned, (0, 1) at
+    first.
+
+    Parameters
+    shape     : map shape
+    mode      : "Min/Max" or "Percentile"
+    low, high : percentiles used in "Percentile" mode
+    """
+    def __init__(self, shape, mode="Min/Max", low=1.0, high=99.0):
+        self.mode = mode
+        self.low = low
+        self.high = high
+        self.low_sketch = P2Quantile(low / 100)
+        self.high_sketch = P2Quantile(high / 100)
+        self.last_limits = (0.0, 1.0)
+        self.reset(shape)
+
+    def reset(self, shape=None):
+        """Starts a new frame: no valid pixels, empty statistics."""
+        if shape is not None:
+            self.shape = shape
+        self.mask = np.zeros(self.shape, dtype=bool)
+        self.clear_stats()
+
+    def clear_stats(self):
+        self.vmin = np.inf
+        self.vmax = -np.inf
+        self.low_sketch.reset()
+        self.high_sketch.reset()
+
+    def set_mode(self, mode, data, local=True):
+        """Switches mode (or processing) and rebuilds the statistics from the valid pixels of data."""
+        self.mode = mode
+        self.clear_stats()
+        return self.rescan(data, local)
+
+    def update(self, data, pixels, local=True):
+        """
+        Marks the (x, y) pixels as valid and returns the new limits.
+
+        Parameters
+        data   : map as displayed
+        pixels : list of (x, y) updated since the last call
+        local  : True if only these pixels of data changed, False after a global fit
+        """
+        if pixels:
+            xs, ys = zip(*pixels)
+            self.mask[list(ys), list(xs)] = True
+        if not local:
+            return self.rescan(data)
+        if pixels:
+            values = data[list(ys), list(xs)]
+            values = values[np.isfinite(values)]
+        if pixels and len(values):
+            if self.mode == "Percentile":
+                for value in values.tolist():
+                    self.low_sketch.add(value)
+                    self.high_sketch.add(value)
+            self.vmin = min(self.vmin, float(values.min()))
+            self.vmax = max(self.vmax, float(values.max()))
+        return self.limits()
+
+    def rescan(self, data, local=False):
+        """
+        Exact limits over the valid pixels of data (all pixels if none is
+        valid yet). With local=True the percentile sketches are refilled so
+        that later per-pixel updates continue from them.
+        """
+        values = data[self.mask] if self.mask.any() else data.ravel()
+        values = values[np.isfinite(values)]
+        if not len(values):
+            self.clear_stats()
+            return self.limits()
+        self.vmin = float(values.min())
+        self.vmax = float(values.max())
+        if self.mode == "Percentile":
+            self.low_sketch.reset()
+            self.high_sketch.reset()
+            if local:
+                for value in values.tolist():
+                    self.low_sketch.add(value)
+                    self.high_sketch.add(value)
+            low, high = np.percentile(values, [self.low, self.high])
+            self.last_limits = (float(low), float(high))
+            return self.last_limits
+        self.last_limits = (self.vmin, self.vmax)
+        return self.last_limits
+
+    def limits(self):
+        if self.mode == "Percentile" and self.low_sketch.count:
+            self.last_limits = (self.low_sketch.value(), self.high_sketch.value())
+        elif self.vmin <= self.vmax:
+            self.last_limits = (self.vmin, self.vmax)
+        return self.last_limits
@@ -0,0 +1,268 @@
+import numpy as np
+
+def pair_indices(starts, stops, low, high):
+    """
+    Every pair with low <= stop - start < high, from sorted start and stop
+    values: a merge by binary search, O(n + pairs).
+
+    Returns
+    (i, j) : index arrays into starts and stops, one entry per pair
+    """
+    lo = np.searchsorted(stops, starts + low, side='left')
+    hi = np.searchsorted(stops, starts + high, side='left')
+    n = np.maximum(hi - lo, 0)
+    total = int(n.sum())
+    if not total:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    first = np.repeat(lo - (np.cumsum(n) - n), n)                               # index of the first stop of each pair's start, minus its offset
+    return np.repeat(np.arange(len(starts)), n), first + np.arange(total)
+
+def pair_delays(starts, stops, window):
+    """
+    Delays stop - start of every pair within [-window, window), from sorted
+    start and stop times.
+
+    Returns
+    delays : array of int64
+    """
+    i, j = pair_indices(starts, stops, -window, window)
+    return stops[j] - starts[i]
+
+class PairCorrelator:
+    """
+    Start-stop coincidence histogram of one channel pair, built
+    incrementally from sorted T2 timestamps fed in chunks.
+
+    A start event is counted once every stop that can pair with it has
+    arrived (i.e. it is older than the latest event by more than the
+    window); stops are kept only as long as a pending start can use them,
+    so memory stays bounded.
+
+    Parameters
+    start_channel, stop_channel : channels (numbering of unfold.getBlock)
+    bin_width                   : histogram bin width (ps)
+    window                      : delays from -window to +window are kept (ps)
+    """
+    def __init__(self, start_channel, stop_channel, bin_width, window):
+        self.start_channel = start_channel
+        self.stop_channel = stop_channel
+        self.bin_width = int(bin_width)
+        self.n_bins = 2 * -(-int(window) // self.bin_width)
+        self.window = self.n_bins // 2 * self.bin_width
+        self.reset()
+
+    def reset(self):
+        self.histogram = np.zeros(self.n_bins, dtype=np.int64)
+        self.starts = np.empty(0, dtype=np.int64)                               # starts not counted yet
+        self.stops = np.empty(0, dtype=np.int64)
+        self.n_starts = 0                                                       # counted starts
+        self.n_stops = 0
+        self.t_first = None
+        self.t_last = None
+
+    def add(self, times, channels):
+        """Feeds a chunk of events (sorted times, in ps, with their channels)."""
+        if not len(times):
+            return
+        if self.t_first is None:
+            self.t_first = int(times[0])
+        self.t_last = int(times[-1])
+        stops = times[channels == self.stop_channel]
+        self.stops = np.concatenate((self.stops, stops))
+        self.n_stops += len(stops)
+        self.starts = np.concatenate((self.starts, times[channels == self.start_channel]))
+        ready = np.searchsorted(self.starts, self.t_last - self.window, side='right')
+        self.count(self.starts[:ready])
+        self.starts = self.starts[ready:]
+        oldest = self.starts[0] if len(self.starts) else self.t_last
+        self.stops = self.stops[np.searchsorted(self.stops, oldest - self.window, side='left'):]
+
+    def flush(self):
+        """Counts the starts still waiting (end of the data)."""
+        self.count(self.starts)
+        self.starts = self.starts[:0]
+
+    def count(self, starts):
+        if not len(starts):
+            return
+        delays = pair_delays(starts, self.stops, self.window)
+        self.histogram += np.bincount((delays + self.window) // self.bin_width, minlength=self.n_bins)[:self.n_bins]
+        if self.start_channel == self.stop_channel:
+            self.histogram[self.n_bins // 2] -= len(starts)                     # every event pairs with itself at zero delay
+        self.n_starts += len(starts)
+
+    def rebin(self, factor):
+        """Histogram with 'factor' adjacent bins summed (coarser bins, no re-acquisition)."""
+        factor = max(int(factor), 1)
+        n = self.n_bins // factor * factor
+        offset = (self.n_bins - n) // 2
+        return self.histogram[offset:offset + n].reshape(-1, factor).sum(axis=1)
+
+    def g2(self, bin_width=None):
+        """
+        Normalised g2 (1 for uncorrelated light).
+
+        Parameters
+        bin_width : bin width (ps), a multiple of the acquisition bin width; acquisition width if None
+
+        Returns
+        tau : delays of the bin centres (s)
+        g2  : normalised coincidences per bin
+        """
+        factor = 1 if bin_width is None else max(int(round(bin_width / self.bin_width)), 1)
+        counts = self.rebin(factor)
+        width = self.bin_width * factor
+        tau = (np.arange(len(counts)) - len(counts) / 2 + 0.5) * width * 1e-12
+        duration = (self.t_last - self.t_first) if self.t_first is not None else 0
+        if not duration or not self.n_starts or not self.n_stops:
+            return tau, counts.astype(float)
+        expected = self.n_starts * self.n_stops * width / duration              # uncorrelated coincidences per bin
+        return tau, counts / expected
+
+class Correlator:
+    """
+    Several PairCorrelators fed from the same event chunks.
+
+    Parameters
+    pairs     : list of (start_channel, stop_channel)
+    bin_width : histogram bin width (ps)
+    window    : delay range +-window (ps)
+    """
+    def __init__(self, pairs, bin_width, window):
+        self.pairs = {pair: PairCorrelator(pair[0], pair[1], bin_width, window) for pair in pairs}
+
+    def add(self, times, channels):
+        times = np.asarray(times, dtype=np.int64)
+        channels = np.asarray(channels)
+        for correlator in self.pairs.values():
+            correlator.add(times, channels)
+
+    def flush(self):
+        for correlator in self.pairs.values():
+            correlator.flush()
+
+    def reset(self):
+        for correlator in self.pairs.values():
+            correlator.reset()
+
+    def g2(self, pair, bin_width=None):
+        return self.pairs[pair].g2(bin_width)
+
+class MultiTauCorrelator:
+    """
+    Log-spaced (multi-tau) auto- and cross-correlation of every pair of
+    channels, for FCS: lags from tau0 up to tau_max with 'points' lags per
+    octave block, computed from streamed T2 timestamps.
+
+    Pairs are ordered: (a, b) correlates photons of b arriving tau after
+    photons of a, so a cross-correlation is kept both ways and (b, a) is
+    the negative-lag half of (a, b).
+
+    Level k bins the photons of each channel at tau0 * 2**k and correlates
+    the bins at lags j (1 <= j < points on level 0, points/2 <= j < points
+    above). Bins are kept sparse (occupied bins only) and a bin is counted
+    once every bin it can pair with is complete, so each level holds about
+    'points' bins per channel whatever the run length.
+
+    Parameters
+    channels : channels correlated (numbering of unfold.getBlock)
+    tau0     : shortest lag and level-0 bin width (ps)
+    tau_max  : longest lag (ps)
+    points   : lags per level (even)
+    """
+    def __init__(self, channels=(1, 2, 3, 4), tau0=1000, tau_max=10**12, points=16):
+        self.channels = tuple(channels)
+        self.pairs = [(a, b) for a in self.channels for b in self.channels]
+        self.tau0 = int(tau0)
+        self.points = points
+        self.n_levels = 1
+        while self.tau0 * 2 ** (self.n_levels - 1) * points < tau_max:
+            self.n_levels += 1
+        self.lags = [np.arange(1 if k == 0 else points // 2, points) for k in range(self.n_levels)]
+        self.tau = np.concatenate([lags * self.tau0 * 2 ** k for k, lags in enumerate(self.lags)]) * 1e-12
+        self.reset()
+
+    def reset(self):
+        self.products = {pair: np.zeros((self.n_levels, self.points)) for pair in self.pairs}
+        empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+        self.bins = {c: [empty] * self.n_levels for c in self.channels}        # per channel and level: (bin index, count) not yet retired
+        self.boundary = [None] * self.n_levels                                  # bins below are counted
+        self.totals = {c: 0 for c in self.channels}
+        self.t_first = None
+        self.t_last = None
+
+    def add(self, times, channels):
+        """Feeds a chunk of events (sorted times, in ps, with their channels)."""
+        times = np.asarray(times, dtype=np.int64)
+        channels = np.asarray(channels)
+        if not len(times):
+            return
+        if self.t_first is None:
+            self.t_first = int(times[0])
+        self.t_last = int(times[-1])
+        per_channel = {c: times[channels == c] for c in self.channels}
+        for c, t in per_channel.items():
+            self.totals[c] += len(t)
+        for k in range(self.n_levels):
+            width = self.tau0 << k
+            for c, t in per_channel.items():
+                self.bins[c][k] = self.merge(self.bins[c][k], t // width)
+            self.advance(k, self.t_last // width - self.points + 1)
+
+    def flush(self):
+        """Counts the bins still waiting (end of the data)."""
+        for k in range(self.n_levels):
+            self.advance(k, np.iinfo(np.int64).max)
+
+    @staticmethod
+    def merge(bins, index):
+        """Adds the sorted bin indices of new photons to the (index, count) bins of a level."""
+        if not len(index):
+            return bins
+        starts = np.flatnonzero(np.diff(index, prepend=index[0] - 1))
+        new_index = index[starts]
+        new_count = np.diff(np.append(starts, len(index)))
+        old_index, old_count = bins
+        if len(old_index) and old_index[-1] == new_index[0]:
+            old_count = old_count.copy()
+            old_count[-1] += new_count[0]
+            new_index, new_count = new_index[1:], new_count[1:]
+        return np.concatenate((old_index, new_index)), np.concatenate((old_count, new_count))
+
+    def advance(self, k, boundary):
+        """Counts the level-k bins below 'boundary' against their partners, then retires them."""
+        first, last = int(self.lags[k][0]), int(self.lags[k][-1])
+        for a, b in self.pairs:
+            index_a, count_a = self.bins[a][k]
+            ready = np.searchsorted(index_a, boundary, side='left')
+            index_b, count_b = self.bins[b][k]
+            i, j = pair_indices(index_a[:ready], index_b, first, last + 1)
+            if len(i):
+                self.products[(a, b)][k] += np.bincount(index_b[j] - index_a[i], weights=count_a[i] * count_b[j], minlength=self.points)[:self.points]
+        for c in self.channels:
+            index, count = self.bins[c][k]
+            keep = np.searchsorted(index, boundary, side='left')
+            self.bins[c][k] = (index[keep:], count[keep:])
+        self.boundary[k] = boundary
+
+    def g2(self, pair):
+        """
+        Normalised correlation of a pair (1 for uncorrelated signals), b
+        delayed by tau after a; g2((b, a)) gives the lags -tau of (a, b).
+
+        Returns
+        tau : lags (s)
+        g2  : correlation at each lag (zeros until both channels have photons)
+        """
+        a, b = pair
+        duration = (self.t_last - self.t_first) if self.t_first is not None else 0
+        values = []
+        for k, lags in enumerate(self.lags):
+            width = self.tau0 << k
+            expected = self.totals[a] * self.totals[b] * width / duration if duration else 0
+            values.append(self.products[pair][k, lags] / expected if expected else np.zeros(len(lags)))
+        return self.tau, np.concatenate(values)
+
+    def active_pairs(self):
+        """Pairs whose channels both have photons."""
+        return [(a, b) for a, b in self.pairs if self.totals[a] and self.totals[b]]
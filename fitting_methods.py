@@ -1,5 +1,5 @@
+from functools import lru_cache
 import numpy as np
-from scipy.optimize import curve_fit
 
 class twoDfittings:
     """Class containing 2D fitting methods for raster scan data (STM, Optical Intensity, etc.)."""
@@ -22,52 +22,191 @@ class twoDfittings:
         return data - mean_value
 
     @staticmethod
-    def subtract_slope(data):
-        """Subtracts a slope estimated from the average of each row."""
-        rows, cols = data.shape
-        x = np.arange(cols)
-        slope_corrected_data = np.zeros_like(data)
+    def subtract_slope(data, out=None):
+        """Subtracts a least-squares line from each row (all rows solved at once)."""
+        _, pinv, vander = line_basis(data.shape[1])
+        coeffs = data @ pinv.T  # (rows, 2): slope and offset of every row
+        return np.subtract(data, coeffs @ vander.T, out=out)
 
-        for i in range(rows):
-            slope = np.polyfit(x, data[i, :], 1)  # Linear fit (degree 1)
-            slope_corrected_data[i, :] = data[i, :] - (slope[0] * x + slope[1])  # Subtract the slope
+    @staticmethod
+    def subtract_slope_columns(data, out=None):
+        """Subtracts a least-squares line from each column."""
+        _, pinv, vander = line_basis(data.shape[0])
+        coeffs = pinv @ data  # (2, cols)
+        return np.subtract(data, vander @ coeffs, out=out)
 
-        return slope_corrected_data
+    @staticmethod
+    def subtract_line_median(data, out=None):
+        """
+        Line levelling by median of differences: each row is shifted by the
+        median step to the row above, so rows line up with the first one
+        without being pulled by features that cross the lines.
+        """
+        steps = np.zeros(data.shape[0])
+        if data.shape[0] > 1:
+            steps[1:] = np.median(np.diff(data, axis=0), axis=1)
+        return np.subtract(data, np.cumsum(steps)[:, np.newaxis], out=out)
 
     @staticmethod
     def subtract_linear_fit(data):
-        """Performs a least-squares linear plane fit and subtracts it."""
-        rows, cols = data.shape
-        x, y = np.meshgrid(np.arange(cols), np.arange(rows))
-
-        def linear_plane(coords, a, b, c):
-            """Linear plane function: z = a*x + b*y + c"""
-            x, y = coords
-            return a*x + b*y + c
-
-        # Fit the data
-        params, _ = curve_fit(linear_plane, (x.ravel(), y.ravel()), data.ravel())
-
-        # Compute fitted plane
-        fitted_plane = linear_plane((x, y), *params)
-
-        return data - fitted_plane
+        """Performs a least-squares linear plane fit (z = a*x + b*y + c) and subtracts it."""
+        return twoDfittings.subtract_surface(data, 1)
 
     @staticmethod
     def subtract_parabolic_fit(data):
-        """Fits and subtracts a parabolic surface from the data."""
-        rows, cols = data.shape
-        x, y = np.meshgrid(np.arange(cols), np.arange(rows))
+        """Fits and subtracts a parabolic surface (z = a*x^2 + b*y^2 + c*x*y + d*x + e*y + f)."""
+        return twoDfittings.subtract_surface(data, 2)
 
-        def parabolic_surface(coords, a, b, c, d, e, f):
-            """Parabolic surface function: z = a*x^2 + b*y^2 + c*x*y + d*x + e*y + f"""
-            x, y = coords
-            return a*x**2 + b*y**2 + c*x*y + d*x + e*y + f
+    @staticmethod
+    def subtract_linear_fit_masked(data, mask=None):
+        """Plane fit over the scanned pixels only (default: non-zero pixels); the others stay 0."""
+        return twoDfittings.subtract_surface_masked(data, 1, mask)
 
-        # Fit the data
-        params, _ = curve_fit(parabolic_surface, (x.ravel(), y.ravel()), data.ravel())
+    @staticmethod
+    def subtract_parabolic_fit_masked(data, mask=None):
+        """Parabolic fit over the scanned pixels only (default: non-zero pixels); the others stay 0."""
+        return twoDfittings.subtract_surface_masked(data, 2, mask)
 
-        # Compute fitted parabolic surface
-        fitted_parabola = parabolic_surface((x, y), *params)
+    @staticmethod
+    def subtract_surface(data, order):
+        """Least-squares surface of the given order, solved with the cached pseudo-inverse."""
+        design, pinv = surface_basis(*data.shape, order)
+        params = pinv @ data.ravel()
+        return data - (design @ params).reshape(data.shape)
 
-        return data - fitted_parabola
\ No newline at end of file
+    @staticmethod
+    def subtract_surface_masked(data, order, mask=None):
+        """Least-squares surface fitted to the pixels selected by mask."""
+        if mask is None:
+            mask = data != 0
+        design, _ = surface_basis(*data.shape, order)
+        selected = mask.ravel()
+        if not selected.any():
+            return np.zeros_like(data, dtype=float)
+        params = np.linalg.lstsq(design[selected], data.ravel()[selected], rcond=None)[0]
+        fitted = (design @ params).reshape(data.shape)
+        return np.where(mask, data - fitted, 0.0)
+
+@lru_cache(maxsize=8)
+def line_basis(n):
+    """
+    Vandermonde matrix [x, 1] of a degree-1 fit over n points, its
+    pseudo-inverse and the matrix used to evaluate the line, shared by
+    every row (or column) of a map. Cached per length; read-only.
+
+    Returns
+    x      : array of shape (n,)
+    pinv   : array of shape (2, n)
+    vander : array of shape (n, 2)
+    """
+    x = np.arange(n, dtype=float)
+    vander = np.vander(x, 2)
+    pinv = np.linalg.pinv(vander)
+    for array in (x, vander, pinv):
+        array.setflags(write=False)
+    return x, pinv, vander
+
+@lru_cache(maxsize=8)
+def surface_basis(rows, cols, order):
+    """
+    Design matrix of a plane (order=1: x, y, 1) or parabolic surface
+    (order=2: x^2, y^2, x*y, x, y, 1) over a rows x cols map, and its
+    pseudo-inverse. Pixel coordinates are scaled to [-1, 1] so the
+    parabolic system stays well conditioned. Cached per shape, so a fit
+    is a single matrix product; the arrays are read-only.
+
+    Returns
+    design : array of shape (rows*cols, n_terms)
+    pinv   : array of shape (n_terms, rows*cols)
+    """
+    xs = np.linspace(-1.0, 1.0, cols) if cols > 1 else np.zeros(1)
+    ys = np.linspace(-1.0, 1.0, rows) if rows > 1 else np.zeros(1)
+    x, y = (c.ravel() for c in np.meshgrid(xs, ys))
+    if order == 1:
+        design = np.column_stack((x, y, np.ones_like(x)))
+    else:
+        design = np.column_stack((x*x, y*y, x*y, x, y, np.ones_like(x)))
+    pinv = np.linalg.pinv(design)
+    for array in (design, pinv):
+        array.setflags(write=False)
+    return design, pinv
+
+class IncrementalSurfaceFit:
+    """
+    Least-squares plane (order=1) or parabolic surface (order=2) fit that is
+    updated one pixel at a time. The normal equations (sums of basis
+    products and of z times each basis term) are kept as running sums, so
+    adding a pixel costs O(1) and solving is a 3x3 or 6x6 system. Only
+    pixels passed to add() take part in the fit; a pixel that is added
+    again replaces its previous value.
+    """
+
+    def __init__(self, shape, order=1):
+        self.shape = shape
+        self.order = order
+        rows, cols = shape
+        self.n_terms = 3 if order == 1 else 6
+        self.ata = np.zeros((self.n_terms, self.n_terms))
+        self.atz = np.zeros(self.n_terms)
+        self.values = np.zeros(shape)
+        self.mask = np.zeros(shape, dtype=bool)
+        self.params = None
+        # Pixel coordinates scaled to [-1, 1] keep the 6x6 system well conditioned
+        self.xs = np.linspace(-1.0, 1.0, cols) if cols > 1 else np.zeros(1)
+        self.ys = np.linspace(-1.0, 1.0, rows) if rows > 1 else np.zeros(1)
+
+    @classmethod
+    def from_data(cls, data, order=1, mask=None):
+        """Starts a fit from the pixels of data selected by mask (default: non-zero pixels)."""
+        fit = cls(data.shape, order)
+        if mask is None:
+            mask = data != 0
+        rows, cols = np.nonzero(mask)
+        terms = fit.terms(fit.xs[cols], fit.ys[rows])
+        z = data[rows, cols]
+        fit.ata = terms.T @ terms
+        fit.atz = terms.T @ z
+        fit.values[rows, cols] = z
+        fit.mask[rows, cols] = True
+        return fit
+
+    def terms(self, x, y):
+        """Basis terms [x, y, 1] or [x^2, y^2, x*y, x, y, 1] (one row per point)."""
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        ones = np.ones_like(x)
+        if self.order == 1:
+            return np.stack((x, y, ones), axis=-1)
+        return np.stack((x*x, y*y, x*y, x, y, ones), axis=-1)
+
+    def add(self, ix, iy, z):
+        """Adds (or replaces) the value of pixel (row iy, column ix)."""
+        t = self.terms(self.xs[ix], self.ys[iy])
+        if self.mask[iy, ix]:
+            old = self.values[iy, ix]
+            self.atz -= old * t
+        else:
+            self.ata += np.outer(t, t)
+            self.mask[iy, ix] = True
+        self.atz += z * t
+        self.values[iy, ix] = z
+        self.params = None
+
+    def solve(self):
+        """Returns the fit parameters (lowest-norm solution while under-determined)."""
+        if self.params is None:
+            self.params = np.linalg.lstsq(self.ata, self.atz, rcond=None)[0]
+        return self.params
+
+    def value_at(self, ix, iy):
+        """Fitted surface at one pixel."""
+        return float(self.terms(self.xs[ix], self.ys[iy]) @ self.solve())
+
+    def surface(self):
+        """Fitted surface over the whole map."""
+        design, _ = surface_basis(*self.shape, self.order)
+        return (design @ self.solve()).reshape(self.shape)
+
+    def subtract(self, data):
+        """Returns data minus the fitted surface."""
+        return data - self.surface()
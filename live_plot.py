@@ -0,0 +1,114 @@
+import numpy as np
+
+def minmax_decimate(x, y, n_buckets):
+    """
+    Reduces a long trace for display: the samples are split into about
+    n_buckets runs and each run keeps only its minimum and maximum, in their
+    original order, and the first and last samples are always kept (so the
+    x range does not change). Drawn n_buckets pixels wide, the line looks
+    the same as the full trace (peaks and dips are kept) with about
+    2 * n_buckets points.
+
+    Returns
+    x, y : decimated copies (the inputs may be views of a ring buffer)
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    n = len(y)
+    n_buckets = max(int(n_buckets), 1)
+    if n <= 2 * n_buckets:
+        return x.copy(), y.copy()
+    k = n // n_buckets
+    m = n // k * k
+    runs = y[:m].reshape(-1, k)
+    lo, hi = runs.argmin(axis=1), runs.argmax(axis=1)
+    base = np.arange(len(runs)) * k
+    index = np.column_stack((np.minimum(lo, hi) + base, np.maximum(lo, hi) + base)).ravel()
+    if m < n:
+        rest = y[m:]
+        index = np.concatenate((index, m + np.sort([rest.argmin(), rest.argmax()])))
+    index = np.unique(np.concatenate(([0], index, [n - 1])))
+    return x[index], y[index]
+
+def pixel_width(ax):
+    """Width of the axes on the canvas (pixels)."""
+    return max(int(ax.bbox.width), 1)
+
+class LivePlot:
+    """
+    Live line plot on a Matplotlib axes repainted by a RenderScheduler. The
+    line artists are created once and blitted over the cached background;
+    update() only sets their data. The axis limits move in steps with some
+    headroom, so ticks and labels (a full redraw) change only when the data
+    leaves them, not on every update.
+
+    Parameters
+    ax       : axes to draw on
+    renderer : RenderScheduler of the axes' canvas
+    follow   : width of the x range that scrolls with the data (time
+               trace), or None to fit x to the data
+    margin   : relative headroom added around the y range
+    """
+    def __init__(self, ax, renderer, follow=None, margin=0.1):
+        self.ax = ax
+        self.renderer = renderer
+        self.follow = follow
+        self.margin = margin
+        self.lines = {}
+
+    def add_line(self, key, **kwargs):
+        """Creates the line of a trace (kwargs go to ax.plot); returns it."""
+        line, = self.ax.plot([], [], **kwargs)
+        self.renderer.add_artists(line)
+        self.lines[key] = line
+        return line
+
+    def clear(self):
+        """Removes the lines and clears the axes (before a new measurement)."""
+        self.renderer.remove_artists(*self.lines.values())
+        self.lines = {}
+        self.ax.clear()
+        self.renderer.invalidate()
+
+    def update(self, traces):
+        """
+        Sets the data of the lines from {key: (x, y)} (already decimated,
+        see minmax_decimate). Returns True if the limits changed.
+        """
+        for key, (x, y) in traces.items():
+            self.lines[key].set_data(x, y)
+        changed = self.update_limits(traces.values())
+        if changed:
+            self.renderer.invalidate()
+        else:
+            self.renderer.mark(*self.lines.values())
+        return changed
+
+    def update_limits(self, traces):
+        xs = [x for x, y in traces if len(x)]
+        ys = [y[np.isfinite(y)] for x, y in traces if len(y)]
+        ys = [y for y in ys if len(y)]
+        if not xs or not ys:
+            return False
+        x_first = min(float(x[0]) for x in xs)
+        x_last = max(float(x[-1]) for x in xs)
+        y_min = min(float(y.min()) for y in ys)
+        y_max = max(float(y.max()) for y in ys)
+        changed = False
+
+        x_lo, x_hi = self.ax.get_xlim()
+        if self.follow is not None:
+            if not x_lo <= x_last <= x_hi:
+                x_lo = x_last - 0.75 * self.follow                              # scroll by a quarter window at a time
+                self.ax.set_xlim(x_lo, x_lo + self.follow)
+                changed = True
+        elif x_last > x_first and not np.allclose((x_lo, x_hi), (x_first, x_last)):
+            self.ax.set_xlim(x_first, x_last)
+            changed = True
+
+        y_lo, y_hi = self.ax.get_ylim()
+        pad = self.margin * max(y_max - y_min, abs(y_max), 1e-12)
+        if y_min < y_lo or y_max > y_hi or y_hi - y_lo > 2 * (y_max - y_min + 2 * pad):    # shrink once the data uses less than half the range
+            self.ax.set_ylim(y_min - pad, y_max + pad)
+            changed = True
+        return changed
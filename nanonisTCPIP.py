@@ -1,5 +1,142 @@
+import asyncio
 import socket
 import struct
+import time
+import timeit
+import numpy as np
+
+class NanonisCodec:
+    """
+    Binary encoder/decoder for the Nanonis TCP protocol.
+
+    Every field on the wire is big-endian. The 40-byte header is
+    command name (32, zero padded), body size (int32), send response
+    (uint16) and 2 unused bytes. Headers are cached per command so the
+    hot polling calls only pack their arguments.
+    """
+    HEADER_SIZE = 40
+
+    header = struct.Struct(">32siH2x")
+    int32 = struct.Struct(">i")
+    uint16 = struct.Struct(">H")
+    uint32 = struct.Struct(">I")
+    float32 = struct.Struct(">f")
+    float64 = struct.Struct(">d")
+
+    def __init__(self):
+        self._header_cache = {}
+
+    def make_header(self, command_name, body_size, resp=True):
+        """
+        Parameters
+        command_name : name of the Nanonis function
+        body_size    : size of the message body in bytes
+        resp         : tell nanonis to send a response
+
+        Returns
+        header : 40-byte header (bytes)
+        """
+        key = (command_name, body_size, resp)
+        header = self._header_cache.get(key)
+        if header is None:
+            header = self.header.pack(command_name.encode('utf-8'), body_size, int(resp))
+            self._header_cache[key] = header
+        return header
+
+    def make_message(self, command_name, body_struct=None, *args, resp=True):
+        """
+        Parameters
+        command_name : name of the Nanonis function
+        body_struct  : precompiled struct.Struct for the arguments (None: no body)
+        args         : argument values packed with body_struct
+
+        Returns
+        message : header + body (bytes)
+        """
+        if body_struct is None:
+            return self.make_header(command_name, 0, resp)
+        return self.make_header(command_name, body_struct.size, resp) + body_struct.pack(*args)
+
+    def make_body_message(self, command_name, body, resp=True):
+        """
+        Parameters
+        command_name : name of the Nanonis function
+        body         : already packed, variable-length body (bytes)
+
+        Returns
+        message : header + body (bytes)
+        """
+        return self.make_header(command_name, len(body), resp) + body
+
+    def pack_int32_array(self, values):
+        """Array size (int32) followed by the values as big-endian int32."""
+        values = np.asarray(values, dtype=">i4")
+        return self.int32.pack(values.size) + values.tobytes()
+
+    def body_size(self, header):
+        """Body size field of a received header."""
+        return self.int32.unpack_from(header, 32)[0]
+
+    def get_int32(self, buf, offset=0):
+        return self.int32.unpack_from(buf, offset)[0]
+
+    def get_uint16(self, buf, offset=0):
+        return self.uint16.unpack_from(buf, offset)[0]
+
+    def get_uint32(self, buf, offset=0):
+        return self.uint32.unpack_from(buf, offset)[0]
+
+    def get_float32(self, buf, offset=0):
+        return self.float32.unpack_from(buf, offset)[0]
+
+    def get_float64(self, buf, offset=0):
+        return self.float64.unpack_from(buf, offset)[0]
+
+    def first_float32(self, bodies):
+        """First float32 of every response body, as a np.float32 array."""
+        return np.fromiter((self.float32.unpack_from(b, 0)[0] for b in bodies), dtype=np.float32, count=len(bodies))
+
+    def check_error(self, response, error_index):
+        """
+        Checks the response from nanonis for error messages
+
+        Parameters
+        response : response body (not inc. header) from nanonis (bytes or memoryview)
+        error_index : index of error status within the body
+
+        Raises
+        Exception   : error message returned from Nanonis
+
+        """
+        i = error_index                                                         # error_index points to start-byte in the body, which is after the 40-byte header
+        error_status = self.get_uint32(response, i)                             # error_status is 4 bytes long
+        
+        if(error_status):
+            i += 8                                                              # index of error description is 8 bytes after error status
+            error_description = bytes(response[i:]).decode()                    # just grab from start index to the end of the message
+            raise Exception(error_description)                                  # raise the exception
+
+    def get_int32_array(self, buf, offset, count):
+        """Zero-copy view of 'count' big-endian int32 values starting at offset."""
+        return np.frombuffer(buf, dtype=">i4", count=count, offset=offset)
+
+    def get_float32_array(self, buf, offset, count):
+        """'count' big-endian float32 values starting at offset, as native np.float32."""
+        return np.frombuffer(buf, dtype=">f4", count=count, offset=offset).astype(np.float32)
+
+    def get_string_array(self, buf, offset, count):
+        """
+        Returns
+        strings : list of 'count' strings, each prefixed by its size (int32)
+        offset  : index of the first byte after the array
+        """
+        strings = []
+        for _ in range(count):
+            size = self.get_int32(buf, offset)
+            offset += 4
+            strings.append(bytes(buf[offset:offset+size]).decode())
+            offset += size
+        return strings, offset
 
 class nanonisTCP:    
     def __init__(self, ip = '127.0.0.1', port = 6501, max_buf_size = 1024):
@@ -8,6 +145,8 @@ class nanonisTCP:
         self.port = port
         self.sock = None
         self.max_buf_size = max_buf_size  # Default buffer size; you can adjust it as needed
+        self.codec = NanonisCodec()
+        self.header_buf = bytearray(NanonisCodec.HEADER_SIZE)                  # Reused for every response header
         
     def connect(self):
         try:
@@ -26,14 +165,37 @@ class nanonisTCP:
             return False
 
     def send_command(self, message):
+        """
+        Parameters
+        message : bytes from NanonisCodec.make_message, or the legacy hex string
+        """
+        if isinstance(message, str):
+            message = bytes.fromhex(message)
         try:
             self.sock.settimeout(2.0)
-            self.sock.sendall(bytes.fromhex(message))
+            self.sock.sendall(message)
         except socket.timeout:
             print("Client 1: Send operation timed out.")
         except socket.error as e:
             print(f"Client 1: Socket error during send: {e}")
 
+    def recv_exact(self, buf):
+        """
+        Fills buf completely from the socket with recv_into (no intermediate
+        copies). Never reads past the end of buf, so back-to-back responses
+        stay separated.
+
+        Parameters
+        buf : writable buffer (bytearray or memoryview) of the exact size to read
+        """
+        view = memoryview(buf)
+        received = 0
+        while received < len(view):
+            n = self.sock.recv_into(view[received:])
+            if n == 0:
+                raise ConnectionError(f"Connection to {self.ip}:{self.port} closed by Nanonis")
+            received += n
+
     def receive_response(self, error_index=-1, keep_header = False):
         """
         Parameters
@@ -41,21 +203,24 @@ class nanonisTCP:
         keep_header : if true: return entire response. if false: return body
         
         Returns
-        response    : either header + body or body only (keep_header)
+        response    : either header + body or body only (keep_header), as a
+                      memoryview over a single buffer
         
         """
         try:
             self.sock.settimeout(2.0)
-            response = self.sock.recv(self.max_buf_size)                               # Read the response
+            header = memoryview(self.header_buf)
+            self.recv_exact(header)                                             # Header is fixed to 40 bytes
+            body_size = self.codec.body_size(header)
+            response = bytearray(NanonisCodec.HEADER_SIZE + body_size)          # Preallocate header + body
+            response[:NanonisCodec.HEADER_SIZE] = header
+            self.recv_exact(memoryview(response)[NanonisCodec.HEADER_SIZE:])    # Read exactly body_size bytes
         except socket.timeout:
-            print("Client 1: Receive operation timed out.")
+            raise TimeoutError("Client 1: Receive operation timed out.")
         except socket.error as e:
-            print(f"Client 1: Socket error during receive: {e}")
-        body_size = self.hex_to_int32(response[32:36])
-        while(True): 
-            if(len(response) == body_size + 40): break                          # body_size + header size (40)
-            response += self.sock.recv(self.max_buf_size)
+            raise ConnectionError(f"Client 1: Socket error during receive: {e}")
         
+        response = memoryview(response)                                         # slices below are zero-copy
         if(error_index > -1): self.check_error(response[40:],error_index)       # error_index < 0 skips error check
         
         if(not keep_header):
@@ -63,25 +228,79 @@ class nanonisTCP:
         
         return response
 
+    def send_many(self, messages):
+        """
+        Sends several messages in one segment without waiting for replies.
+        Read the replies back in the same order with recv_many.
+
+        Parameters
+        messages : list of messages from NanonisCodec.make_message
+        """
+        self.send_command(b"".join(messages))
+
+    def recv_many(self, count, error_index=-1):
+        """
+        Parameters
+        count       : number of responses to read
+        error_index : index of 'error status' within each body. -1 skip check
+
+        Returns
+        bodies : list of response bodies, in request order
+        """
+        return [self.receive_response(error_index) for _ in range(count)]
+
+    def pipeline(self, message, count=None, duration=None, depth=8, error_index=-1):
+        """
+        Repeats the same request with up to 'depth' requests outstanding, so
+        the sample rate is set by the controller instead of the round-trip
+        latency. Stops issuing new requests after 'count' requests or once
+        'duration' has elapsed, then drains the ones still in flight.
+
+        Parameters
+        message     : message from NanonisCodec.make_message
+        count       : total number of requests (None: no limit)
+        duration    : time window for issuing requests in s (None: no limit)
+        depth       : maximum number of outstanding requests
+        error_index : index of 'error status' within each body. -1 skip check
+
+        Returns
+        bodies : list of response bodies, in request order
+        """
+        if count is None and duration is None:
+            raise ValueError("pipeline needs a count or a duration")
+        deadline = None if duration is None else time.perf_counter() + duration
+        bodies = []
+        sent = 0
+
+        def more():
+            if count is not None and sent >= count:
+                return False
+            return deadline is None or time.perf_counter() < deadline
+
+        burst = depth if count is None else min(depth, count)
+        if burst > 0:
+            self.send_command(message * burst)                                  # Fill the pipe in one segment
+            sent += burst
+        while len(bodies) < sent:
+            bodies.append(self.receive_response(error_index))
+            if more():
+                self.send_command(message)                                      # Keep 'depth' requests in flight
+                sent += 1
+        return bodies
+
     def check_error(self,response,error_index):
         """
         Checks the response from nanonis for error messages
 
         Parameters
-        response : response body (not inc. header) from nanonis (bytes)
+        response : response body (not inc. header) from nanonis (bytes or memoryview)
         error_index : index of error status within the body
 
         Raises
         Exception   : error message returned from Nanonis
 
         """
-        i = error_index                                                         # error_index points to start-byte in the body, which is after the 40-byte header
-        error_status = self.hex_to_uint16(response[i:i+4])                      # error_status is 4 bytes long
-        
-        if(error_status):
-            i += 8                                                              # index of error description is 8 bytes after error status
-            error_description = response[i:].decode()                           # just grab from start index to the end of the message
-            raise Exception(error_description)                                  # raise the exception
+        self.codec.check_error(response, error_index)
                 
     def close_socket(self):
         """ Close the socket """
@@ -126,6 +345,8 @@ class nanonisTCP:
         return hex_rep
 
 class FolMe:
+    xy_pos_body = struct.Struct(">ddI")                                         # X (float64), Y (float64), Wait end of move (uint32)
+
     def __init__(self, nanonisTCP):
         self.nanonisTCP = nanonisTCP
 
@@ -142,15 +363,8 @@ class FolMe:
         Wait_end_of_move : False: Selects whether the function  immediately
                            True: Waits until tip stops moving
         """
-        ## Make Header
-        hex_rep = self.nanonisTCP.make_header('FolMe.XYPosSet', body_size=20)
-        
-        ## arguments
-        hex_rep += self.nanonisTCP.float64_to_hex(X)
-        hex_rep += self.nanonisTCP.float64_to_hex(Y)
-        hex_rep += self.nanonisTCP.to_hex(Wait_end_of_move,4)
-        
-        self.nanonisTCP.send_command(hex_rep)
+        message = self.nanonisTCP.codec.make_message('FolMe.XYPosSet', self.xy_pos_body, X, Y, int(Wait_end_of_move))
+        self.nanonisTCP.send_command(message)
         message =  self.nanonisTCP.receive_response(0)
         return message
 
@@ -158,8 +372,12 @@ class Current:
     """
     Nanonis Current Module
     """
+    gain_body = struct.Struct(">H")                                             # Gain index (uint16)
+    calibr_body = struct.Struct(">dd")                                          # Calibration (float64), Offset (float64)
+
     def __init__(self,NanonisTCP):
         self.NanonisTCP = NanonisTCP
+        self.codec = NanonisTCP.codec
     
     def Get(self):
         """
@@ -170,12 +388,23 @@ class Current:
         current : Current value (A)
 
         """
-        ## Make Header
-        hex_rep = self.NanonisTCP.make_header('Current.Get', body_size=0)        
-        self.NanonisTCP.send_command(hex_rep)        
+        self.NanonisTCP.send_command(self.codec.make_message('Current.Get'))
         response = self.NanonisTCP.receive_response(4)        
-        current = self.NanonisTCP.hex_to_float32(response[0:4])        
+        current = self.codec.get_float32(response, 0)
         return current
+
+    def GetMany(self, count=None, duration=None, depth=8):
+        """
+        Pipelined Current.Get: keeps 'depth' requests in flight and returns
+        every sample read within 'count' requests or 'duration' seconds
+
+        Returns
+        -------
+        currents : Current values (A), np.float32 array
+
+        """
+        bodies = self.NanonisTCP.pipeline(self.codec.make_message('Current.Get'), count, duration, depth, error_index=4)
+        return self.codec.first_float32(bodies)
     
     def Get100(self):
         """
@@ -186,11 +415,9 @@ class Current:
         current100 : Current 100 value (A)
 
         """
-        ## Make Header
-        hex_rep = self.NanonisTCP.make_header('Current.100Get', body_size=0)        
-        self.NanonisTCP.send_command(hex_rep)        
+        self.NanonisTCP.send_command(self.codec.make_message('Current.100Get'))
         response = self.NanonisTCP.receive_response(4)        
-        current100 = self.NanonisTCP.hex_to_float32(response[0:4])        
+        current100 = self.codec.get_float32(response, 0)
         return current100
     
     def BEEMGet(self):
@@ -203,11 +430,9 @@ class Current:
         currentBEEM : Current BEEM value (A)
 
         """
-        ## Make Header
-        hex_rep = self.NanonisTCP.make_header('Current.BEEMGet', body_size=0)        
-        self.NanonisTCP.send_command(hex_rep)        
+        self.NanonisTCP.send_command(self.codec.make_message('Current.BEEMGet'))
         response = self.NanonisTCP.receive_response(4)        
-        currentBEEM = self.NanonisTCP.hex_to_float32(response[0:4])        
+        currentBEEM = self.codec.get_float32(response, 0)
         return currentBEEM
     
     def GainSet(self,gain_index):
@@ -220,11 +445,8 @@ class Current:
                      by the function Current.GainsGet
 
         """
-        ## Make Header
-        hex_rep = self.NanonisTCP.make_header('Current.GainSet', body_size=2)        
-        ## Arguments
-        hex_rep += self.NanonisTCP.to_hex(gain_index,2)        
-        self.NanonisTCP.send_command(hex_rep)        
+        message = self.codec.make_message('Current.GainSet', self.gain_body, gain_index)
+        self.NanonisTCP.send_command(message)        
         self.NanonisTCP.receive_response(0)
     
     def GainsGet(self):
@@ -238,23 +460,17 @@ class Current:
         gain_index : index of the selected gain in gains array
 
         """
-        ## Make Header
-        hex_rep = self.NanonisTCP.make_header('Current.GainsGet', body_size=0)        
-        self.NanonisTCP.send_command(hex_rep)        
+        self.NanonisTCP.send_command(self.codec.make_message('Current.GainsGet'))
         response = self.NanonisTCP.receive_response()        
-        # gains_size      = self.NanonisTCP.hex_to_int32(response[0:4])         # Not needed since
-        number_of_gains = self.NanonisTCP.hex_to_int32(response[4:8])           # We know the number of gains
-        
-        idx   = 8
-        gains = []
-        for g in range(number_of_gains):
-            size = self.NanonisTCP.hex_to_int32(response[idx:idx+4])            # And the size of each next gain
-            idx += 4
-            gain = response[idx:idx+size].decode()
-            idx += size
-            gains.append(gain)
-        
-        gain_index = self.NanonisTCP.hex_to_uint16(response[idx:idx+2])        
+        return self.parse_gains(self.codec, response)
+
+    @staticmethod
+    def parse_gains(codec, response):
+        """Decodes the Current.GainsGet body into [gains, gain_index]."""
+        # gains_size      = codec.get_int32(response, 0)                        # Not needed since
+        number_of_gains = codec.get_int32(response, 4)                          # We know the number of gains
+        gains, idx = codec.get_string_array(response, 8, number_of_gains)       # And the size of each next gain
+        gain_index = codec.get_uint16(response, idx)
         return [gains,gain_index]
     
     def CalibrSet(self,calibration,offset):
@@ -268,12 +484,8 @@ class Current:
         offset      : offset (A)
 
         """
-        ## Make Header
-        hex_rep = self.NanonisTCP.make_header('Current.CalibrSet', body_size=16)        
-        ## Arguments
-        hex_rep += self.NanonisTCP.float64_to_hex(calibration)
-        hex_rep += self.NanonisTCP.float64_to_hex(offset)        
-        self.NanonisTCP.send_command(hex_rep)        
+        message = self.codec.make_message('Current.CalibrSet', self.calibr_body, calibration, offset)
+        self.NanonisTCP.send_command(message)        
         self.NanonisTCP.receive_response(0)
     
     def CalibrGet(self):
@@ -287,18 +499,17 @@ class Current:
         offset       : offset (A)
 
         """
-        ## Make Header
-        hex_rep = self.NanonisTCP.make_header('Current.CalibrGet', body_size=0)        
-        self.NanonisTCP.send_command(hex_rep)        
+        self.NanonisTCP.send_command(self.codec.make_message('Current.CalibrGet'))
         response = self.NanonisTCP.receive_response(16)        
-        calibration = self.NanonisTCP.hex_to_float64(response[0:8])
-        offset      = self.NanonisTCP.hex_to_float64(response[8:16])
+        calibration = self.codec.get_float64(response, 0)
+        offset      = self.codec.get_float64(response, 8)
         
         return [calibration,offset]
 
 class ZCtrl:
     def __init__(self, nanonisTCP):
         self.nanonisTCP = nanonisTCP
+        self.codec = nanonisTCP.codec
 
     def ZPosGet(self):
         """
@@ -309,9 +520,488 @@ class ZCtrl:
         zpos : the current z position of the tip
 
         """
-        ## Make Header
-        hex_rep = self.nanonisTCP.make_header('ZCtrl.ZPosGet', body_size=0)
-        self.nanonisTCP.send_command(hex_rep)
+        self.nanonisTCP.send_command(self.codec.make_message('ZCtrl.ZPosGet'))
         response = self.nanonisTCP.receive_response(4)
-        zpos = self.nanonisTCP.hex_to_float32(response[0:4])        
+        zpos = self.codec.get_float32(response, 0)
         return zpos  
+
+    def ZPosGetMany(self, count=None, duration=None, depth=8):
+        """
+        Pipelined ZCtrl.ZPosGet: keeps 'depth' requests in flight and returns
+        every sample read within 'count' requests or 'duration' seconds
+
+        Returns
+        -------
+        zpos : Z positions (m), np.float32 array
+
+        """
+        bodies = self.nanonisTCP.pipeline(self.codec.make_message('ZCtrl.ZPosGet'), count, duration, depth, error_index=4)
+        return self.codec.first_float32(bodies)
+
+class Signals:
+    """
+    Nanonis Signals Module
+    """
+    val_body = struct.Struct(">iI")                                             # Signal index (int), Wait for newest data (uint32)
+
+    def __init__(self, nanonisTCP):
+        self.nanonisTCP = nanonisTCP
+        self.codec = nanonisTCP.codec
+
+    def NamesGet(self):
+        """
+        Returns the signals names list of the 128 signals available in the
+        software. The index of a name is the signal index used by the other
+        functions.
+
+        Returns
+        -------
+        names : list of signal names
+
+        """
+        self.nanonisTCP.send_command(self.codec.make_message('Signals.NamesGet'))
+        response = self.nanonisTCP.receive_response()
+        return self.parse_names(self.codec, response)
+
+    @staticmethod
+    def parse_names(codec, response):
+        """Decodes the Signals.NamesGet body into a list of names."""
+        number_of_names = codec.get_int32(response, 4)
+        names, idx = codec.get_string_array(response, 8, number_of_names)
+        codec.check_error(response, idx)
+        return names
+
+    def ValGet(self, signal_index, wait_for_newest=True):
+        """
+        Returns the value of the selected signal
+
+        Parameters
+        ----------
+        signal_index    : index of the signal (0-127)
+        wait_for_newest : True: wait for the next fresh sample
+
+        Returns
+        -------
+        value : signal value
+
+        """
+        message = self.codec.make_message('Signals.ValGet', self.val_body, signal_index, int(wait_for_newest))
+        self.nanonisTCP.send_command(message)
+        response = self.nanonisTCP.receive_response(4)
+        return self.codec.get_float32(response, 0)
+
+    def ValsGet(self, signal_indexes, wait_for_newest=True):
+        """
+        Returns the values of several signals in one call
+
+        Parameters
+        ----------
+        signal_indexes  : list of signal indexes (0-127)
+        wait_for_newest : True: wait for the next fresh sample
+
+        Returns
+        -------
+        values : signal values, np.float32 array
+
+        """
+        self.nanonisTCP.send_command(self.vals_message(self.codec, signal_indexes, wait_for_newest))
+        response = self.nanonisTCP.receive_response()
+        return self.parse_vals(self.codec, response)
+
+    @staticmethod
+    def vals_message(codec, signal_indexes, wait_for_newest):
+        body = codec.pack_int32_array(signal_indexes) + codec.uint32.pack(int(wait_for_newest))
+        return codec.make_body_message('Signals.ValsGet', body)
+
+    @staticmethod
+    def parse_vals(codec, response):
+        """Decodes the Signals.ValsGet body into a np.float32 array."""
+        size = codec.get_int32(response, 0)
+        codec.check_error(response, 4 + 4*size)
+        return codec.get_float32_array(response, 4, size)
+
+    def find(self, prefix, names=None):
+        """
+        Returns the index of the first signal whose name starts with prefix
+        (e.g. 'Current' or 'Z'), or -1 if there is none
+
+        """
+        if names is None:
+            names = self.NamesGet()
+        return self.find_in(prefix, names)
+
+    @staticmethod
+    def find_in(prefix, names):
+        for index, name in enumerate(names):
+            if name.startswith(prefix):
+                return index
+        return -1
+
+class TipRec:
+    """
+    Nanonis Tip Move Recorder (Follow Me). The controller fills a buffer at
+    its own sample rate; DataGet fetches the whole block in one call.
+    """
+    size_body = struct.Struct(">i")                                             # Buffer size (int)
+
+    def __init__(self, nanonisTCP):
+        self.nanonisTCP = nanonisTCP
+        self.codec = nanonisTCP.codec
+
+    def BufferSizeSet(self, buffer_size):
+        """
+        Sets the buffer size of the Tip Move Recorder. This function clears
+        the graph.
+
+        Parameters
+        ----------
+        buffer_size : number of data elements in the buffer
+
+        """
+        message = self.codec.make_message('TipRec.BufferSizeSet', self.size_body, buffer_size)
+        self.nanonisTCP.send_command(message)
+        self.nanonisTCP.receive_response(0)
+
+    def BufferSizeGet(self):
+        """
+        Returns
+        -------
+        buffer_size : number of data elements in the buffer
+
+        """
+        self.nanonisTCP.send_command(self.codec.make_message('TipRec.BufferSizeGet'))
+        response = self.nanonisTCP.receive_response(4)
+        return self.codec.get_int32(response, 0)
+
+    def BufferClear(self):
+        """
+        Clears the buffer of the Tip Move Recorder
+
+        """
+        self.nanonisTCP.send_command(self.codec.make_message('TipRec.BufferClear'))
+        self.nanonisTCP.receive_response(0)
+
+    def DataGet(self):
+        """
+        Returns the data recorded by the Tip Move Recorder
+
+        Returns
+        -------
+        channel_indexes : signal indexes of the recorded channels, np.int32 array
+        data            : recorded data, np.float32 array of shape
+                          (number of channels, number of samples)
+
+        """
+        self.nanonisTCP.send_command(self.codec.make_message('TipRec.DataGet'))
+        response = self.nanonisTCP.receive_response()
+        return self.parse_data(self.codec, response)
+
+    @staticmethod
+    def parse_data(codec, response):
+        """Decodes the TipRec.DataGet body into [channel_indexes, data]."""
+        number_of_channels = codec.get_int32(response, 0)
+        channel_indexes = codec.get_int32_array(response, 4, number_of_channels).astype(np.int32)
+        idx = 4 + 4*number_of_channels
+        rows = codec.get_int32(response, idx)
+        cols = codec.get_int32(response, idx + 4)
+        idx += 8
+        data = codec.get_float32_array(response, idx, rows*cols).reshape(rows, cols)
+        codec.check_error(response, idx + 4*rows*cols)
+        if rows != number_of_channels:                                          # Keep one row per channel
+            data = data.T
+        return [channel_indexes, data]
+
+    def ChannelGet(self, signal_index):
+        """
+        Returns the samples of one recorded signal, or an empty array if the
+        signal is not among the recorded channels
+
+        Parameters
+        ----------
+        signal_index : index of the signal (see Signals.NamesGet)
+
+        Returns
+        -------
+        samples : np.float32 array
+
+        """
+        channel_indexes, data = self.DataGet()
+        return self.select_channel(channel_indexes, data, signal_index)
+
+    @staticmethod
+    def select_channel(channel_indexes, data, signal_index):
+        match = np.flatnonzero(channel_indexes == signal_index)
+        if match.size == 0:
+            return np.empty(0, dtype=np.float32)
+        return data[match[0]]
+
+class DataLog:
+    """
+    Nanonis Data Logger Module
+    """
+    def __init__(self, nanonisTCP):
+        self.nanonisTCP = nanonisTCP
+        self.codec = nanonisTCP.codec
+
+    def Open(self):
+        """
+        Opens the Data Logger module
+
+        """
+        self.nanonisTCP.send_command(self.codec.make_message('DataLog.Open'))
+        self.nanonisTCP.receive_response(0)
+
+    def Start(self):
+        """
+        Starts the acquisition in the Data Logger module
+
+        """
+        self.nanonisTCP.send_command(self.codec.make_message('DataLog.Start'))
+        self.nanonisTCP.receive_response(0)
+
+    def Stop(self):
+        """
+        Stops the acquisition in the Data Logger module
+
+        """
+        self.nanonisTCP.send_command(self.codec.make_message('DataLog.Stop'))
+        self.nanonisTCP.receive_response(0)
+
+    def ChsSet(self, channel_indexes):
+        """
+        Sets the list of recorded channels in the Data Logger module
+
+        Parameters
+        ----------
+        channel_indexes : list of signal indexes (0-127)
+
+        """
+        body = self.codec.pack_int32_array(channel_indexes)
+        self.nanonisTCP.send_command(self.codec.make_body_message('DataLog.ChsSet', body))
+        self.nanonisTCP.receive_response(0)
+
+    def ChsGet(self):
+        """
+        Returns
+        -------
+        channel_indexes : signal indexes of the recorded channels, np.int32 array
+
+        """
+        self.nanonisTCP.send_command(self.codec.make_message('DataLog.ChsGet'))
+        response = self.nanonisTCP.receive_response()
+        size = self.codec.get_int32(response, 0)
+        self.nanonisTCP.check_error(response, 4 + 4*size)
+        return self.codec.get_int32_array(response, 4, size).astype(np.int32)
+
+class AsyncNanonisTCP:
+    """
+    asyncio client for the Nanonis TCP interface, sharing NanonisCodec with
+    the blocking nanonisTCP class. Requests on one connection are serialised
+    by a lock (Nanonis answers in order); open a second connection on
+    another Nanonis port (6501-6504) to overlap e.g. a tip move with
+    signal reads.
+    """
+    def __init__(self, ip = '127.0.0.1', port = 6501):
+        self.ip = ip
+        self.port = port
+        self.reader = None
+        self.writer = None
+        self.codec = NanonisCodec()
+        self.lock = asyncio.Lock()
+
+    async def connect(self, timeout=5.0):
+        try:
+            self.reader, self.writer = await asyncio.wait_for(asyncio.open_connection(self.ip, self.port), timeout)
+            print(f"Connected to {self.ip}:{self.port}")
+            return True
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"Connection to {self.ip}:{self.port} timed out")
+        except OSError as e:
+            raise ConnectionError(f"Failed to connect to {self.ip}:{self.port}: {e}")
+
+    async def close_socket(self):
+        """ Close the connection """
+        if self.writer:
+            self.writer.close()
+            await self.writer.wait_closed()
+            self.writer = None
+
+    async def read_response(self, error_index=-1, timeout=2.0):
+        """Reads one exact-length response frame and returns its body."""
+        try:
+            header = await asyncio.wait_for(self.reader.readexactly(NanonisCodec.HEADER_SIZE), timeout)
+            body = await asyncio.wait_for(self.reader.readexactly(self.codec.body_size(header)), timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError("Client 1: Receive operation timed out.")
+        except asyncio.IncompleteReadError:
+            raise ConnectionError(f"Connection to {self.ip}:{self.port} closed by Nanonis")
+        body = memoryview(body)
+        if(error_index > -1): self.codec.check_error(body, error_index)
+        return body
+
+    async def query(self, message, error_index=-1):
+        """
+        Parameters
+        message     : message from NanonisCodec.make_message
+        error_index : index of 'error status' within the body. -1 skip check
+
+        Returns
+        response : response body (memoryview)
+        """
+        async with self.lock:
+            self.writer.write(message)
+            await self.writer.drain()
+            return await self.read_response(error_index)
+
+    async def pipeline(self, message, count=None, duration=None, depth=8, error_index=-1):
+        """Async counterpart of nanonisTCP.pipeline."""
+        if count is None and duration is None:
+            raise ValueError("pipeline needs a count or a duration")
+        loop = asyncio.get_running_loop()
+        deadline = None if duration is None else loop.time() + duration
+        bodies = []
+        async with self.lock:
+            sent = depth if count is None else min(depth, count)
+            self.writer.write(message * sent)
+            await self.writer.drain()
+            while len(bodies) < sent:
+                bodies.append(await self.read_response(error_index))
+                if (count is None or sent < count) and (deadline is None or loop.time() < deadline):
+                    self.writer.write(message)
+                    await self.writer.drain()
+                    sent += 1
+        return bodies
+
+class AsyncFolMe(FolMe):
+    async def XYPosSet(self, X, Y, Wait_end_of_move=False):
+        """Coroutine version of FolMe.XYPosSet."""
+        message = self.nanonisTCP.codec.make_message('FolMe.XYPosSet', self.xy_pos_body, X, Y, int(Wait_end_of_move))
+        return await self.nanonisTCP.query(message, 0)
+
+class AsyncCurrent(Current):
+    async def Get(self):
+        """Coroutine version of Current.Get."""
+        response = await self.NanonisTCP.query(self.codec.make_message('Current.Get'), 4)
+        return self.codec.get_float32(response, 0)
+
+    async def GetMany(self, count=None, duration=None, depth=8):
+        """Coroutine version of Current.GetMany."""
+        bodies = await self.NanonisTCP.pipeline(self.codec.make_message('Current.Get'), count, duration, depth, error_index=4)
+        return self.codec.first_float32(bodies)
+
+    async def Get100(self):
+        response = await self.NanonisTCP.query(self.codec.make_message('Current.100Get'), 4)
+        return self.codec.get_float32(response, 0)
+
+    async def BEEMGet(self):
+        response = await self.NanonisTCP.query(self.codec.make_message('Current.BEEMGet'), 4)
+        return self.codec.get_float32(response, 0)
+
+    async def GainSet(self, gain_index):
+        await self.NanonisTCP.query(self.codec.make_message('Current.GainSet', self.gain_body, gain_index), 0)
+
+    async def GainsGet(self):
+        response = await self.NanonisTCP.query(self.codec.make_message('Current.GainsGet'))
+        return self.parse_gains(self.codec, response)
+
+    async def CalibrSet(self, calibration, offset):
+        await self.NanonisTCP.query(self.codec.make_message('Current.CalibrSet', self.calibr_body, calibration, offset), 0)
+
+    async def CalibrGet(self):
+        response = await self.NanonisTCP.query(self.codec.make_message('Current.CalibrGet'), 16)
+        return [self.codec.get_float64(response, 0), self.codec.get_float64(response, 8)]
+
+class AsyncZCtrl(ZCtrl):
+    async def ZPosGet(self):
+        """Coroutine version of ZCtrl.ZPosGet."""
+        response = await self.nanonisTCP.query(self.codec.make_message('ZCtrl.ZPosGet'), 4)
+        return self.codec.get_float32(response, 0)
+
+    async def ZPosGetMany(self, count=None, duration=None, depth=8):
+        """Coroutine version of ZCtrl.ZPosGetMany."""
+        bodies = await self.nanonisTCP.pipeline(self.codec.make_message('ZCtrl.ZPosGet'), count, duration, depth, error_index=4)
+        return self.codec.first_float32(bodies)
+
+class AsyncSignals(Signals):
+    async def NamesGet(self):
+        response = await self.nanonisTCP.query(self.codec.make_message('Signals.NamesGet'))
+        return self.parse_names(self.codec, response)
+
+    async def ValGet(self, signal_index, wait_for_newest=True):
+        message = self.codec.make_message('Signals.ValGet', self.val_body, signal_index, int(wait_for_newest))
+        response = await self.nanonisTCP.query(message, 4)
+        return self.codec.get_float32(response, 0)
+
+    async def ValsGet(self, signal_indexes, wait_for_newest=True):
+        response = await self.nanonisTCP.query(self.vals_message(self.codec, signal_indexes, wait_for_newest))
+        return self.parse_vals(self.codec, response)
+
+    async def find(self, prefix, names=None):
+        if names is None:
+            names = await self.NamesGet()
+        return self.find_in(prefix, names)
+
+class AsyncTipRec(TipRec):
+    async def BufferSizeSet(self, buffer_size):
+        await self.nanonisTCP.query(self.codec.make_message('TipRec.BufferSizeSet', self.size_body, buffer_size), 0)
+
+    async def BufferSizeGet(self):
+        response = await self.nanonisTCP.query(self.codec.make_message('TipRec.BufferSizeGet'), 4)
+        return self.codec.get_int32(response, 0)
+
+    async def BufferClear(self):
+        await self.nanonisTCP.query(self.codec.make_message('TipRec.BufferClear'), 0)
+
+    async def DataGet(self):
+        response = await self.nanonisTCP.query(self.codec.make_message('TipRec.DataGet'))
+        return self.parse_data(self.codec, response)
+
+    async def ChannelGet(self, signal_index):
+        channel_indexes, data = await self.DataGet()
+        return self.select_channel(channel_indexes, data, signal_index)
+
+def benchmark_codec(number=100000):
+    """
+    Micro-benchmark of the binary codec against the legacy hex-string path
+    for the calls made in the scan loop. No connection is needed.
+
+    Returns
+    results : {name: (hex_us, codec_us)} time per call in microseconds
+    """
+    client = nanonisTCP()
+    codec = client.codec
+    reply = codec.make_header('Current.Get', 12) + codec.float32.pack(1.5e-10) + bytes(8)
+
+    def hex_xy():
+        hex_rep = client.make_header('FolMe.XYPosSet', body_size=20)
+        hex_rep += client.float64_to_hex(1.25e-8)
+        hex_rep += client.float64_to_hex(-3.5e-9)
+        hex_rep += client.to_hex(True, 4)
+        return bytes.fromhex(hex_rep)
+
+    def codec_xy():
+        return codec.make_message('FolMe.XYPosSet', FolMe.xy_pos_body, 1.25e-8, -3.5e-9, 1)
+
+    def hex_get():
+        bytes.fromhex(client.make_header('Current.Get', body_size=0))
+        body = reply[40:]
+        client.hex_to_uint16(body[4:8])
+        return client.hex_to_float32(body[0:4])
+
+    def codec_get():
+        codec.make_message('Current.Get')
+        body = memoryview(reply)[40:]
+        codec.get_uint32(body, 4)
+        return codec.get_float32(body, 0)
+
+    assert hex_xy() == codec_xy()
+    results = {}
+    for name, legacy, binary in (("FolMe.XYPosSet", hex_xy, codec_xy), ("Current.Get", hex_get, codec_get)):
+        hex_us = timeit.timeit(legacy, number=number) / number * 1e6
+        codec_us = timeit.timeit(binary, number=number) / number * 1e6
+        results[name] = (hex_us, codec_us)
+        print(f"{name}: hex {hex_us:.2f} us, codec {codec_us:.2f} us ({hex_us / codec_us:.1f}x)")
+    return results
+
+if __name__ == "__main__":
+    benchmark_codec()
@@ -0,0 +1,343 @@
+import struct
+import threading
+import time
+import numpy as np
+
+# Binary count stream of the TimeTagger server ('B' subscribe, 'U' unsubscribe).
+#
+# Subscribe: the client sends b'B'; the server answers b'OK' followed by its
+# wall clock (!d, time.time()), then pushes frames until b'U' is received.
+# Each frame is a header followed by n_bins x n_channels counts (!I, bin
+# major). Row c of the counts is channel c of sn.timeTrace (0 is Sync), the
+# same indexing as the 'D' reply (channel 1). A frame with n_bins = 0 ends
+# the stream.
+#
+# Header: magic, seq, n_channels, n_bins, t_first (measurement time of the
+# first bin, s), bin_width (s), wall_offset (server wall clock minus
+# measurement time, s).
+FRAME_MAGIC = b'TT'
+FRAME_HEADER = struct.Struct('!2sIHHddd')
+SUBSCRIBE_REPLY = struct.Struct('!2sd')
+
+# Pixel-clock counting ('P' arm, 'W' windows, 'U' disarm).
+#
+# Arm: b'P<n_pixels>,<channel>,<marker>P' (ASCII, like 'M'); marker is the
+# marker channel of a hardware pixel clock, or 0 for software windows. The
+# reply is SUBSCRIBE_REPLY. With a pixel clock the server pushes one line
+# frame per completed line; in software mode the client sends b'W', the
+# number of windows (!I) and their (start, end) server wall-clock times
+# (!dd each), and the server answers with one line frame. Line frame:
+# LINE_HEADER (magic, line index, n_pixels) then n_pixels counts (!I); a
+# line frame with n_pixels = 0 ends the pushed lines after b'U'.
+LINE_MAGIC = b'LN'
+LINE_HEADER = struct.Struct('!2sIH')
+WINDOW_COUNT = struct.Struct('!I')
+
+# FLIM decays of software windows ('F', after arming with 'P').
+#
+# The client sends b'F', FLIM_ARGS (microtime bin width in ps, bins per
+# decay), then the windows as for 'W'. The server answers with one decay
+# frame: DECAY_HEADER (magic, line index, n_pixels, n_bins) then
+# n_pixels x n_bins counts (!I, pixel major). Microtimes are measured from
+# the preceding sync event (channel 0 of sn.unfold).
+FLIM_ARGS = struct.Struct('!IH')
+DECAY_MAGIC = b'DK'
+DECAY_HEADER = struct.Struct('!2sIHH')
+
+def pack_line(index, counts):
+    counts = np.asarray(counts)
+    return LINE_HEADER.pack(LINE_MAGIC, index, len(counts)) + counts.astype('>u4').tobytes()
+
+def pack_windows(starts, ends):
+    windows = np.column_stack((starts, ends)).astype('>f8')
+    return b'W' + WINDOW_COUNT.pack(len(windows)) + windows.tobytes()
+
+def unpack_windows(buf, offset=1):
+    """
+    Server side of 'W': parses the windows at 'offset' in buf (after the
+    command byte).
+
+    Returns
+    (starts, ends, size) with size the bytes used from the start of buf, or
+    None if buf does not hold the whole request yet
+    """
+    if len(buf) < offset + WINDOW_COUNT.size:
+        return None
+    n = WINDOW_COUNT.unpack_from(buf, offset)[0]
+    size = offset + WINDOW_COUNT.size + 16 * n
+    if len(buf) < size:
+        return None
+    windows = np.frombuffer(bytes(buf[offset + WINDOW_COUNT.size:size]), dtype='>f8').reshape(n, 2)
+    return windows[:, 0].astype(float), windows[:, 1].astype(float), size
+
+def pack_flim_windows(starts, ends, bin_width, n_bins):
+    """'F' request: windows (s) and decay binning (bin_width in ps)."""
+    return b'F' + FLIM_ARGS.pack(int(bin_width), n_bins) + pack_windows(starts, ends)[1:]
+
+def unpack_flim_windows(buf):
+    """
+    Server side of 'F'.
+
+    Returns
+    (starts, ends, bin_width, n_bins, size), or None if buf does not hold
+    the whole request yet
+    """
+    if len(buf) < 1 + FLIM_ARGS.size:
+        return None
+    bin_width, n_bins = FLIM_ARGS.unpack_from(buf, 1)
+    request = unpack_windows(buf, 1 + FLIM_ARGS.size)
+    if request is None:
+        return None
+    starts, ends, size = request
+    return starts, ends, bin_width, n_bins, size
+
+def pack_decays(index, decays):
+    """Decay frame: decays is an array (n_pixels, n_bins) of counts."""
+    decays = np.asarray(decays)
+    n_pixels, n_bins = decays.shape
+    return DECAY_HEADER.pack(DECAY_MAGIC, index, n_pixels, n_bins) + decays.astype('>u4').tobytes()
+
+def pack_frame(seq, counts, t_first, bin_width, wall_offset):
+    """
+    Packs one frame.
+
+    Parameters
+    seq         : frame number
+    counts      : array (n_bins, n_channels) of counts
+    t_first     : measurement time of the first bin (s)
+    bin_width   : bin width (s)
+    wall_offset : server wall clock minus measurement time (s)
+    """
+    counts = np.asarray(counts)
+    n_bins, n_channels = counts.shape if counts.size else (0, 0)
+    header = FRAME_HEADER.pack(FRAME_MAGIC, seq, n_channels, n_bins, t_first, bin_width, wall_offset)
+    return header + np.rint(counts).astype('>u4').tobytes()
+
+def end_frame(seq):
+    return FRAME_HEADER.pack(FRAME_MAGIC, seq, 0, 0, 0.0, 0.0, 0.0)
+
+def recv_exact(sock, size):
+    buf = bytearray(size)
+    view = memoryview(buf)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:])
+        if n == 0:
+            raise ConnectionError("Socket connection broken")
+        received += n
+    return buf
+
+def read_frame(sock):
+    """
+    Reads one frame.
+
+    Returns
+    header : (seq, n_channels, n_bins, t_first, bin_width, wall_offset)
+    counts : array (n_bins, n_channels) of uint32, or None for the end frame
+    """
+    magic, seq, n_channels, n_bins, t_first, bin_width, wall_offset = FRAME_HEADER.unpack(recv_exact(sock, FRAME_HEADER.size))
+    if magic != FRAME_MAGIC:
+        raise ValueError("Lost count stream framing")
+    header = (seq, n_channels, n_bins, t_first, bin_width, wall_offset)
+    if n_bins == 0:
+        return header, None
+    body = recv_exact(sock, 4 * n_bins * n_channels)
+    counts = np.frombuffer(body, dtype='>u4').reshape(n_bins, n_channels).astype(np.uint32)
+    return header, counts
+
+def read_line(sock):
+    """Reads one line frame; returns (index, counts) or None for the end frame."""
+    magic, index, n_pixels = LINE_HEADER.unpack(recv_exact(sock, LINE_HEADER.size))
+    if magic != LINE_MAGIC:
+        raise ValueError("Lost line framing")
+    if n_pixels == 0:
+        return None
+    counts = np.frombuffer(recv_exact(sock, 4 * n_pixels), dtype='>u4').astype(np.int64)
+    return index, counts
+
+def read_decays(sock):
+    """Reads one decay frame; returns (index, array (n_pixels, n_bins) of int64)."""
+    magic, index, n_pixels, n_bins = DECAY_HEADER.unpack(recv_exact(sock, DECAY_HEADER.size))
+    if magic != DECAY_MAGIC:
+        raise ValueError("Lost decay framing")
+    decays = np.frombuffer(recv_exact(sock, 4 * n_pixels * n_bins), dtype='>u4').astype(np.int64)
+    return index, decays.reshape(n_pixels, n_bins)
+
+class LineCounter:
+    """
+    Client side of pixel-clock counting: exact per-pixel photon counts from
+    the raw T2 timestamps on the server, returned one line at a time.
+
+    With a hardware pixel clock (marker > 0) read_line() returns the lines
+    pushed by the server. Otherwise count_windows() sends the measured
+    dwell windows of a line (client time.time(), shifted by the clock
+    offset estimated when arming) and returns their counts;
+    decay_windows() returns their FLIM decay histograms instead.
+    """
+    def __init__(self, sock):
+        self.sock = sock
+        self.clock_offset = 0.0
+        self.marker = 0
+
+    def arm(self, n_pixels, channel=1, marker=0):
+        self.marker = marker
+        sent = time.time()
+        self.sock.sendall(f"P{n_pixels},{channel},{marker}P".encode('utf-8'))
+        ok, server_time = SUBSCRIBE_REPLY.unpack(recv_exact(self.sock, SUBSCRIBE_REPLY.size))
+        received = time.time()
+        if ok != b'OK':
+            raise ValueError("Pixel counting not accepted")
+        self.clock_offset = server_time - (sent + received) / 2
+
+    def disarm(self):
+        self.sock.sendall(b'U')
+        if self.marker:
+            while read_line(self.sock) is not None:                             # drop lines still in flight
+                pass
+
+    def read_line(self):
+        line = read_line(self.sock)
+        return None if line is None else line[1]
+
+    def count_windows(self, starts, ends):
+        self.sock.sendall(pack_windows(np.asarray(starts) + self.clock_offset, np.asarray(ends) + self.clock_offset))
+        return read_line(self.sock)[1]
+
+    def decay_windows(self, starts, ends, bin_width, n_bins):
+        """Decays (n_windows, n_bins) of dwell windows; bin_width in ps."""
+        self.sock.sendall(pack_flim_windows(np.asarray(starts) + self.clock_offset, np.asarray(ends) + self.clock_offset, bin_width, n_bins))
+        return read_decays(self.sock)[1]
+
+class CountStream:
+    """
+    Client side of the count stream. A reader thread stores the pushed bins
+    in arrays (bin start in the client's wall clock, counts per channel),
+    so a detector can ask for the counts of any recent dwell window after
+    the fact instead of polling per pixel. Only the last 'keep' seconds are
+    kept: when the arrays are full, older bins are dropped in place, and
+    the arrays grow only if 'keep' seconds of bins do not fit.
+
+    The server clock offset is estimated once from the subscribe reply
+    (half the round trip), so windows are given in client time.time().
+
+    Parameters
+    sock     : socket connected to the TimeTagger server
+    capacity : initial number of bins
+    keep     : seconds of bins kept for window requests
+    """
+    def __init__(self, sock, capacity=65536, keep=10.0):
+        self.sock = sock
+        self.capacity = capacity
+        self.keep = keep
+        self.lock = threading.Condition()
+        self.starts = np.empty(capacity)
+        self.counts = None
+        self.size = 0
+        self.bin_width = 0.0
+        self.clock_offset = 0.0                                                 # server wall clock minus client wall clock
+        self.running = False
+        self.thread = None
+        self.frames = 0
+
+    def subscribe(self):
+        sent = time.time()
+        self.sock.sendall(b'B')
+        ok, server_time = SUBSCRIBE_REPLY.unpack(recv_exact(self.sock, SUBSCRIBE_REPLY.size))
+        received = time.time()
+        if ok != b'OK':
+            raise ValueError("Count stream not accepted")
+        self.clock_offset = server_time - (sent + received) / 2
+        self.running = True
+        self.thread = threading.Thread(target=self.read_loop, daemon=True)
+        self.thread.start()
+
+    def unsubscribe(self, timeout=2.0):
+        """Stops the stream; returns once the end frame has been read."""
+        if self.thread is None:
+            return
+        self.sock.sendall(b'U')
+        self.thread.join(timeout)
+        self.thread = None
+
+    def read_loop(self):
+        try:
+            while self.running:
+                header, counts = read_frame(self.sock)
+                if counts is None:
+                    break
+                self.append(header, counts)
+        except (OSError, ValueError) as e:
+            print(f"Count stream error: {e}")
+        finally:
+            self.running = False
+            with self.lock:
+                self.lock.notify_all()
+
+    def append(self, header, counts):
+        _, n_channels, n_bins, t_first, bin_width, wall_offset = header
+        starts = t_first + np.arange(n_bins) * bin_width + wall_offset - self.clock_offset
+        with self.lock:
+            if self.counts is None or self.counts.shape[1] != n_channels:
+                self.counts = np.zeros((len(self.starts), n_channels), dtype=np.uint32)
+                self.size = 0
+            if self.size:
+                starts = np.maximum(starts, self.starts[self.size - 1])         # wall_offset jitter must not move a bin before the last one
+            if self.size + n_bins > len(self.starts):
+                self.discard_before(starts[0] - self.keep)
+            if self.size + n_bins > len(self.starts):
+                capacity = len(self.starts) + max(len(self.starts), n_bins)     # starts and counts always grow together
+                self.starts = np.concatenate((self.starts, np.empty(capacity - len(self.starts))))
+                self.counts = np.concatenate((self.counts, np.zeros((capacity - len(self.counts), n_channels), dtype=np.uint32)))
+            self.starts[self.size:self.size + n_bins] = starts
+            self.counts[self.size:self.size + n_bins] = counts
+            self.size += n_bins
+            self.bin_width = bin_width
+            self.frames += 1
+            self.lock.notify_all()
+
+    def discard_before(self, t):
+        """Drops the bins that end before client time t, moving the rest to the front (lock held)."""
+        first = int(np.searchsorted(self.starts[:self.size], t - self.bin_width, side='right'))
+        if first:
+            self.starts[:self.size - first] = self.starts[first:self.size]
+            self.counts[:self.size - first] = self.counts[first:self.size]
+            self.size -= first
+
+    def wait_until(self, t_end, timeout=1.0):
+        """Waits until bins covering client time t_end have arrived; False on timeout."""
+        deadline = time.time() + timeout
+        with self.lock:
+            while self.running:
+                if self.size and self.starts[self.size - 1] + self.bin_width >= t_end:
+                    return True
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self.lock.wait(remaining)
+        return False
+
+    def window_mean(self, t_start, t_end, channel=1):
+        """
+        Time-weighted mean of the bin values of a channel over [t_start, t_end]
+        (client wall clock); bins partly inside the window count by their overlap.
+        """
+        with self.lock:
+            if not self.size:
+                return 0.0
+            starts = self.starts[:self.size]
+            width = self.bin_width
+            first = max(np.searchsorted(starts, t_start - width, side='right') - 1, 0)
+            last = np.searchsorted(starts, t_end, side='left')
+            if last <= first:
+                return float(self.counts[self.size - 1, channel])
+            begin = starts[first:last]
+            overlap = np.clip(np.minimum(begin + width, t_end) - np.maximum(begin, t_start), 0.0, None)
+            values = self.counts[first:last, channel]
+        total = overlap.sum()
+        if total <= 0:
+            return float(values[-1])
+        return float(np.dot(overlap, values) / total)
+
+    def latest(self, channel=1):
+        with self.lock:
+            return int(self.counts[self.size - 1, channel]) if self.size else 0
@@ -0,0 +1,305 @@
+import bisect
+import threading
+import time
+import numpy as np
+
+PS = 1e-12  # T2 time unit of sn.unfold (ps), in s
+MAX_SYNC_EVENTS = 5e6  # Sync events/s the T2 reader keeps up with; faster lasers use the sync divider
+SYNC_DIVIDERS = (1, 2, 4, 8, 16)
+
+def bin_windows(photon_times, starts, ends):
+    """
+    Photon counts in each [start, end) window.
+
+    Parameters
+    photon_times : sorted photon times
+    starts, ends : window edges (same unit as photon_times)
+
+    Returns
+    counts : array of int64, one per window
+    """
+    photon_times = np.asarray(photon_times)
+    return np.searchsorted(photon_times, ends, side='left') - np.searchsorted(photon_times, starts, side='left')
+
+def sync_divider(sync_rate, max_rate=MAX_SYNC_EVENTS):
+    """
+    Smallest sync divider in SYNC_DIVIDERS that brings the sync events
+    below max_rate (per s); the largest one if none does.
+    """
+    for divider in SYNC_DIVIDERS:
+        if sync_rate / divider <= max_rate:
+            return divider
+    return SYNC_DIVIDERS[-1]
+
+def microtimes(photon_times, sync_times, last_sync=-1, period=None):
+    """
+    Delay of each photon after the preceding sync (laser pulse), from T2
+    times.
+
+    Parameters
+    photon_times : sorted photon times
+    sync_times   : sorted sync times of the same block
+    last_sync    : last sync time of the previous blocks, or -1
+    period       : laser period (same unit) when the sync is divided, so
+                   the delay after the last recorded sync is folded into
+                   one period; None if every pulse is recorded
+
+    Returns
+    microtimes : array of int64, -1 for photons before the first sync
+    """
+    photon_times = np.asarray(photon_times, dtype=np.int64)
+    syncs = np.concatenate(([last_sync], np.asarray(sync_times, dtype=np.int64)))
+    sync = syncs[np.searchsorted(syncs[1:], photon_times, side='right')]       # preceding sync, last_sync before the first one
+    delay = photon_times - sync
+    if period is not None:
+        delay = np.floor(np.mod(delay, period)).astype(np.int64)
+    return np.where(sync >= 0, delay, -1)
+
+def decay_histograms(photon_times, photon_microtimes, starts, ends, bin_width, n_bins):
+    """
+    Microtime histogram (decay) of the photons in each [start, end) window,
+    for all windows in one bincount.
+
+    Parameters
+    photon_times      : sorted photon times
+    photon_microtimes : microtime of each photon (see microtimes), -1 if unknown
+    starts, ends      : window edges (same unit as photon_times)
+    bin_width         : microtime bin width (same unit)
+    n_bins            : bins per decay; later photons are not counted
+
+    Returns
+    decays : array (n_windows, n_bins) of int64
+    """
+    lo = np.searchsorted(photon_times, starts, side='left')
+    hi = np.searchsorted(photon_times, ends, side='left')
+    n = np.maximum(hi - lo, 0)
+    total = int(n.sum())
+    decays = np.zeros(len(n) * n_bins, dtype=np.int64)
+    if total:
+        window = np.repeat(np.arange(len(n)), n)
+        index = np.repeat(lo - (np.cumsum(n) - n), n) + np.arange(total)       # photons of every window, back to back
+        bins = np.asarray(photon_microtimes)[index] // bin_width
+        keep = (bins >= 0) & (bins < n_bins)
+        decays += np.bincount(window[keep] * n_bins + bins[keep], minlength=len(decays))
+    return decays.reshape(len(n), n_bins)
+
+class TimeBuffer:
+    """
+    Sorted event times of one channel, kept as the blocks they arrived in,
+    so appending never copies the history. Once the oldest block is more
+    than 2 * 'keep' time units old, the blocks older than 'keep' are dropped.
+    Windows are counted with a binary search in the blocks they overlap,
+    found from the first and last time of every block. The microtime of
+    each event (see microtimes) is kept alongside for decay histograms.
+    """
+    def __init__(self, keep):
+        self.keep = keep
+        self.blocks = []                                                        # (times, microtimes) of each block
+        self.firsts = []                                                        # first and last time of each block
+        self.lasts = []
+
+    def append(self, times, microtimes=None):
+        if len(times):
+            times = np.asarray(times, dtype=np.int64)
+            if microtimes is None:
+                microtimes = np.full(len(times), -1, dtype=np.int64)
+            self.blocks.append((times, np.asarray(microtimes, dtype=np.int64)))
+            self.firsts.append(int(times[0]))
+            self.lasts.append(int(times[-1]))
+            if self.lasts[-1] - self.firsts[0] > 2 * self.keep:
+                expired = bisect.bisect_left(self.lasts, self.lasts[-1] - self.keep)
+                del self.blocks[:expired], self.firsts[:expired], self.lasts[:expired]
+
+    def select(self, start, end):
+        """Times and microtimes of the blocks overlapping [start, end), as single arrays."""
+        blocks = self.blocks[bisect.bisect_left(self.lasts, start):bisect.bisect_left(self.firsts, end)]
+        if not blocks:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        if len(blocks) == 1:
+            return blocks[0]
+        return np.concatenate([b[0] for b in blocks]), np.concatenate([b[1] for b in blocks])
+
+    def count(self, starts, ends):
+        if not len(starts):
+            return np.zeros(0, dtype=np.int64)
+        times, _ = self.select(int(np.min(starts)), int(np.max(ends)))
+        return bin_windows(times, starts, ends)
+
+    def decays(self, starts, ends, bin_width, n_bins):
+        if not len(starts):
+            return np.zeros((0, n_bins), dtype=np.int64)
+        times, microtimes = self.select(int(np.min(starts)), int(np.max(ends)))
+        return decay_histograms(times, microtimes, starts, ends, bin_width, n_bins)
+
+class MarkerLineBinner:
+    """
+    Exact per-pixel counts from a hardware pixel clock: the scan emits one
+    marker at the start of every pixel, n_pixels markers per line. Pixel i
+    spans from its marker to the next one; the last pixel of a line lasts
+    the median pixel time of the line (the flyback to the next line is not
+    counted).
+
+    Parameters
+    n_pixels : pixels (markers) per line
+    """
+    def __init__(self, n_pixels):
+        self.n_pixels = n_pixels
+        self.markers = np.empty(0, dtype=np.int64)
+        self.lines = 0
+
+    def add_markers(self, marker_times):
+        self.markers = np.concatenate((self.markers, marker_times))
+
+    def pop_lines(self, photons, latest):
+        """
+        Bins every complete line, i.e. whose end is before 'latest' (the
+        last event time received), with the photons of 'photons' (a TimeBuffer).
+
+        Returns
+        lines : list of (line index, counts array of n_pixels)
+        """
+        lines = []
+        n = self.n_pixels
+        while len(self.markers) >= n and latest >= self.line_end():
+            starts = self.markers[:n]
+            ends = np.empty_like(starts)
+            ends[:-1] = starts[1:]
+            ends[-1] = starts[-1] + (np.median(np.diff(starts)) if n > 1 else 0)
+            lines.append((self.lines, photons.count(starts, ends)))
+            self.markers = self.markers[n:]
+            self.lines += 1
+        return lines
+
+    def line_end(self):
+        starts = self.markers[:self.n_pixels]
+        return starts[-1] + (np.median(np.diff(starts)) if len(starts) > 1 else 0)
+
+class PhotonStream:
+    """
+    Reads raw T2 events from sn.unfold in a background thread and keeps the
+    recent photon times of the counted channel (and the marker times), so
+    pixel windows can be counted exactly from timestamps instead of
+    time-trace bins. With a sync channel the microtime of every photon
+    (delay after the laser pulse) is computed as the blocks arrive, so only
+    the photons are kept, not the sync events, and decays() gives the FLIM
+    histogram of each window.
+
+    At most MAX_SYNC_EVENTS sync events per second are supported: for a
+    faster laser, set the sync divider of the device (see sync_divider) and
+    pass it as sync_divider. The laser period is then estimated from the
+    recorded sync events and the microtimes are folded into one period.
+
+    Photon times are in ps since the start of the measurement; wall_anchor
+    is time.time() when the measurement was started, so a wall-clock window
+    maps to (t - wall_anchor) / PS.
+
+    Parameters
+    unfold         : sn.unfold of the snAPI instance
+    channel        : photon channel counted (numbering of unfold.getBlock)
+    marker_channel : channel of the pixel-clock markers, or None
+    sync_channel   : channel of the laser sync (0 on sn.unfold), or None
+    sync_divider   : sync divider set on the device (pulses per sync event)
+    n_pixels       : markers per line (marker mode)
+    keep           : seconds of photon history kept for window requests
+    on_line        : callback(line index, counts) for every line completed
+                     from markers (called from the reader thread)
+    """
+    def __init__(self, unfold, channel=1, marker_channel=None, n_pixels=0, keep=10.0, on_line=None, sync_channel=None, sync_divider=1):
+        self.unfold = unfold
+        self.channel = channel
+        self.marker_channel = marker_channel
+        self.sync_channel = sync_channel
+        self.sync_divider = sync_divider
+        self.last_sync = -1
+        self.first_sync = -1
+        self.n_syncs = 0                                                        # sync intervals since first_sync
+        self.photons = TimeBuffer(int(keep / PS))
+        self.binner = MarkerLineBinner(n_pixels) if marker_channel is not None and n_pixels else None
+        self.on_line = on_line
+        self.lock = threading.Lock()
+        self.running = False
+        self.thread = None
+        self.wall_anchor = 0.0
+        self.latest = -1                                                        # last event time received (any channel)
+
+    def start(self, acquisition_time):
+        self.unfold.measure(acquisition_time, waitFinished=False, savePTU=False)
+        self.wall_anchor = time.time()
+        self.running = True
+        self.thread = threading.Thread(target=self.read_loop, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.unfold.stopMeasure()
+
+    def read_loop(self):
+        while self.running:
+            times, channels = self.unfold.getBlock()
+            if not len(times):
+                time.sleep(0.005)
+                continue
+            times = np.asarray(times, dtype=np.int64)
+            channels = np.asarray(channels)
+            photons = times[channels == self.channel]
+            if self.sync_channel is not None:
+                syncs = times[channels == self.sync_channel]
+                photon_microtimes = microtimes(photons, syncs, self.last_sync, self.laser_period(syncs))
+                if len(syncs):
+                    self.last_sync = int(syncs[-1])
+            else:
+                photon_microtimes = None
+            with self.lock:
+                self.photons.append(photons, photon_microtimes)
+                self.latest = max(self.latest, int(times.max()))
+                if self.binner is not None:
+                    self.binner.add_markers(times[channels == self.marker_channel])
+                    lines = self.binner.pop_lines(self.photons, self.latest)
+                else:
+                    lines = []
+            for index, counts in lines:
+                if self.on_line is not None:
+                    self.on_line(index, counts)
+
+    def laser_period(self, syncs):
+        """
+        Laser period (ps) from all sync events so far, including the new
+        ones; None without a sync divider or before two sync events.
+        """
+        if len(syncs) and self.first_sync < 0:
+            self.first_sync = int(syncs[0])
+            self.n_syncs = -1
+        self.n_syncs += len(syncs)
+        if self.sync_divider == 1 or self.n_syncs < 1:
+            return None
+        last = int(syncs[-1]) if len(syncs) else self.last_sync
+        return (last - self.first_sync) / (self.n_syncs * self.sync_divider)
+
+    def to_ticks(self, wall_times):
+        """Wall-clock times (s) to measurement times (ps)."""
+        return ((np.asarray(wall_times) - self.wall_anchor) / PS).astype(np.int64)
+
+    def covers(self, wall_time):
+        """True once events later than wall_time (s) have been received."""
+        with self.lock:
+            return self.latest >= self.to_ticks(wall_time)
+
+    def count(self, starts, ends):
+        """Counts of wall-clock windows (s) with the photons received so far."""
+        with self.lock:
+            return self.photons.count(self.to_ticks(starts), self.to_ticks(ends))
+
+    def decays(self, starts, ends, bin_width, n_bins):
+        """Decay histograms (n_windows, n_bins) of wall-clock windows (s); bin_width in ps."""
+        with self.lock:
+            return self.photons.decays(self.to_ticks(starts), self.to_ticks(ends), bin_width, n_bins)
+
+    def count_windows(self, starts, ends, timeout=0.5):
+        """Counts of wall-clock windows (s); waits until events past the last window end are in."""
+        deadline = time.time() + timeout
+        while self.running and time.time() < deadline and not self.covers(np.max(ends)):
+            time.sleep(0.002)
+        return self.count(starts, ends)
@@ -0,0 +1,117 @@
+import threading
+import time
+
+class RenderScheduler:
+    """
+    Repaints a Matplotlib Tk canvas from the Tk main loop at a capped frame
+    rate. Pixel events reach the main loop through a UIBridge; expensive
+    refreshes are queued with request(), where only the latest call per key
+    runs each frame. Artists that change often (images, crosshairs)
+    are registered with add_artists() and repainted by blitting them over a
+    cached background; a full canvas.draw() is only done after invalidate()
+    (colour limits, extent, ...) and at most full_fps times per second.
+
+    Parameters
+    root     : Tk root (or any widget) whose after() drives the scheduler
+    canvas   : FigureCanvasTkAgg to repaint
+    fps      : maximum number of blitted frames per second
+    full_fps : maximum number of full redraws per second
+    """
+    def __init__(self, root, canvas, fps=20, full_fps=4):
+        self.root = root
+        self.canvas = canvas
+        self.fps = fps
+        self.full_fps = full_fps
+        self.requests = {}
+        self.lock = threading.Lock()
+        self.artists = []
+        self.dirty = set()
+        self.full_redraw = False
+        self.background = None
+        self.last_frame = 0.0
+        self.last_full = 0.0
+        self.after_id = None
+        self.canvas.mpl_connect("draw_event", self.on_draw)
+
+    def add_artists(self, *artists):
+        """Registers artists that are repainted by blitting."""
+        for artist in artists:
+            artist.set_animated(True)
+            self.artists.append(artist)
+        self.invalidate()
+
+    def remove_artists(self, *artists):
+        """Stops repainting artists (e.g. before their axes are cleared)."""
+        self.artists = [artist for artist in self.artists if artist not in artists]
+        self.dirty.difference_update(artists)
+        self.invalidate()
+
+    def request(self, key, func, *args):
+        """Runs func(*args) once on the next frame; a newer request with the same key replaces it (thread-safe)."""
+        with self.lock:
+            self.requests[key] = (func, args)
+
+    def mark(self, *artists):
+        """Marks registered artists as changed; they are blitted on the next frame."""
+        self.dirty.update(artists)
+
+    def invalidate(self):
+        """Requests a full redraw (axes, colorbars, text) on the next allowed frame."""
+        self.full_redraw = True
+
+    def start(self):
+        if self.after_id is None:
+            self.tick()
+
+    def stop(self):
+        if self.after_id is not None:
+            self.root.after_cancel(self.after_id)
+            self.after_id = None
+
+    def tick(self):
+        self.after_id = self.root.after(max(1, int(1000 / self.fps)), self.tick)
+        try:
+            self.drain()
+            self.render()
+        except Exception as e:
+            print(f"Render error: {e}")
+
+    def drain(self):
+        """Runs the coalesced requests."""
+        with self.lock:
+            requests, self.requests = self.requests, {}
+        for func, args in requests.values():
+            func(*args)
+
+    def render(self):
+        now = time.perf_counter()
+        if now - self.last_frame < 1 / self.fps:
+            return
+        if self.full_redraw and (self.background is None or now - self.last_full >= 1 / self.full_fps):
+            self.full_redraw = False
+            self.dirty.clear()
+            self.last_full = now
+            self.canvas.draw()  # on_draw caches the new background
+        elif self.dirty and self.background is not None:
+            self.blit()
+        else:
+            return
+        self.last_frame = now
+
+    def blit(self):
+        """Repaints only the axes holding changed artists."""
+        axes = {artist.axes for artist in self.dirty if artist.axes is not None}
+        self.dirty.clear()
+        self.canvas.restore_region(self.background)
+        for artist in self.artists:
+            if artist.axes in axes:
+                artist.axes.draw_artist(artist)
+        for ax in axes:
+            self.canvas.blit(ax.bbox)
+
+    def on_draw(self, event):
+        """After any full draw: cache the background without the animated artists, then paint them."""
+        self.background = self.canvas.copy_from_bbox(self.canvas.figure.bbox)
+        for artist in self.artists:
+            if artist.axes is not None:
+                artist.axes.draw_artist(artist)
@@ -0,0 +1,493 @@
+import queue
+import struct
+import threading
+import time
+from collections import deque, namedtuple
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from nanonisTCPIP import FolMe, ZCtrl, Current, Signals, TipRec
+from photon_stream import CountStream, LineCounter
+
+SCAN_MODES = ("Forward", "Backward", "Bidirectional", "Zigzag")
+
+# One measured point of the raster. trace is 0 for the recorded pass and 1
+# for the return pass of a Bidirectional line. values maps detector name
+# to its reading; timing maps stage name to a perf_counter timestamp, plus
+# the dwell window in wall-clock time ("window_start", "window_end").
+PixelResult = namedtuple("PixelResult", ["ix", "iy", "x", "y", "trace", "values", "timing"])
+
+# Values of a per-line detector for one recorded line: ix lists the pixels
+# of the line in scan order and values maps detector name to an array of
+# the same order. Put on the results queue after the PixelResults of the line.
+LineResult = namedtuple("LineResult", ["iy", "ix", "values"])
+
+# Full scan path: coords (n_points, 2) stage x/y, indices (n_points, 2)
+# pixel ix/iy and trace (n_points,) as in PixelResult. Arrays are shared
+# between callers through the cache and are read-only.
+Trajectory = namedtuple("Trajectory", ["coords", "indices", "trace"])
+
+class NanonisStage:
+    """Moves the tip with Follow Me and waits for the end of the move."""
+    def __init__(self, nanonis):
+        self.folme = FolMe(nanonis)
+
+    def move_to(self, x, y):
+        self.folme.XYPosSet(x, y, True)
+
+class E70Stage:
+    """Moves the E70.D2S piezo stage (positions in µm)."""
+    def __init__(self, e70, step_size):
+        self.e70 = e70
+        self.step_size = step_size
+
+    def move_to(self, x, y):
+        self.e70.move_to(target_x=x, target_y=y, step_size=self.step_size)
+
+class NanonisDetector:
+    """
+    Averages the Nanonis current ("Current") or tip height ("Height") over
+    the dwell. sampling="Buffer" reads the Tip Move Recorder block in one
+    call; "Polling" uses pipelined Current.Get/ZCtrl.ZPosGet requests.
+
+    Buffer mode falls back to polling when the signal is not recorded by
+    the Tip Move Recorder, and from the first dwell whose block is empty.
+    A dwell without any sample raises RuntimeError (ending the scan)
+    instead of giving the pixel a made-up value.
+    """
+    overlap = False                                                             # measured during the dwell
+
+    def __init__(self, nanonis, signal="Current", sampling="Buffer", depth=8, buffer_size=10000):
+        self.nanonis = nanonis
+        self.signal = signal
+        self.sampling = sampling
+        self.depth = depth
+        self.buffer_size = buffer_size                                          # Tip Move Recorder samples, enough for one dwell
+        self.signal_index = -1
+        self.tiprec = None
+
+    def start(self):
+        self.zctrl = ZCtrl(self.nanonis)
+        self.current = Current(self.nanonis)
+        self.tiprec = None
+        if self.sampling == "Buffer":
+            signals = Signals(self.nanonis)
+            self.signal_index = signals.find("Z" if self.signal == "Height" else "Current")
+            if self.signal_index < 0:
+                print(f"{self.signal} signal not found: polling instead of the Tip Move Recorder")
+                return
+            tiprec = TipRec(self.nanonis)
+            tiprec.BufferSizeSet(self.buffer_size)
+            channel_indexes, _ = tiprec.DataGet()
+            if self.signal_index not in channel_indexes:
+                print(f"{self.signal} is not recorded by the Tip Move Recorder: polling instead")
+                return
+            self.tiprec = tiprec
+
+    def stop(self):
+        pass
+
+    def samples(self, dwell):
+        """Returns the samples taken during one dwell."""
+        if self.tiprec is not None:
+            # Controller-side buffer: clear, wait for the dwell, fetch the block in one call
+            self.tiprec.BufferClear()
+            time.sleep(dwell)
+            values = self.tiprec.ChannelGet(self.signal_index)
+            if len(values):
+                return values
+            print("Tip Move Recorder block empty: polling from now on")
+            self.tiprec = None
+        if self.signal == "Height":
+            return self.zctrl.ZPosGetMany(duration=dwell, depth=self.depth)
+        return self.current.GetMany(duration=dwell, depth=self.depth)
+
+    def acquire(self, dwell):
+        values = self.samples(dwell)
+        if not len(values):
+            raise RuntimeError(f"No {self.signal} samples during the dwell")
+        return float(np.mean(values))  # Mean value
+
+class PicoHarpDetector:
+    """
+    Reads the latest photon count from the TimeTagger TCP server ('D'
+    command). The server integrates on its own, so the read is done after
+    the dwell and overlaps with the move to the next pixel.
+    """
+    overlap = True                                                              # read after the dwell, on the readout worker
+
+    def __init__(self, sock):
+        self.sock = sock
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def read(self, window=None):
+        self.sock.sendall(b"D")
+        data = b''
+        while len(data) < 4:
+            packet = self.sock.recv(4 - len(data))
+            if not packet:
+                raise ConnectionError("Socket connection broken")
+            data += packet
+        return struct.unpack("!I", data)[0]  # Unpack the received data (intensity value)
+
+class StreamingPicoHarpDetector:
+    """
+    Photon counts from the TimeTagger binary count stream: the server pushes
+    every bin once, and the value of a pixel is the time-weighted mean of
+    the bins inside its dwell window. No request per pixel; the read only
+    waits until the bins covering the window have arrived.
+    """
+    overlap = True                                                              # read after the dwell, on the readout worker
+
+    def __init__(self, sock, channel=1, timeout=1.0):
+        self.sock = sock
+        self.channel = channel
+        self.timeout = timeout
+        self.stream = None
+
+    def start(self):
+        self.stream = CountStream(self.sock)
+        self.stream.subscribe()
+
+    def stop(self):
+        if self.stream is not None:
+            self.stream.unsubscribe()
+
+    def read(self, window=None):
+        if window is None:
+            return self.stream.latest(self.channel)
+        if not self.stream.wait_until(window[1], self.timeout):
+            print("Count stream late: using the bins received so far")
+        return self.stream.window_mean(window[0], window[1], self.channel)
+
+class PixelClockDetector:
+    """
+    Exact photon counts per pixel from the raw T2 timestamps on the
+    TimeTagger server, returned once per line (per_line detector).
+
+    marker > 0: the scan hardware sends one marker per recorded pixel to
+    that input of the time tagger and the server pushes each completed line.
+    marker = 0: the dwell windows measured by the scan (time.time()) are
+    sent at the end of the line and mapped to the server clock with the
+    offset estimated when arming.
+    """
+    overlap = True                                                              # read after the dwell, on the readout worker
+    per_line = True                                                             # read once per line with read_line()
+
+    def __init__(self, sock, n_pixels, channel=1, marker=0):
+        self.counter = LineCounter(sock)
+        self.n_pixels = n_pixels
+        self.channel = channel
+        self.marker = marker
+
+    def start(self):
+        self.counter.arm(self.n_pixels, self.channel, self.marker)
+
+    def stop(self):
+        self.counter.disarm()
+
+    def read_line(self, windows):
+        if self.marker:
+            return self.counter.read_line()
+        starts, ends = zip(*windows)
+        return self.counter.count_windows(starts, ends)
+
+class FlimDetector:
+    """
+    FLIM decay histogram of every pixel from the raw T2 timestamps on the
+    TimeTagger server (microtimes after the laser sync), returned once per
+    line as an array (n_pixels, n_bins) for the dwell windows of the line
+    (per_line detector, software windows as PixelClockDetector with
+    marker = 0). The server reads the sync in T2 mode and divides it so at
+    most photon_tools.MAX_SYNC_EVENTS (5 MHz) sync events reach its
+    reader, which supports lasers up to 80 MHz (divider 16).
+
+    Parameters
+    sock      : socket connected to the TimeTagger server
+    n_pixels  : pixels per line
+    bin_width : microtime bin width (ps)
+    n_bins    : bins per decay (n_bins * bin_width about the laser period)
+    channel   : photon channel
+    """
+    overlap = True
+    per_line = True
+
+    def __init__(self, sock, n_pixels, bin_width=50, n_bins=250, channel=1):
+        self.counter = LineCounter(sock)
+        self.n_pixels = n_pixels
+        self.bin_width = bin_width
+        self.n_bins = n_bins
+        self.channel = channel
+
+    def start(self):
+        self.counter.arm(self.n_pixels, self.channel, 0)
+
+    def stop(self):
+        self.counter.disarm()
+
+    def read_line(self, windows):
+        starts, ends = zip(*windows)
+        return self.counter.decay_windows(starts, ends, self.bin_width, self.n_bins)
+
+class SimulatedStage:
+    """Stage stand-in for headless runs and benchmarks."""
+    def __init__(self, move_time=0.0):
+        self.move_time = move_time
+        self.position = (0.0, 0.0)
+        self.moves = deque(maxlen=64)                                           # (time.time() at the end of the move, position)
+
+    def move_to(self, x, y):
+        if self.move_time:
+            time.sleep(self.move_time)
+        self.position = (x, y)
+        self.moves.append((time.time(), self.position))
+
+    def position_at(self, t):
+        """Position of the stage at wall-clock time t (s), from the recent moves."""
+        for end, position in reversed(self.moves):
+            if end <= t:
+                return position
+        return self.moves[0][1] if self.moves else self.position
+
+class SimulatedDetector:
+    """
+    Detector stand-in returning func(x, y) at the stage position of the
+    pixel: the current one for acquire(), the one at the start of the dwell
+    window for read() (with overlap the stage is already on the next pixel).
+    """
+    def __init__(self, stage, func=None, overlap=False, read_time=0.0):
+        self.stage = stage
+        self.func = func if func is not None else (lambda x, y: 0.0)
+        self.overlap = overlap
+        self.read_time = read_time
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def acquire(self, dwell):
+        time.sleep(dwell)
+        return self.func(*self.stage.position)
+
+    def read(self, window=None):
+        if self.read_time:
+            time.sleep(self.read_time)
+        position = self.stage.position if window is None else self.stage.position_at(window[0])
+        return self.func(*position)
+
+@lru_cache(maxsize=16)
+def pixel_grid(center_x, center_y, frame, pixel, rotation=0.0):
+    """
+    Stage coordinates of every pixel, computed once per parameter set.
+    Row 0 is the top line, column 0 the left edge; the frame is rotated by
+    'rotation' degrees (clockwise) around the centre.
+
+    Returns
+    grid : read-only array of shape (pixel, pixel, 2) holding (x, y)
+    """
+    resolution = frame / pixel
+    offsets = np.arange(pixel) * resolution
+    dx = (-frame / 2 + offsets)[np.newaxis, :]                                  # relative to the centre
+    dy = (frame / 2 - offsets)[:, np.newaxis]
+    theta = np.radians(-rotation)
+    cos, sin = np.cos(theta), np.sin(theta)
+    grid = np.empty((pixel, pixel, 2))
+    grid[..., 0] = center_x + dx * cos - dy * sin
+    grid[..., 1] = center_y + dx * sin + dy * cos
+    grid.setflags(write=False)
+    return grid
+
+@lru_cache(maxsize=16)
+def raster_trajectory(center_x, center_y, frame, pixel, rotation=0.0, mode="Forward"):
+    """
+    Precomputes the whole scan path for a raster mode in one shot. Cached,
+    so the scan loop, the crosshair and exports share the same arrays
+    until a scan parameter changes.
+
+    Returns
+    trajectory : Trajectory(coords, indices, trace)
+    """
+    if mode not in SCAN_MODES:
+        raise ValueError("Unknown scan mode")
+    forward = np.arange(pixel)
+    backward = forward[::-1]
+    rows = np.arange(pixel)
+    if mode == "Forward":
+        ix = np.tile(forward, pixel)
+    elif mode == "Backward":
+        ix = np.tile(backward, pixel)
+    elif mode == "Zigzag":
+        ix = np.where((rows % 2 == 0)[:, np.newaxis], forward, backward).ravel()
+    else:  # Bidirectional: every line forward, then back over the same line
+        ix = np.tile(np.concatenate((forward, backward)), pixel)
+    passes = 2 if mode == "Bidirectional" else 1
+    iy = np.repeat(rows, passes * pixel)
+    trace = np.zeros(ix.size, dtype=np.int8)
+    if mode == "Bidirectional":
+        trace = np.tile(np.repeat(np.array([0, 1], dtype=np.int8), pixel), pixel)
+    indices = np.column_stack((ix, iy))
+    coords = pixel_grid(center_x, center_y, frame, pixel, rotation)[iy, ix]
+    for array in (coords, indices, trace):
+        array.setflags(write=False)
+    return Trajectory(coords, indices, trace)
+
+class RasterScan:
+    """
+    Headless raster scan. Parameters are plain numbers read once, so the
+    scan never touches GUI widgets.
+
+    Each point: stage.move_to, then the dwell detectors (overlap=False)
+    measure for 'dwell' seconds, then the readout detectors (overlap=True)
+    are read for that dwell window on a worker thread while the stage already moves to the next
+    point. Results are put on 'results' (a queue.Queue) as PixelResult, in
+    scan order, followed by None when the scan ends. Per-line detectors
+    (per_line=True) are read once at the end of every line with the dwell
+    windows of its recorded pixels, and give a LineResult.
+
+    Parameters
+    center_x, center_y : scan centre
+    frame              : frame size (same unit as the centre)
+    pixel              : number of pixels per line and of lines
+    rotation           : frame rotation (degrees)
+    mode               : "Forward", "Backward", "Bidirectional" or "Zigzag"
+    dwell              : dwell time per pixel (s)
+    stage              : object with move_to(x, y)
+    detectors          : {name: detector}
+    """
+    def __init__(self, center_x, center_y, frame, pixel, rotation=0.0, mode="Forward", dwell=0.05,
+                 stage=None, detectors=None, results=None):
+        if mode not in SCAN_MODES:
+            raise ValueError("Unknown scan mode")
+        self.center_x = center_x
+        self.center_y = center_y
+        self.frame = frame
+        self.pixel = int(pixel)
+        self.rotation = rotation
+        self.mode = mode
+        self.dwell = dwell
+        self.stage = stage
+        self.detectors = detectors or {}
+        self.results = results if results is not None else queue.Queue()
+        self.running = False
+        self.thread = None
+        self.timings = []
+
+    def trajectory(self):
+        return raster_trajectory(self.center_x, self.center_y, self.frame, self.pixel, self.rotation, self.mode)
+
+    def position(self, ix, iy):
+        """Stage coordinates of pixel (ix, iy); row 0 is the top line."""
+        x, y = pixel_grid(self.center_x, self.center_y, self.frame, self.pixel, self.rotation)[iy, ix]
+        return float(x), float(y)
+
+    def points(self):
+        """Yields (ix, iy, x, y, trace) in scan order."""
+        trajectory = self.trajectory()
+        coords = trajectory.coords.tolist()                                     # plain floats for the stage backends
+        indices = trajectory.indices.tolist()
+        trace = trajectory.trace.tolist()
+        for (ix, iy), (x, y), t in zip(indices, coords, trace):
+            yield ix, iy, x, y, t
+
+    def start(self):
+        """Runs the scan in a background thread and returns the results queue."""
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self.results
+
+    def stop(self):
+        self.running = False
+
+    def run(self):
+        self.running = True
+        self.timings = []
+        dwell_detectors = {name: d for name, d in self.detectors.items() if not d.overlap}
+        line_detectors = {name: d for name, d in self.detectors.items() if getattr(d, "per_line", False)}
+        readout_detectors = {name: d for name, d in self.detectors.items() if d.overlap and name not in line_detectors}
+        readout = ThreadPoolExecutor(max_workers=1)
+        pending = None
+        line = []                                                               # (ix, window) of the recorded pixels of the line
+        line_iy = None
+        try:
+            for detector in self.detectors.values():
+                detector.start()
+            for ix, iy, x, y, trace in self.points():
+                if not self.running:
+                    break
+                if line and iy != line_iy:
+                    if pending is not None:
+                        pending.result()
+                    pending = readout.submit(self.readout_line, line_iy, line, line_detectors)
+                    line = []
+                line_iy = iy
+                timing = {"move": time.perf_counter()}
+                self.stage.move_to(x, y)
+                timing["dwell"] = time.perf_counter()
+                timing["window_start"] = time.time()
+                values = {name: d.acquire(self.dwell) for name, d in dwell_detectors.items()}
+                if not dwell_detectors:
+                    time.sleep(self.dwell)
+                timing["window_end"] = time.time()
+                timing["dwell_end"] = time.perf_counter()
+                if pending is not None:
+                    pending.result()  # Keep results in order; at most one readout in flight
+                pending = readout.submit(self.readout, ix, iy, x, y, trace, values, timing,
+                                         readout_detectors if trace == 0 else {})
+                if line_detectors and trace == 0:
+                    line.append((ix, (timing["window_start"], timing["window_end"])))
+            if pending is not None:
+                pending.result()
+            if line and self.running:                                           # last line, unless the scan was stopped mid-line
+                self.readout_line(line_iy, line, line_detectors)
+        finally:
+            readout.shutdown(wait=True)
+            for detector in self.detectors.values():
+                detector.stop()
+            self.running = False
+            self.results.put(None)
+
+    def readout(self, ix, iy, x, y, trace, values, timing, readout_detectors):
+        timing["readout"] = time.perf_counter()
+        window = (timing["window_start"], timing["window_end"])
+        for name, detector in readout_detectors.items():
+            values[name] = detector.read(window)
+        timing["done"] = time.perf_counter()
+        self.timings.append(timing)
+        self.results.put(PixelResult(ix, iy, x, y, trace, values, timing))
+
+    def readout_line(self, iy, line, line_detectors):
+        ix = [p[0] for p in line]
+        windows = [p[1] for p in line]
+        values = {name: detector.read_line(windows) for name, detector in line_detectors.items()}
+        self.results.put(LineResult(iy, ix, values))
+
+    def timing_summary(self):
+        """Mean duration of each stage and mean time per pixel, in ms."""
+        if len(self.timings) < 2:
+            return {}
+        t = {key: np.array([timing[key] for timing in self.timings]) for key in self.timings[0]}
+        return {"move": np.mean(t["dwell"] - t["move"]) * 1000,
+                "dwell": np.mean(t["dwell_end"] - t["dwell"]) * 1000,
+                "readout": np.mean(t["done"] - t["readout"]) * 1000,
+                "pixel": np.mean(np.diff(t["move"])) * 1000}
+
+if __name__ == "__main__":
+    # Headless benchmark with simulated hardware: readout overlaps the next move
+    stage = SimulatedStage(move_time=0.002)
+    detectors = {"z": SimulatedDetector(stage, lambda x, y: x + y),
+                 "photon": SimulatedDetector(stage, lambda x, y: x * y, overlap=True, read_time=0.002)}
+    scan = RasterScan(0.0, 0.0, 1e-8, 16, rotation=15, mode="Zigzag", dwell=0.002, stage=stage, detectors=detectors)
+    results = scan.start()
+    n = 0
+    while results.get() is not None:
+        n += 1
+    summary = scan.timing_summary()
+    print(f"{n} pixels, " + ", ".join(f"{key}: {value:.2f} ms" for key, value in summary.items()))
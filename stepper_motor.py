@@ -5,6 +5,7 @@ import math
 import serial
 import time
 import threading
+from ui_bridge import UIBridge
 from ctypes import cdll,c_long, c_ulong, c_uint32,byref,create_string_buffer,c_bool,c_char_p,c_int,c_int16,c_double, sizeof, c_voidp
 from TLPMX import TLPMX
 from TLPMX import TLPM_DEFAULT_CHANNEL
@@ -176,8 +177,14 @@ class DialCanvas(tk.Canvas):
             return 1
 
 class NDFilterGUI:
-    def __init__(self, parent_frame):
+    def __init__(self, parent_frame, ui=None):
         self.root = parent_frame
+        # PM16 and stepper threads update the widgets through the bridge
+        if ui is None:
+            ui = UIBridge(parent_frame)
+            ui.start()
+        self.ui = ui
+        self.move_thread = None
         self.arr18 = ('Arial', 18)
         self.arr24 = ('Arial', 24)
 
@@ -519,6 +526,10 @@ class NDFilterGUI:
         if super_method:
             super_method(motor_id, flip, angle)
 
+        if self.move_thread is not None and self.move_thread.is_alive():
+            print("Motor is still moving.")
+            return
+
         motor = self.motors[motor_id]
         if self.connected and self.arduino:
             try:
@@ -566,40 +577,49 @@ class NDFilterGUI:
                 self.arduino.write(command.encode())
                 self.arduino.flush()
 
-                deadline = time.time() + 10  # 10-second timeout
-                while time.time() < deadline:
-                    if self.arduino.in_waiting:
-                        response = self.arduino.readline().decode().strip()
-                        if response.startswith("DONE"):
-                            #print("Response from Arduino:", response)
-                            try:
-                                _, motor_id_str, current_step_str = response.split()
-                                #print(f"Current step count: {int(current_step)}")
-                            except ValueError:
-                                print("Malformed DONE response:", response)
-                            break
-                    else:
-                        time.sleep(0.05)  # Avoid CPU spin
-
-                motor["current_position_steps"] = target_steps
-                if motor_id == 0:
-                    self.wheel_canvas.update_angle(self.step_to_angle(0))
-
-                if flip == True:
-                    flip_btn = motor.get("flip_button")
-                    if flip_btn and flip_btn.winfo_exists():
-                        if self.step_to_angle(motor_id) == 0:
-                            flip_btn.config(text="Flip Up", bg="green")
-                        else:
-                            flip_btn.config(text="Flip Down", bg="red")  
-                else:
-                    if "goto_button" in motor and motor["goto_button"].winfo_exists():
-                        motor["goto_button"].config(text="Move", bg="orange")
-                    #motor["toggle_button"].config(state='normal')
+                # Wait for DONE on a worker thread so the GUI keeps running during the move
+                self.move_thread = threading.Thread(target=self.wait_for_move, args=(motor_id, target_steps, flip), daemon=True)
+                self.move_thread.start()
 
             except ValueError:
                 print("Invalid angle input.")
 
+    def wait_for_move(self, motor_id, target_steps, flip):
+        """Worker thread: waits for the Arduino DONE reply, then hands the GUI update to the main loop."""
+        deadline = time.time() + 10  # 10-second timeout
+        while time.time() < deadline:
+            if self.arduino.in_waiting:
+                response = self.arduino.readline().decode().strip()
+                if response.startswith("DONE"):
+                    #print("Response from Arduino:", response)
+                    try:
+                        _, motor_id_str, current_step_str = response.split()
+                        #print(f"Current step count: {int(current_step)}")
+                    except ValueError:
+                        print("Malformed DONE response:", response)
+                    break
+            else:
+                time.sleep(0.05)  # Avoid CPU spin
+        self.ui.post(self.finish_move, motor_id, target_steps, flip)
+
+    def finish_move(self, motor_id, target_steps, flip):
+        motor = self.motors[motor_id]
+        motor["current_position_steps"] = target_steps
+        if motor_id == 0:
+            self.wheel_canvas.update_angle(self.step_to_angle(0))
+
+        if flip == True:
+            flip_btn = motor.get("flip_button")
+            if flip_btn and flip_btn.winfo_exists():
+                if self.step_to_angle(motor_id) == 0:
+                    flip_btn.config(text="Flip Up", bg="green")
+                else:
+                    flip_btn.config(text="Flip Down", bg="red")  
+        else:
+            if "goto_button" in motor and motor["goto_button"].winfo_exists():
+                motor["goto_button"].config(text="Move", bg="orange")
+            #motor["toggle_button"].config(state='normal')
+
     def zero_angle(self, motor_id):
         motor = self.motors[motor_id]
         motor["current_position_steps"] = 0
@@ -703,7 +723,7 @@ class NDFilterGUI:
         while self.pm16_connected and self.pm16_thread_running:
             try:
                 self.tlPM.measPower(byref(power),TLPM_DEFAULT_CHANNEL)
-                self.pm16_power.set(self.format_output(power.value))
+                self.ui.set(self.pm16_power, self.format_output(power.value))
                 time.sleep(0.2)
 
             except CommunicationError:
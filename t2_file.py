@@ -0,0 +1,192 @@
+import os
+import struct
+import threading
+import time
+import numpy as np
+
+# Raw T2 capture file.
+#
+# <name>.t2   : FILE_HEADER (magic, version, record size, time unit in s)
+#               then the records back to back, so the whole file maps to one
+#               NumPy array of RECORD (memmap, no loading).
+# <name>.t2i  : chunk index, one CHUNK_ENTRY per written chunk (first record,
+#               number of records, first time, last time). Written after the
+#               chunk itself, so the index never points past the data.
+FILE_MAGIC = b'T2RAW\0'
+FILE_VERSION = 1
+FILE_HEADER = struct.Struct('<6sHHd')
+HEADER_SIZE = 32
+RECORD = np.dtype([('time', '<i8'), ('channel', '<u1')])
+CHUNK_ENTRY = np.dtype([('first', '<i8'), ('count', '<i8'), ('t_first', '<i8'), ('t_last', '<i8')])
+
+class T2Writer:
+    """
+    Appends raw T2 events to a capture file. Events are gathered in a
+    preallocated chunk of chunk_size records and written when it is full
+    (or on flush/close), so memory stays bounded whatever the run length.
+
+    Parameters
+    path       : file name (the index is path + 'i')
+    time_unit  : duration of one time tick (s), 1e-12 for sn.unfold
+    chunk_size : records per chunk
+    """
+    def __init__(self, path, time_unit=1e-12, chunk_size=1 << 20):
+        self.path = path
+        self.chunk = np.empty(chunk_size, dtype=RECORD)
+        self.fill = 0
+        self.written = 0
+        self.lock = threading.Lock()
+        self.data = open(path, 'wb')
+        self.index = open(path + 'i', 'wb')
+        self.data.write(FILE_HEADER.pack(FILE_MAGIC, FILE_VERSION, RECORD.itemsize, time_unit).ljust(HEADER_SIZE, b'\0'))
+
+    def append(self, times, channels):
+        with self.lock:
+            start = 0
+            while start < len(times):
+                n = min(len(times) - start, len(self.chunk) - self.fill)
+                self.chunk['time'][self.fill:self.fill + n] = times[start:start + n]
+                self.chunk['channel'][self.fill:self.fill + n] = channels[start:start + n]
+                self.fill += n
+                start += n
+                if self.fill == len(self.chunk):
+                    self.write_chunk()
+
+    def write_chunk(self):
+        if not self.fill:
+            return
+        chunk = self.chunk[:self.fill]
+        self.data.write(chunk.tobytes())
+        self.data.flush()
+        entry = np.array([(self.written, self.fill, chunk['time'][0], chunk['time'][-1])], dtype=CHUNK_ENTRY)
+        self.index.write(entry.tobytes())
+        self.index.flush()
+        self.written += self.fill
+        self.fill = 0
+
+    def flush(self):
+        with self.lock:
+            self.write_chunk()
+
+    def close(self):
+        self.flush()
+        self.data.close()
+        self.index.close()
+
+class T2File:
+    """
+    Reads a capture file through a memory map: records() returns views of
+    the file for any time range (found with the chunk index), and rebin()
+    builds a time trace at any bin width, one chunk at a time.
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            magic, version, record_size, self.time_unit = FILE_HEADER.unpack(f.read(FILE_HEADER.size))
+        if magic != FILE_MAGIC or record_size != RECORD.itemsize:
+            raise ValueError("Not a T2 capture file")
+        self.version = version
+        self.index = np.fromfile(path + 'i', dtype=CHUNK_ENTRY) if os.path.exists(path + 'i') else np.empty(0, dtype=CHUNK_ENTRY)
+        count = int(self.index['first'][-1] + self.index['count'][-1]) if len(self.index) else 0
+        self.records_map = np.memmap(path, dtype=RECORD, mode='r', offset=HEADER_SIZE, shape=(count,)) if count else np.empty(0, dtype=RECORD)
+
+    def __len__(self):
+        return len(self.records_map)
+
+    def span(self):
+        """(first, last) event time in ticks."""
+        if not len(self.index):
+            return 0, 0
+        return int(self.index['t_first'][0]), int(self.index['t_last'][-1])
+
+    def chunk_range(self, t_start=None, t_end=None):
+        """Indices of the chunks overlapping [t_start, t_end) (ticks)."""
+        first = 0 if t_start is None else np.searchsorted(self.index['t_last'], t_start, side='left')
+        last = len(self.index) if t_end is None else np.searchsorted(self.index['t_first'], t_end, side='left')
+        return range(first, last)
+
+    def records(self, t_start=None, t_end=None):
+        """Records with t_start <= time < t_end, as a view of the file."""
+        chunks = self.chunk_range(t_start, t_end)
+        if not len(chunks):
+            return self.records_map[:0]
+        begin = int(self.index['first'][chunks[0]])
+        end = int(self.index['first'][chunks[-1]] + self.index['count'][chunks[-1]])
+        view = self.records_map[begin:end]
+        times = view['time']
+        lo = 0 if t_start is None else np.searchsorted(times, t_start, side='left')
+        hi = len(view) if t_end is None else np.searchsorted(times, t_end, side='left')
+        return view[lo:hi]
+
+    def rebin(self, bin_width, channels=(1,), t_start=None, t_end=None):
+        """
+        Time trace of the capture at any bin width.
+
+        Parameters
+        bin_width      : bin width (s)
+        channels       : channels counted
+        t_start, t_end : time range (s from the start of the measurement); whole file if None
+
+        Returns
+        times  : bin start times (s)
+        counts : array (len(channels), n_bins) of counts per bin
+        """
+        first, last = self.span()
+        start = first if t_start is None else int(t_start / self.time_unit)
+        end = last + 1 if t_end is None else int(t_end / self.time_unit)
+        width = max(int(round(bin_width / self.time_unit)), 1)
+        n_bins = max(-(-(end - start) // width), 0)
+        counts = np.zeros((len(channels), n_bins), dtype=np.int64)
+        for chunk in self.chunk_range(start, end):
+            begin = int(self.index['first'][chunk])
+            view = self.records_map[begin:begin + int(self.index['count'][chunk])]
+            times = view['time']
+            keep = (times >= start) & (times < end)
+            bins = (times[keep] - start) // width
+            chunk_channels = view['channel'][keep]
+            for row, channel in enumerate(channels):
+                counts[row] += np.bincount(bins[chunk_channels == channel], minlength=n_bins)[:n_bins]
+        return (start + np.arange(n_bins) * width) * self.time_unit, counts
+
+class T2Capture:
+    """
+    Streams raw T2 events from sn.unfold to a capture file in a background
+    thread, for runs of any length.
+
+    Parameters
+    unfold     : sn.unfold of the snAPI instance
+    path       : capture file name
+    chunk_size : records per chunk (see T2Writer)
+    """
+    def __init__(self, unfold, path, chunk_size=1 << 20):
+        self.unfold = unfold
+        self.writer = T2Writer(path, chunk_size=chunk_size)
+        self.running = False
+        self.thread = None
+        self.events = 0
+
+    def start(self, acquisition_time):
+        self.unfold.measure(acquisition_time, waitFinished=False, savePTU=False)
+        self.running = True
+        self.thread = threading.Thread(target=self.read_loop, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.unfold.stopMeasure()
+        self.writer.close()
+
+    def read_loop(self):
+        try:
+            while self.running:
+                times, channels = self.unfold.getBlock()
+                if not len(times):
+                    time.sleep(0.005)
+                    continue
+                self.writer.append(np.asarray(times, dtype=np.int64), np.asarray(channels, dtype=np.uint8))
+                self.events += len(times)
+        except Exception as e:
+            print(f"T2 capture error: {e}")
+            self.running = False
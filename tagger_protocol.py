@@ -0,0 +1,197 @@
+import struct
+import numpy as np
+from photon_stream import unpack_windows, unpack_flim_windows, recv_exact, FLIM_ARGS
+
+# Commands of the TimeTagger server.
+#
+# Legacy clients send bare ASCII commands: 'M<n>M', 'D', 'S', 'B', 'U',
+# 'P<n_pixels>,<channel>,<marker>P', and 'W' or 'F' followed by their
+# arguments and windows (see photon_stream). A client that starts with the handshake is framed
+# instead: b'H' + HELLO (magic, version), answered by HELLO_REPLY (b'OK',
+# version used; an unsupported version closes the connection), then every
+# command is COMMAND_HEADER (command,
+# payload length) followed by its payload. Any number of commands can be
+# sent in one segment; they are run in order. Replies and pushed frames are
+# the same in both modes.
+#
+# Framed payloads: M '!I' (same number as in 'M<n>M'), P '!HBB' (n_pixels,
+# channel, marker), W n x '!dd' (start, end), F FLIM_ARGS then the windows
+# as for W, none for D, S, B, U and G.
+#
+# 'G' is answered with the latest multi-tau correlation: G2_HEADER (magic,
+# n_pairs, n_lags), the lags (n_lags x '!d', s), then for each pair its
+# channels ('!BB') and g2 values (n_lags x '!d'). n_pairs is 0 while no
+# multi-tau measurement runs. Pairs are ordered: (a, b) is b delayed by the
+# lag after a, and (b, a) holds the negative lags of (a, b).
+PROTOCOL_VERSION = 1
+HELLO_MAGIC = b'TP'
+HELLO = struct.Struct('!2sH')
+HELLO_REPLY = struct.Struct('!2sH')
+COMMAND_HEADER = struct.Struct('!cI')
+MAX_PAYLOAD = 1 << 20
+COMMANDS = b'MDSBUPWFG'
+G2_MAGIC = b'G2'
+G2_HEADER = struct.Struct('!2sHH')
+G2_PAIR = struct.Struct('!BB')
+PIXEL_ARGS = struct.Struct('!HBB')
+M_ARG = struct.Struct('!I')
+WINDOW = struct.Struct('!dd')
+
+def check_payload(command, size):
+    """Raises ValueError if a framed payload has the wrong size for its command."""
+    if command == 'M':
+        valid = size == M_ARG.size
+    elif command == 'P':
+        valid = size == PIXEL_ARGS.size
+    elif command == 'W':
+        valid = size % WINDOW.size == 0
+    elif command == 'F':
+        valid = size >= FLIM_ARGS.size and (size - FLIM_ARGS.size) % WINDOW.size == 0
+    else:
+        valid = True
+    if not valid:
+        raise ValueError(f"Bad payload size {size} for command {command!r}")
+
+def hello(version=PROTOCOL_VERSION):
+    return b'H' + HELLO.pack(HELLO_MAGIC, version)
+
+def pack_command(command, payload=b''):
+    """One framed command; command is a one-letter string such as 'D'."""
+    return COMMAND_HEADER.pack(command.encode('utf-8'), len(payload)) + payload
+
+def pack_batch(commands):
+    """Several framed commands for a single send: list of (command, payload)."""
+    return b''.join(pack_command(command, payload) for command, payload in commands)
+
+def pack_g2(tau, curves):
+    """'G' reply: tau (s) and curves {(a, b): g2 array}."""
+    tau = np.asarray(tau, dtype='>f8')
+    parts = [G2_HEADER.pack(G2_MAGIC, len(curves), len(tau) if curves else 0)]
+    if curves:
+        parts.append(tau.tobytes())
+        for (a, b), values in curves.items():
+            parts.append(G2_PAIR.pack(a, b) + np.asarray(values, dtype='>f8').tobytes())
+    return b''.join(parts)
+
+def read_g2(sock):
+    """Client side of 'G': returns (tau, {(a, b): g2 array})."""
+    magic, n_pairs, n_lags = G2_HEADER.unpack(recv_exact(sock, G2_HEADER.size))
+    if magic != G2_MAGIC:
+        raise ValueError("Lost g2 framing")
+    if not n_pairs:
+        return np.empty(0), {}
+    tau = np.frombuffer(recv_exact(sock, 8 * n_lags), dtype='>f8').astype(float)
+    curves = {}
+    for _ in range(n_pairs):
+        pair = G2_PAIR.unpack(recv_exact(sock, G2_PAIR.size))
+        curves[pair] = np.frombuffer(recv_exact(sock, 8 * n_lags), dtype='>f8').astype(float)
+    return tau, curves
+
+def handshake(sock, version=PROTOCOL_VERSION):
+    """Client side: switches the connection to framed commands; returns the version used."""
+    sock.sendall(hello(version))
+    ok, version = HELLO_REPLY.unpack(recv_exact(sock, HELLO_REPLY.size))
+    if ok != b'OK':
+        raise ValueError("Handshake refused")
+    return version
+
+class CommandParser:
+    """
+    Splits the byte stream of one client into commands, without blocking:
+    feed() consumes the complete commands at the start of the buffer and
+    leaves a partial one for the next call. The first byte selects the
+    mode: b'H' starts the versioned handshake of the framed protocol, any
+    other command byte the legacy ASCII protocol.
+
+    Commands are returned as (command, args) in both modes:
+    ('H', version), ('M', n), ('P', (n_pixels, channel, marker)),
+    ('W', (starts, ends)), ('F', (starts, ends, bin_width, n_bins)) and
+    ('D' | 'S' | 'B' | 'U' | 'G', None).
+    Malformed input raises ValueError.
+    """
+    def __init__(self):
+        self.version = None                                                     # None: mode not known yet, 0: legacy
+
+    def feed(self, buf):
+        commands = []
+        while buf:
+            if self.version is None:
+                if buf[:1] == b'H':
+                    if len(buf) < 1 + HELLO.size:
+                        break
+                    magic, version = HELLO.unpack_from(buf, 1)
+                    if magic != HELLO_MAGIC:
+                        raise ValueError("Bad handshake")
+                    del buf[:1 + HELLO.size]
+                    if version < 1:
+                        raise ValueError(f"Unsupported protocol version {version}")
+                    self.version = min(version, PROTOCOL_VERSION)
+                    commands.append(('H', self.version))
+                    continue
+                self.version = 0
+            command = self.parse_framed(buf) if self.version else self.parse_legacy(buf)
+            if command is None:
+                break
+            commands.append(command)
+        return commands
+
+    def parse_framed(self, buf):
+        if len(buf) < COMMAND_HEADER.size:
+            return None
+        command, size = COMMAND_HEADER.unpack_from(buf)
+        if size > MAX_PAYLOAD:
+            raise ValueError("Command too long")
+        if len(buf) < COMMAND_HEADER.size + size:
+            return None
+        payload = bytes(buf[COMMAND_HEADER.size:COMMAND_HEADER.size + size])
+        del buf[:COMMAND_HEADER.size + size]
+        command = command.decode('utf-8')
+        check_payload(command, len(payload))
+        if command == 'M':
+            return command, M_ARG.unpack(payload)[0]
+        if command == 'P':
+            return command, PIXEL_ARGS.unpack(payload)
+        if command == 'W':
+            windows = np.frombuffer(payload, dtype='>f8').reshape(-1, 2)
+            return command, (windows[:, 0].astype(float), windows[:, 1].astype(float))
+        if command == 'F':
+            bin_width, n_bins = FLIM_ARGS.unpack(payload[:FLIM_ARGS.size])
+            windows = np.frombuffer(payload[FLIM_ARGS.size:], dtype='>f8').reshape(-1, 2)
+            return command, (windows[:, 0].astype(float), windows[:, 1].astype(float), bin_width, n_bins)
+        if command.encode('utf-8') not in COMMANDS:
+            raise ValueError(f"Unknown command {command!r}")
+        return command, None
+
+    def parse_legacy(self, buf):
+        while buf and buf[0] not in COMMANDS:                                   # stray bytes (e.g. newlines) are skipped
+            del buf[:1]
+        prefix = buf[:1]
+        if prefix in (b'M', b'P'):
+            end = buf.find(prefix, 1)
+            if end < 0:
+                return None
+            argument = buf[1:end].decode('utf-8')
+            del buf[:end + 1]
+            if prefix == b'M':
+                return 'M', int(argument.strip())
+            args = tuple(int(v) for v in argument.split(','))
+            if len(args) != 3:
+                raise ValueError(f"Expected n_pixels,channel,marker, got {argument!r}")
+            return 'P', args
+        if prefix == b'W':
+            request = unpack_windows(buf)
+            if request is None:
+                return None
+            starts, ends, size = request
+            del buf[:size]
+            return 'W', (starts, ends)
+        if prefix == b'F':
+            request = unpack_flim_windows(buf)
+            if request is None:
+                return None
+            del buf[:request[-1]]
+            return 'F', request[:-1]
+        if not prefix:
+            return None
+        del buf[:1]
+        return prefix.decode('utf-8'), None
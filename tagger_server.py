@@ -0,0 +1,239 @@
+import collections
+import selectors
+import socket
+import threading
+
+RESUME = 0                                                                      # service() mask: run on_data again without reading
+
+class ClientConnection:
+    """
+    State of one client of the TimeTagger server. Received bytes are kept in
+    inbuf until a command is complete; output goes to a send buffer that the
+    server loop flushes when the socket is writable, so a slow client never
+    blocks the server, the acquisition or the other clients.
+
+    The send buffer is bounded for pushed data (stream frames): while more
+    than max_buffer bytes are waiting, new pushed frames are dropped for this
+    client only (counted in 'dropped'). Replies to commands are always queued.
+
+    Parameters
+    sock       : connected non-blocking socket
+    addr       : peer address
+    max_buffer : bytes allowed in the send buffer before pushed data is dropped
+    """
+    def __init__(self, sock, addr, max_buffer=1 << 20):
+        self.sock = sock
+        self.addr = addr
+        self.max_buffer = max_buffer
+        self.inbuf = bytearray()
+        self.outbuf = collections.deque()
+        self.out_size = 0
+        self.lock = threading.RLock()                                           # Held by other threads while they push to this client
+        self.subscribed = False                                                 # count stream ('B')
+        self.seq = 0
+        self.dropped = 0
+        self.windows = []                                                       # pending 'W' and 'F' requests
+        self.parser = None                                                      # command parser, set by the application
+        self.commands = collections.deque()                                     # parsed commands not run yet
+        self.busy = False                                                       # a command runs in the background; the next ones wait
+        self.resumed = False
+        self.closed = False
+
+    def send(self, data, push=False):
+        """Queues data; returns False if pushed data was dropped because the buffer is full."""
+        with self.lock:
+            if self.closed:
+                return False
+            if push and self.out_size > self.max_buffer:
+                self.dropped += 1
+                return False
+            self.outbuf.append(bytes(data))
+            self.out_size += len(data)
+            return True
+
+    def pending(self):
+        return self.out_size > 0
+
+    def flush(self):
+        """Sends as much of the buffer as the socket takes without blocking."""
+        with self.lock:
+            if len(self.outbuf) > 1:
+                self.outbuf = collections.deque([b''.join(self.outbuf)])        # replies of a batch go out in one send
+            while self.outbuf:
+                data = self.outbuf[0]
+                try:
+                    sent = self.sock.send(data)
+                except BlockingIOError:
+                    return
+                self.out_size -= sent
+                if sent < len(data):
+                    self.outbuf[0] = data[sent:]
+                    return
+                self.outbuf.popleft()
+
+class TaggerServer:
+    """
+    TCP server of the TimeTagger app built on selectors: a single thread
+    accepts any number of clients, reads their commands and flushes their
+    send buffers, so one stuck client cannot hold up the others.
+
+    Other threads (count stream, photon reader) queue output with
+    ClientConnection.send() and call wake() so it goes out immediately.
+
+    Parameters
+    host, port : address to listen on
+    on_data    : callback(conn) after bytes were added to conn.inbuf (or after resume()); consumes the complete commands
+    on_close   : callback(conn) when a client is gone
+    on_tick    : callback() on every loop iteration, at most 'interval' s apart
+    interval   : selector timeout (s)
+    max_buffer : send buffer bound of each client (see ClientConnection)
+    """
+    def __init__(self, host, port, on_data, on_close=None, on_tick=None, interval=0.005, max_buffer=1 << 20):
+        self.host = host
+        self.port = port
+        self.on_data = on_data
+        self.on_close = on_close
+        self.on_tick = on_tick
+        self.interval = interval
+        self.max_buffer = max_buffer
+        self.selector = selectors.DefaultSelector()
+        self.clients = {}
+        self.clients_lock = threading.Lock()
+        self.accepting = True
+        self.running = False
+        self.thread = None
+        self.listener = None
+        self.wake_recv, self.wake_send = socket.socketpair()
+
+    def start(self):
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((self.host, self.port))
+        self.listener.listen(5)
+        self.listener.setblocking(False)
+        self.wake_recv.setblocking(False)
+        self.wake_send.setblocking(False)
+        self.selector.register(self.listener, selectors.EVENT_READ, None)
+        self.selector.register(self.wake_recv, selectors.EVENT_READ, None)
+        self.running = True
+        self.thread = threading.Thread(target=self.loop, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.wake()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        for conn in self.connections():
+            self.close(conn)
+        self.selector.close()
+        self.listener.close()
+
+    def set_accepting(self, accepting):
+        """Allows or refuses new clients; refusing also disconnects the current ones."""
+        self.accepting = accepting
+        if not accepting:
+            for conn in self.connections():
+                conn.closed = True
+            self.wake()
+
+    def connections(self):
+        with self.clients_lock:
+            return list(self.clients.values())
+
+    def wake(self):
+        """Makes the loop flush the send buffers now (thread-safe)."""
+        try:
+            self.wake_send.send(b'\0')
+        except (BlockingIOError, OSError):
+            pass                                                                # a wake-up is already pending
+
+    def resume(self, conn):
+        """Makes the loop call on_data again for conn, e.g. once a background command is done (thread-safe)."""
+        conn.resumed = True
+        self.wake()
+
+    def loop(self):
+        while self.running:
+            for conn in self.connections():
+                if conn.closed:
+                    self.close(conn)
+                    continue
+                if conn.resumed:
+                    conn.resumed = False
+                    self.service(conn, RESUME)
+                    if conn.closed:
+                        continue
+                if conn.pending():
+                    self.service(conn, selectors.EVENT_WRITE)                   # send what was queued by other threads right away
+                    if conn.closed:
+                        continue
+                events = selectors.EVENT_READ | (selectors.EVENT_WRITE if conn.pending() else 0)
+                if self.selector.get_key(conn.sock).events != events:
+                    self.selector.modify(conn.sock, events, conn)
+            for key, mask in self.selector.select(self.interval):
+                if key.fileobj is self.listener:
+                    self.accept()
+                elif key.fileobj is self.wake_recv:
+                    try:
+                        self.wake_recv.recv(4096)
+                    except BlockingIOError:
+                        pass
+                else:
+                    self.service(key.data, mask)
+            if self.on_tick is not None:
+                try:
+                    self.on_tick()
+                except Exception as e:
+                    print(f"Server tick error: {e}")
+
+    def accept(self):
+        try:
+            sock, addr = self.listener.accept()
+        except BlockingIOError:
+            return
+        if not self.accepting:
+            sock.close()
+            return
+        print(f"Connection from {addr}")
+        sock.setblocking(False)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        conn = ClientConnection(sock, addr, self.max_buffer)
+        with self.clients_lock:
+            self.clients[sock] = conn
+        self.selector.register(sock, selectors.EVENT_READ, conn)
+
+    def service(self, conn, mask):
+        try:
+            if mask & selectors.EVENT_READ:
+                data = conn.sock.recv(65536)
+                if not data:
+                    print("Client disconnected")
+                    self.close(conn)
+                    return
+                conn.inbuf.extend(data)
+            if mask & selectors.EVENT_READ or mask == RESUME:
+                self.on_data(conn)
+                conn.flush()                                                    # replies go out without waiting for the next select
+            elif mask & selectors.EVENT_WRITE:
+                conn.flush()
+        except (ConnectionResetError, BrokenPipeError, OSError, ValueError) as e:
+            print(f"Client error: {e}")
+            self.close(conn)
+        except Exception as e:                                                  # a failing handler drops its client, never the server loop
+            print(f"Client handler error: {e!r}")
+            self.close(conn)
+
+    def close(self, conn):
+        with self.clients_lock:
+            if self.clients.pop(conn.sock, None) is None:
+                return
+        conn.closed = True
+        try:
+            self.selector.unregister(conn.sock)
+        except (KeyError, ValueError):
+            pass
+        conn.sock.close()
+        if self.on_close is not None:
+            self.on_close(conn)
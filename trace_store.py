@@ -0,0 +1,165 @@
+import threading
+import time
+import numpy as np
+
+class TraceRing:
+    """
+    Fixed-size ring buffer of time-trace bins (bin times and counts per
+    channel). Every bin is written twice, at i and i + capacity, so the last
+    n bins are always one contiguous slice: window() returns views, not
+    copies. A view stays valid until capacity - n further bins have been
+    appended; copy it to keep it longer.
+
+    Parameters
+    capacity   : number of bins kept
+    n_channels : number of channels (rows of the counts)
+    """
+    def __init__(self, capacity, n_channels):
+        self.capacity = capacity
+        self.n_channels = n_channels
+        self.times = np.zeros(2 * capacity)
+        self.counts = np.zeros((n_channels, 2 * capacity))
+        self.head = 0                                                           # index of the next bin, in [0, capacity)
+        self.size = 0
+        self.total = 0                                                          # bins appended since the last reset
+
+    def reset(self):
+        self.head = 0
+        self.size = 0
+        self.total = 0
+
+    def append(self, times, counts):
+        """Appends bins: times (n,), counts (n_channels, n)."""
+        n = len(times)
+        if n > self.capacity:
+            times, counts = times[-self.capacity:], counts[:, -self.capacity:]
+            self.total += n - self.capacity
+            n = self.capacity
+        index = (self.head + np.arange(n)) % self.capacity
+        for offset in (0, self.capacity):
+            self.times[index + offset] = times
+            self.counts[:, index + offset] = counts
+        self.head = (self.head + n) % self.capacity
+        self.size = min(self.size + n, self.capacity)
+        self.total += n
+
+    def latest(self, channel):
+        """Count of the last bin of a channel, O(1)."""
+        if not self.size:
+            return 0.0
+        return self.counts[channel, self.head + self.capacity - 1]
+
+    def window(self, n=None):
+        """Views (times, counts) of the last n bins (all kept bins if n is None)."""
+        n = self.size if n is None else min(n, self.size)
+        end = self.head + self.capacity
+        return self.times[end - n:end], self.counts[:, end - n:end]
+
+class TimeTraceStore:
+    """
+    Background acquisition of sn.timeTrace: one thread polls getData() and
+    appends only the bins it has not seen yet to a TraceRing, so plotting,
+    saving and the TCP server read the same buffer instead of each copying
+    the whole history. A restart of the measurement (bin times going back)
+    clears the ring.
+
+    The store runs only while a time trace is measured: start() with the
+    measurement, stop() when it ends (stop() reads the last bins). snAPI
+    only hands out the whole history, so each poll locates the first new
+    bin in the sorted bin times and converts just the tail after it. The
+    poll period is half a bin but at least 'interval', so a poll brings
+    several short bins at once; it backs off to 'idle' once no new bin has
+    arrived for a few bin widths (acquisition time over).
+
+    Parameters
+    time_trace : sn.timeTrace of the snAPI instance
+    capacity   : number of bins kept per channel
+    n_channels : rows of getData() counts (Sync and the inputs)
+    interval   : shortest poll period (s)
+    idle       : poll period while the trace is not running (s)
+    """
+    def __init__(self, time_trace, capacity=100000, n_channels=5, interval=0.02, idle=0.1):
+        self.time_trace = time_trace
+        self.capacity = capacity
+        self.n_channels = n_channels
+        self.interval = interval
+        self.idle = idle
+        self.ring = None
+        self.lock = threading.Lock()
+        self.bin_width = 0.0
+        self.wall_offset = 0.0                                                  # wall clock minus measurement time (s)
+        self.last_time = None
+        self.last_new = 0.0                                                     # time.time() of the last new bin
+        self.listeners = []
+        self.running = False
+        self.thread = None
+
+    def add_listener(self, func):
+        """func(times, counts, bin_width, wall_offset) is called with the new bins, from the acquisition thread."""
+        self.listeners.append(func)
+
+    def start(self):
+        if self.thread is None:
+            self.running = True
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+            try:
+                self.poll()                                                     # bins completed since the last poll
+            except Exception as e:
+                print(f"Time trace error: {e}")
+
+    def run(self):
+        while self.running:
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"Time trace error: {e}")
+            active = time.time() - self.last_new < max(4 * self.bin_width, self.idle)
+            time.sleep(max(self.bin_width / 2, self.interval) if active else self.idle)
+
+    def poll(self):
+        """Reads the trace once and appends the new bins; returns True if there were any."""
+        counts, times = self.time_trace.getData()
+        times = np.asarray(times)                                               # no copy of the history
+        if len(times) < 2:
+            return False
+        counts = np.asarray(counts)
+        bin_width = float(times[1] - times[0])
+        wall_offset = time.time() - (float(times[-1]) + bin_width)              # The last bin has just been completed
+        with self.lock:
+            if self.ring is None or self.ring.n_channels != counts.shape[0]:
+                self.ring = TraceRing(self.capacity, counts.shape[0])
+                self.last_time = None
+            if self.last_time is not None and times[-1] < self.last_time:
+                self.ring.reset()                                               # Measurement restarted
+                self.last_time = None
+            first = 0 if self.last_time is None else int(np.searchsorted(times, self.last_time + bin_width / 2))
+            if first >= len(times):
+                return False
+            new_times = times[first:].astype(float)
+            new_counts = counts[:, first:].astype(float)
+            self.ring.append(new_times, new_counts)
+            self.last_time = new_times[-1]
+            self.bin_width = bin_width
+            self.wall_offset = wall_offset
+            self.last_new = time.time()
+        for func in self.listeners:
+            func(new_times, new_counts, bin_width, wall_offset)
+        return True
+
+    def latest(self, channel=1):
+        with self.lock:
+            return self.ring.latest(channel) if self.ring is not None else 0.0
+
+    def window(self, n=None):
+        """Views (times, counts) of the last n bins; empty arrays before the first poll."""
+        with self.lock:
+            if self.ring is None:
+                return np.empty(0), np.empty((self.n_channels, 0))
+            return self.ring.window(n)
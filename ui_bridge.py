@@ -0,0 +1,55 @@
+import queue
+
+class UIBridge:
+    """
+    Hands GUI work from worker threads (scan, polarization, PM16, stepper)
+    to the Tk main loop. post() only puts the call on a lock-free
+    queue.SimpleQueue, so a worker never waits for the GUI; the main loop
+    drains the queue in batches every 'interval' ms and runs the calls in
+    the order they were posted.
+
+    Parameters
+    root     : Tk root (or any widget) whose after() drives the bridge
+    interval : drain period (ms)
+    batch    : maximum number of calls run per drain, so a burst of events
+               cannot freeze the GUI
+    """
+    def __init__(self, root, interval=20, batch=500):
+        self.root = root
+        self.interval = interval
+        self.batch = batch
+        self.calls = queue.SimpleQueue()
+        self.after_id = None
+
+    def post(self, func, *args, **kwargs):
+        """Runs func(*args, **kwargs) on the main loop. Safe to call from any thread."""
+        self.calls.put((func, args, kwargs))
+
+    def set(self, variable, value):
+        """Sets a Tk variable (StringVar, DoubleVar, ...) from any thread."""
+        self.calls.put((variable.set, (value,), {}))
+
+    def start(self):
+        if self.after_id is None:
+            self.tick()
+
+    def stop(self):
+        if self.after_id is not None:
+            self.root.after_cancel(self.after_id)
+            self.after_id = None
+
+    def tick(self):
+        self.drain()
+        self.after_id = self.root.after(self.interval, self.tick)
+
+    def drain(self):
+        """Runs up to 'batch' posted calls; the rest wait for the next tick."""
+        for _ in range(self.batch):
+            try:
+                func, args, kwargs = self.calls.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                func(*args, **kwargs)
+            except Exception as e:
+                print(f"UI update error: {e}")